@@ -0,0 +1,512 @@
+"""
+Координатор распределенного рендера через Redis (брокер из docker-compose.yml).
+
+Единицы рендера из planner.py (продукт x модель x камера x часть x материал)
+раскладываются по очередям моделей. Нода берет единицы в аренду (lease) с TTL и
+продлевает аренду heartbeat'ами; аренда упавшей ноды истекает и единицы
+возвращаются в очередь. Нода в первую очередь берет единицы модели, которая
+у нее уже загружена.
+
+Ключи Redis (префикс render:):
+    units             hash   id -> json единицы
+    pending:<model>   set    id ожидающих единиц модели (<pk>:<model_n>)
+    models            set    модели с ожидающими единицами
+    leases            zset   id -> время окончания аренды
+    owners            hash   id -> нода
+    done              set    id готовых единиц
+    nodes             hash   нода -> время последнего heartbeat
+    node_models       hash   нода -> загруженная модель
+
+Аренда, продление, завершение и возврат единиц - Lua-скрипты: между spop и
+записью аренды нода может упасть, а аренду, истекшую и отданную другой ноде,
+прежняя нода не должна ни продлить, ни снять.
+
+Запуск:
+    python coordinator.py submit 12,13 [--preset draft] [--redis redis://localhost:6379/1]
+    python coordinator.py status
+    python coordinator.py simulate --redis memory --nodes 4 --units 400 --crash 0.02 [--ttl 0.5]
+"""
+import json
+import multiprocessing
+import os
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+
+from planner import RenderUnit
+
+PREFIX = 'render:'
+LEASE_TTL = 120
+# В симуляции единица рендерится миллисекунды - аренда по умолчанию короткая
+SIMULATE_TTL = 0.5
+REDIS_URL = os.environ.get('RENDER_REDIS_URL', 'redis://localhost:6379/1')
+
+
+def unit_id(unit):
+    return unit.id
+
+
+def model_key(unit):
+    return '%d:%d' % (unit.pk, unit.model_n)
+
+
+def unit_model(uid):
+    # id единицы начинается с <pk>:<model_n>
+    return ':'.join(uid.split(':')[:2])
+
+
+# KEYS: pending, leases, owners, models; ARGV: count, expires, node, model
+LEASE_SCRIPT = """
+local ids = redis.call('SPOP', KEYS[1], ARGV[1])
+for _, id in ipairs(ids) do
+    redis.call('ZADD', KEYS[2], ARGV[2], id)
+    redis.call('HSET', KEYS[3], id, ARGV[3])
+end
+if #ids == 0 and redis.call('SCARD', KEYS[1]) == 0 then
+    redis.call('SREM', KEYS[4], ARGV[4])
+end
+return ids
+"""
+
+# KEYS: leases, owners; ARGV: node, expires, id...
+EXTEND_SCRIPT = """
+local extended = 0
+for i = 3, #ARGV do
+    if redis.call('HGET', KEYS[2], ARGV[i]) == ARGV[1] then
+        redis.call('ZADD', KEYS[1], ARGV[2], ARGV[i])
+        extended = extended + 1
+    end
+end
+return extended
+"""
+
+# KEYS: leases, owners, done; ARGV: node, id...
+COMPLETE_SCRIPT = """
+local completed = 0
+for i = 2, #ARGV do
+    if redis.call('HGET', KEYS[2], ARGV[i]) == ARGV[1] then
+        redis.call('ZREM', KEYS[1], ARGV[i])
+        redis.call('HDEL', KEYS[2], ARGV[i])
+        completed = completed + 1
+    end
+    redis.call('SADD', KEYS[3], ARGV[i])
+end
+return completed
+"""
+
+# KEYS: leases, owners, pending, models; ARGV: id, now, model
+REAP_SCRIPT = """
+local expires = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if not expires or tonumber(expires) > tonumber(ARGV[2]) then
+    return false
+end
+redis.call('ZREM', KEYS[1], ARGV[1])
+local owner = redis.call('HGET', KEYS[2], ARGV[1])
+redis.call('HDEL', KEYS[2], ARGV[1])
+redis.call('SADD', KEYS[3], ARGV[1])
+redis.call('SADD', KEYS[4], ARGV[3])
+return owner or ''
+"""
+
+
+def memory_lease(redis, keys, args):
+    ids = redis.spop(keys[0], int(args[0]))
+    for i in ids:
+        redis.zadd(keys[1], {i: float(args[1])})
+        redis.hset(keys[2], i, args[2])
+    if not ids and not redis.scard(keys[0]):
+        redis.srem(keys[3], args[3])
+    return ids
+
+
+def memory_extend(redis, keys, args):
+    owned = [i for i in args[2:] if redis.hget(keys[1], i) == args[0]]
+    redis.zadd(keys[0], {i: float(args[1]) for i in owned})
+    return len(owned)
+
+
+def memory_complete(redis, keys, args):
+    completed = 0
+    for i in args[1:]:
+        if redis.hget(keys[1], i) == args[0]:
+            redis.zrem(keys[0], i)
+            redis.hdel(keys[1], i)
+            completed += 1
+        redis.sadd(keys[2], i)
+    return completed
+
+
+def memory_reap(redis, keys, args):
+    expires = redis.zscore(keys[0], args[0])
+    if expires is None or expires > float(args[1]):
+        return None
+    redis.zrem(keys[0], args[0])
+    owner = redis.hget(keys[1], args[0])
+    redis.hdel(keys[1], args[0])
+    redis.sadd(keys[2], args[0])
+    redis.sadd(keys[3], args[2])
+    return owner or ''
+
+
+MEMORY_SCRIPTS = {
+    LEASE_SCRIPT: memory_lease,
+    EXTEND_SCRIPT: memory_extend,
+    COMPLETE_SCRIPT: memory_complete,
+    REAP_SCRIPT: memory_reap,
+}
+
+
+class MemoryRedis:
+    """Замена Redis в одном процессе: только команды, нужные координатору"""
+
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.RLock()
+
+    def _get(self, name, factory):
+        return self.data.setdefault(name, factory())
+
+    def delete(self, *names):
+        with self.lock:
+            for name in names:
+                self.data.pop(name, None)
+
+    def hset(self, name, key=None, value=None, mapping=None):
+        with self.lock:
+            h = self._get(name, dict)
+            if key is not None:
+                h[key] = value
+            h.update(mapping or {})
+
+    def hget(self, name, key):
+        with self.lock:
+            return self.data.get(name, {}).get(key)
+
+    def hmget(self, name, keys):
+        with self.lock:
+            h = self.data.get(name, {})
+            return [h.get(k) for k in keys]
+
+    def hgetall(self, name):
+        with self.lock:
+            return dict(self.data.get(name, {}))
+
+    def hdel(self, name, *keys):
+        with self.lock:
+            h = self.data.get(name, {})
+            return sum(h.pop(k, None) is not None for k in keys)
+
+    def sadd(self, name, *values):
+        with self.lock:
+            s = self._get(name, set)
+            added = len(set(values) - s)
+            s.update(values)
+            return added
+
+    def srem(self, name, *values):
+        with self.lock:
+            s = self.data.get(name, set())
+            removed = len(s & set(values))
+            s.difference_update(values)
+            return removed
+
+    def spop(self, name, count=None):
+        with self.lock:
+            s = self.data.get(name, set())
+            values = [s.pop() for _ in range(min(1 if count is None else count, len(s)))]
+            return values if count is not None else (values[0] if values else None)
+
+    def smembers(self, name):
+        with self.lock:
+            return set(self.data.get(name, set()))
+
+    def scard(self, name):
+        with self.lock:
+            return len(self.data.get(name, set()))
+
+    def zadd(self, name, mapping, xx=False):
+        with self.lock:
+            z = self._get(name, dict)
+            for key, score in mapping.items():
+                if not xx or key in z:
+                    z[key] = score
+
+    def zrem(self, name, *keys):
+        with self.lock:
+            z = self.data.get(name, {})
+            return sum(z.pop(k, None) is not None for k in keys)
+
+    def zrangebyscore(self, name, min_score, max_score):
+        with self.lock:
+            z = self.data.get(name, {})
+            low = float(min_score) if min_score != '-inf' else float('-inf')
+            return sorted((k for k, v in z.items() if low <= v <= float(max_score)), key=z.get)
+
+    def zcard(self, name):
+        with self.lock:
+            return len(self.data.get(name, {}))
+
+    def zscore(self, name, key):
+        with self.lock:
+            return self.data.get(name, {}).get(key)
+
+    def register_script(self, script):
+        # Скрипт выполняется целиком под блокировкой, как Lua в Redis
+        func = MEMORY_SCRIPTS[script]
+
+        def run(keys=(), args=()):
+            with self.lock:
+                return func(self, list(keys), [str(a) for a in args])
+        return run
+
+
+def connect(url=REDIS_URL):
+    if url == 'memory':
+        return MemoryRedis()
+
+    import redis
+    return redis.Redis.from_url(url, decode_responses=True)
+
+
+class Coordinator:
+    def __init__(self, redis, ttl=LEASE_TTL):
+        self.redis = redis
+        self.ttl = ttl
+        self.lease_script = redis.register_script(LEASE_SCRIPT)
+        self.extend_script = redis.register_script(EXTEND_SCRIPT)
+        self.complete_script = redis.register_script(COMPLETE_SCRIPT)
+        self.reap_script = redis.register_script(REAP_SCRIPT)
+
+    def key(self, name):
+        return PREFIX + name
+
+    def submit(self, units):
+        if not units:
+            return 0
+
+        self.redis.hset(self.key('units'), mapping={unit_id(u): json.dumps(u.to_dict()) for u in units})
+        by_model = defaultdict(list)
+        for unit in units:
+            by_model[model_key(unit)].append(unit_id(unit))
+        for model, ids in by_model.items():
+            self.redis.sadd(self.key('pending:' + model), *ids)
+            self.redis.sadd(self.key('models'), model)
+        return len(units)
+
+    def choose_model(self, node, prefer=None):
+        if prefer and self.redis.scard(self.key('pending:' + prefer)):
+            return prefer
+
+        models = self.redis.smembers(self.key('models'))
+        if not models:
+            return None
+
+        # Модель, на которой работает меньше всего нод: остальные ноды ее не загружали
+        busy = Counter(m for n, m in self.redis.hgetall(self.key('node_models')).items() if n != node)
+        return min(models, key=lambda m: (busy[m], -self.redis.scard(self.key('pending:' + m))))
+
+    def lease(self, node, prefer=None, count=8):
+        """Аренда до count единиц одной модели, prefer - загруженная на ноде модель"""
+        self.reap()
+
+        while True:
+            model = self.choose_model(node, prefer)
+            if model is None:
+                return []
+
+            # spop и запись аренды одним скриптом: единица не теряется, если нода упадет между ними
+            # Опустевшая очередь модели убирается из models в том же скрипте: reap или submit,
+            # пополнившие ее между spop и srem, не потеряют единицы
+            ids = self.lease_script(keys=[self.key('pending:' + model), self.key('leases'), self.key('owners'),
+                                          self.key('models')],
+                                    args=[count, time.time() + self.ttl, node, model])
+            if ids:
+                break
+            prefer = None
+
+        self.redis.hset(self.key('node_models'), node, model)
+        self.heartbeat(node)
+
+        data = self.redis.hmget(self.key('units'), ids)
+        return [RenderUnit.from_dict(json.loads(d)) for d in data if d]
+
+    def heartbeat(self, node, units=()):
+        self.redis.hset(self.key('nodes'), node, time.time())
+        if units:
+            # Продлеваются только свои аренды: истекшую единицу могла забрать другая нода
+            return self.extend_script(keys=[self.key('leases'), self.key('owners')],
+                                      args=[node, time.time() + self.ttl] + [unit_id(u) for u in units])
+        return 0
+
+    def complete(self, node, units):
+        """Число единиц, аренда которых еще была у ноды; готовыми отмечаются все"""
+        ids = [unit_id(u) for u in units]
+        completed = self.complete_script(keys=[self.key('leases'), self.key('owners'), self.key('done')],
+                                         args=[node] + ids)
+        self.heartbeat(node)
+        return completed
+
+    def release_node(self, node):
+        self.redis.hdel(self.key('nodes'), node)
+        self.redis.hdel(self.key('node_models'), node)
+
+    def reap(self, now=None):
+        """Возвращает в очередь единицы с истекшей арендой"""
+        now = now or time.time()
+        expired = self.redis.zrangebyscore(self.key('leases'), '-inf', now)
+        reassigned = 0
+        for i in expired:
+            # Скрипт заново проверяет срок: аренду могли продлить или завершить после zrangebyscore
+            model = unit_model(i)
+            owner = self.reap_script(keys=[self.key('leases'), self.key('owners'), self.key('pending:' + model),
+                                           self.key('models')], args=[i, now, model])
+            if owner is None:
+                continue
+            if owner:
+                self.release_node(owner)
+            reassigned += 1
+
+        if reassigned:
+            print('Reassigned %d units with expired leases' % reassigned)
+        return reassigned
+
+    def status(self):
+        models = self.redis.smembers(self.key('models'))
+        return {
+            'pending': sum(self.redis.scard(self.key('pending:' + m)) for m in models),
+            'leased': self.redis.zcard(self.key('leases')),
+            'done': self.redis.scard(self.key('done')),
+            'nodes': len(self.redis.hgetall(self.key('nodes'))),
+        }
+
+    def is_finished(self):
+        status = self.status()
+        return status['pending'] == 0 and status['leased'] == 0
+
+    def clear(self):
+        names = ['units', 'models', 'leases', 'owners', 'done', 'nodes', 'node_models']
+        models = self.redis.smembers(self.key('models'))
+        self.redis.delete(*[self.key(n) for n in names], *[self.key('pending:' + m) for m in models])
+
+
+def simulate_node(coordinator, node, crash, batch, stats):
+    loaded = None
+    while True:
+        units = coordinator.lease(node, loaded, batch)
+        if not units:
+            if coordinator.is_finished():
+                return
+            time.sleep(0.01)
+            continue
+
+        model = model_key(units[0])
+        if model != loaded:
+            stats['model_loads'] += 1
+            loaded = model
+            time.sleep(0.02)
+
+        for unit in units:
+            if random.random() < crash:
+                # Нода "упала": аренда не продлевается и истечет, нода перезапускается без модели
+                stats['crashes'] += 1
+                loaded = None
+                break
+            time.sleep(unit.cost / 1000)
+            coordinator.heartbeat(node, units)
+        else:
+            coordinator.complete(node, units)
+            stats['rendered'] += len(units)
+
+
+def fake_units(count, models=6, pk=1):
+    return [RenderUnit(pk=pk, model_n=n % models + 1, camera_n=n % 3 + 1, blender_name='part_%d' % (n % 4),
+                       material=str(n), scene_material=n, obj_url='', camera={}, cost=random.uniform(5, 15))
+            for n in range(count)]
+
+
+def simulate_process(url, node, crash, batch, ttl, results):
+    stats = Counter()
+    simulate_node(Coordinator(connect(url), ttl=ttl), node, crash, batch, stats)
+    print(node, dict(stats))
+    results.put(dict(stats))
+
+
+def simulate(url, nodes, units, crash, batch, ttl):
+    """memory - ноды потоками в одном процессе, иначе отдельные процессы с общим Redis"""
+    redis = connect(url)
+    coordinator = Coordinator(redis, ttl=ttl)
+    coordinator.clear()
+    coordinator.submit(fake_units(units))
+
+    stats = Counter()
+    start_time = time.time()
+    if url == 'memory':
+        workers = [threading.Thread(target=simulate_node, args=(coordinator, 'node-%d' % n, crash, batch, stats))
+                   for n in range(nodes)]
+    else:
+        # Счетчики нод живут в дочерних процессах - собираем их через очередь
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=simulate_process,
+                                           args=(url, 'node-%d' % n, crash, batch, ttl, results))
+                   for n in range(nodes)]
+    for worker in workers:
+        worker.start()
+    if url != 'memory':
+        for _ in workers:
+            stats.update(results.get())
+    for worker in workers:
+        worker.join()
+
+    print(f"Simulated {units} units on {nodes} nodes in {time.time() - start_time:.2f}s: "
+          f"{stats['rendered']} rendered, {stats['crashes']} crashes, {stats['model_loads']} model loads, "
+          f"status {coordinator.status()}")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['submit', 'status', 'clear', 'simulate'])
+    parser.add_argument('ids', nargs='?', default='')
+    parser.add_argument('--redis', default=REDIS_URL, help='URL Redis или memory')
+    parser.add_argument('--preset', default=None)
+    parser.add_argument('--nodes', type=int, default=4)
+    parser.add_argument('--units', type=int, default=400)
+    parser.add_argument('--crash', type=float, default=0.02)
+    parser.add_argument('--batch', type=int, default=8)
+    parser.add_argument('--ttl', type=float, default=None,
+                        help='аренда в секундах, по умолчанию %d (simulate: %s)' % (LEASE_TTL, SIMULATE_TTL))
+    args = parser.parse_args()
+
+    if args.command == 'simulate':
+        simulate(args.redis, args.nodes, args.units, args.crash, args.batch,
+                 SIMULATE_TTL if args.ttl is None else args.ttl)
+        return
+
+    coordinator = Coordinator(connect(args.redis), ttl=args.ttl or LEASE_TTL)
+    if args.command == 'submit':
+        os.environ['RENDER_IDS'] = args.ids
+        os.environ.setdefault('RENDER_MAKE', 'y')
+        os.environ.setdefault('RENDER_WRITE_ANYWAY', 'n')
+
+        from planner import plan_product
+        from settings import domain, ids, media_path, filter_parts, write_anyway, render_preset, \
+            composite_flat_colors
+        from utils.payload import fetch_product
+
+        for pk in ids:
+            data = fetch_product(domain, pk)
+            if data is None:
+                continue
+            units = plan_product(data, pk, media_path, filter_parts, write_anyway, args.preset or render_preset,
+                                 composite_flat_colors)
+            print('Product %d: %d units submitted' % (pk, coordinator.submit(units)))
+    elif args.command == 'clear':
+        coordinator.clear()
+
+    print(coordinator.status())
+
+
+if __name__ == '__main__':
+    main()
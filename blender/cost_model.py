@@ -0,0 +1,311 @@
+"""
+Модель времени рендера кадра по истории (media/cache/timings.jsonl).
+
+Рендер пишет в журнал время каждого отрендеренного кадра вместе с признаками
+сцены (utils/timing_log.py). Модель - линейная регрессия на логарифме времени:
+время растет мультипликативно от пикселей, сэмплов и треугольников, тип
+материала и пакетный рендер дают множители. Поправка Дуана (smearing) убирает
+занижение при переходе обратно из логарифма.
+
+Треугольники известны только после загрузки модели в Blender, поэтому при
+обучении сохраняется таблица obj_url / часть -> треугольники; для новых
+моделей берется медиана.
+
+Модель не экстраполирует: если в журнале только final, признаки пикселей и
+сэмплов постоянны, их веса нулевые, и draft получил бы время final. Поэтому
+модель запоминает пары (пиксели, сэмплы) и режимы рендера из журнала, а для
+остальных кадров predict возвращает None - планировщик оставляет FRAME_COST.
+
+Модель подхватывает planner.py: RenderUnit.cost, а через него ETA задач
+(utils/progress.py) и дедлайны очереди (project/scheduler.py).
+
+Без bpy и numpy:
+    python cost_model.py train [--timings media/cache/timings.jsonl]
+    python cost_model.py bench [--holdout-preset draft] [--synthetic 2000]
+
+bench --synthetic проверяет только обучение: синтетический журнал построен по
+той же лог-линейной форме, что и модель, поэтому ошибка на нем ничего не
+говорит о точности на рендер-ферме - ее показывает bench по настоящему журналу.
+--holdout-preset убирает пресет из обучения и проверяет кадры только этого
+пресета: без пресета в журнале модель должна уступать место FRAME_COST.
+"""
+import json
+import math
+import os
+import random
+from statistics import median
+
+from utils.presets import get_preset
+from utils.timing_log import TIMINGS_PATH, load_timings
+
+MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'media', 'cache', 'cost_model.json')
+FEATURES = ('bias', 'log_pixels', 'log_samples', 'log_triangles', 'log_scene_triangles',
+            'textured', 'bump', 'displacement', 'unknown', 'log_batch', 'composite')
+MIN_RECORDS = 30
+RIDGE = 1e-3
+
+
+def feature_vector(record):
+    return [
+        1.0,
+        math.log(record['pixels']),
+        math.log(record['samples']),
+        math.log1p(record['triangles'] / 1000),
+        math.log1p(record['scene_triangles'] / 1000),
+        float(record['kind'] == 'textured'),
+        float(record['kind'] == 'bump'),
+        float(record['kind'] == 'displacement'),
+        float(record['kind'] == 'unknown'),
+        math.log(max(record.get('batch', 1), 1)),
+        float(record.get('mode') == 'composite'),
+    ]
+
+
+def solve(a, b):
+    # Гаусс с выбором главного элемента, матрица маленькая (len(FEATURES))
+    n = len(b)
+    m = [row[:] + [b[i]] for i, row in enumerate(a)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(m[r][col]))
+        m[col], m[pivot] = m[pivot], m[col]
+        if abs(m[col][col]) < 1e-12:
+            continue
+        for r in range(n):
+            if r != col:
+                factor = m[r][col] / m[col][col]
+                m[r] = [x - factor * y for x, y in zip(m[r], m[col])]
+    return [m[i][n] / m[i][i] if abs(m[i][i]) >= 1e-12 else 0.0 for i in range(n)]
+
+
+class CostModel:
+    def __init__(self, weights, smearing=1.0, triangles=None, trained_on=0, presets=None, modes=None):
+        self.weights = weights
+        self.smearing = smearing
+        self.triangles = triangles or {}
+        self.trained_on = trained_on
+        # [пиксели, сэмплы] и режимы рендера, которые были в журнале
+        self.presets = presets or []
+        self.modes = modes or []
+
+    @classmethod
+    def train(cls, records, ridge=RIDGE):
+        """Ридж-регрессия log(render_time) по признакам, нормальные уравнения"""
+        x = [feature_vector(r) for r in records]
+        y = [math.log(r['render_time']) for r in records]
+        n = len(FEATURES)
+
+        xtx = [[sum(row[i] * row[j] for row in x) + (ridge * len(x) if i == j and i else 0.0) for j in range(n)]
+               for i in range(n)]
+        xty = [sum(row[i] * t for row, t in zip(x, y)) for i in range(n)]
+        weights = solve(xtx, xty)
+
+        residuals = [t - sum(w * v for w, v in zip(weights, row)) for row, t in zip(x, y)]
+        smearing = sum(math.exp(r) for r in residuals) / len(residuals)
+        presets = sorted({(r['pixels'], r['samples']) for r in records})
+        modes = sorted({record_mode(r) for r in records})
+        return cls(weights, smearing, triangle_table(records), len(records), [list(p) for p in presets], modes)
+
+    def covers(self, record):
+        """Пресет и режим кадра были в журнале - иначе веса для него не обучены"""
+        return [record['pixels'], record['samples']] in self.presets and record_mode(record) in self.modes
+
+    def predict_record(self, record):
+        return math.exp(sum(w * v for w, v in zip(self.weights, feature_vector(record)))) * self.smearing
+
+    def predict(self, unit, batch=1, composite=False):
+        """Время кадра RenderUnit в секундах по плану, без Blender; None - модель не обучена на таких кадрах"""
+        record = unit_record(unit, self.triangles, batch, composite)
+        if not self.covers(record):
+            return None
+        return self.predict_record(record)
+
+    def to_dict(self):
+        return {'features': list(FEATURES), 'weights': self.weights, 'smearing': self.smearing,
+                'triangles': self.triangles, 'trained_on': self.trained_on, 'presets': self.presets,
+                'modes': self.modes}
+
+    def save(self, path=MODEL_PATH):
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(self.to_dict(), file)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=MODEL_PATH):
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as file:
+            data = json.load(file)
+        if data.get('features') != list(FEATURES) or 'presets' not in data:
+            # Модель старого формата - переобучить
+            return None
+        return cls(data['weights'], data['smearing'], data['triangles'], data['trained_on'], data['presets'],
+                   data['modes'])
+
+
+def triangle_table(records):
+    table = {}
+    for r in records:
+        table['%s|%s' % (r['obj_url'], r['blender_name'])] = r['triangles']
+        table[r['obj_url']] = r['scene_triangles']
+    if records:
+        table['*'] = median(r['triangles'] for r in records)
+        table['*scene'] = median(r['scene_triangles'] for r in records)
+    return table
+
+
+def record_mode(record):
+    # Пакет из одного кадра в журнале - тот же одиночный рендер
+    if record.get('mode') == 'composite':
+        return 'composite'
+    return 'batch' if record.get('batch', 1) > 1 else 'single'
+
+
+def unit_record(unit, triangles, batch=1, composite=False):
+    """composite - однотонный кадр собирается из базового прохода камеры (settings.composite_flat_colors)"""
+    preset = get_preset(unit.preset)
+    width, height = preset['resolution']
+    if composite and unit.kind == 'color':
+        mode = 'composite'
+    else:
+        mode = 'batch' if batch > 1 else 'single'
+    return {
+        'pixels': width * height,
+        'samples': preset['samples'],
+        'triangles': triangles.get('%s|%s' % (unit.obj_url, unit.blender_name), triangles.get('*', 0)),
+        'scene_triangles': triangles.get(unit.obj_url, triangles.get('*scene', 0)),
+        'kind': unit.kind,
+        'batch': batch,
+        'mode': mode,
+    }
+
+
+_model = None
+_model_mtime = None
+
+
+def get_model():
+    """Обученная модель или None; воркер пула живет долго - перечитывается после train"""
+    global _model, _model_mtime
+    mtime = os.path.getmtime(MODEL_PATH) if os.path.exists(MODEL_PATH) else None
+    if mtime != _model_mtime:
+        _model = CostModel.load()
+        _model_mtime = mtime
+    return _model
+
+
+def usable(records):
+    return [r for r in records if r.get('render_time', 0) > 0 and r.get('pixels') and r.get('samples')]
+
+
+def synthetic_records(count, seed=1):
+    """Журнал с известной зависимостью для проверки обучения без рендер-фермы"""
+    rng = random.Random(seed)
+    kinds = {'color': 1.0, 'textured': 1.6, 'bump': 1.9, 'displacement': 3.0, 'unknown': 1.6}
+    presets = [('draft', 975 * 650, 32), ('preview', 1462 * 975, 96), ('final', 1950 * 1300, 200)]
+    models = [('obj_%d' % n, rng.randint(50, 2000) * 1000) for n in range(12)]
+    records = []
+    for n in range(count):
+        obj_url, scene_triangles = rng.choice(models)
+        part = 'part_%d' % rng.randint(0, 5)
+        triangles = scene_triangles // (2 + int(part.split('_')[1]))
+        preset, pixels, samples = rng.choice(presets)
+        kind = rng.choice(list(kinds))
+        batch = rng.choice([1, 1, 2, 3])
+        seconds = (2e-7 * pixels * samples ** 0.8 * kinds[kind] * (1 + scene_triangles / 2e6)
+                   / batch ** 0.3 * rng.lognormvariate(0, 0.15))
+        records.append({'pk': n // 20, 'obj_url': obj_url, 'blender_name': part, 'preset': preset,
+                        'pixels': pixels, 'samples': samples, 'triangles': triangles,
+                        'scene_triangles': scene_triangles, 'kind': kind, 'batch': batch, 'mode': 'batch',
+                        'render_time': seconds, 'time': n})
+    return records
+
+
+def errors(pairs):
+    ape = sorted(abs(p - a) / a for p, a in pairs)
+    return {
+        'mae': sum(abs(p - a) for p, a in pairs) / len(pairs),
+        'mape': sum(ape) / len(ape),
+        'median_ape': median(ape),
+        'p90_ape': ape[min(len(ape) - 1, int(0.9 * len(ape)))],
+    }
+
+
+def benchmark(records, test_share=0.2, holdout_preset=None):
+    """
+    Обучение на старых записях, проверка на новых; сравнение с FRAME_COST.
+    holdout_preset - обучение без пресета, проверка на его кадрах.
+
+    model - предсказание модели как есть, planner - как в planner.py: модель,
+    а для кадров вне журнала FRAME_COST.
+    """
+    from planner import FRAME_COST
+
+    if holdout_preset:
+        train = [r for r in records if r['preset'] != holdout_preset]
+        test = [r for r in records if r['preset'] == holdout_preset]
+    else:
+        records = sorted(records, key=lambda r: r.get('time', 0))
+        split = int(len(records) * (1 - test_share))
+        train, test = records[:split], records[split:]
+    if not train or not test:
+        print(f"Nothing to compare: train {len(train)}, test {len(test)} frames")
+        return None
+    model = CostModel.train(train)
+
+    heuristic = [FRAME_COST[r['kind']] * get_preset(r['preset'])['cost_factor'] for r in test]
+    predictions = {
+        'model': [model.predict_record(r) for r in test],
+        'planner': [model.predict_record(r) if model.covers(r) else h for r, h in zip(test, heuristic)],
+        'heuristic': heuristic,
+    }
+
+    print(f"Train {len(train)}, test {len(test)} frames, "
+          f"{sum(model.covers(r) for r in test)} covered by the model")
+    for name, predicted in predictions.items():
+        # Для очереди важнее ошибка суммы по продукту
+        products = {}
+        for r, p in zip(test, predicted):
+            total = products.setdefault(r['pk'], [0.0, 0.0])
+            total[0] += p
+            total[1] += r['render_time']
+        frame = errors([(p, r['render_time']) for r, p in zip(test, predicted)])
+        product = errors(list(products.values()))
+        print(f"  {name:9} frame MAE {frame['mae']:6.1f}s, MAPE {frame['mape']:6.1%}, "
+              f"median {frame['median_ape']:6.1%}, p90 {frame['p90_ape']:6.1%}; "
+              f"product MAPE {product['mape']:6.1%}")
+    return model
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['train', 'bench'])
+    parser.add_argument('--timings', default=TIMINGS_PATH)
+    parser.add_argument('--synthetic', type=int, default=0,
+                        help='только bench: журнал по форме самой модели, проверка обучения, не точности')
+    parser.add_argument('--holdout-preset', default=None, help='только bench: пресет, которого нет в обучении')
+    args = parser.parse_args()
+    if (args.synthetic or args.holdout_preset) and args.command == 'train':
+        parser.error('--synthetic and --holdout-preset are for bench only')
+
+    records = synthetic_records(args.synthetic) if args.synthetic else usable(load_timings(args.timings))
+    if len(records) < MIN_RECORDS:
+        print(f"Not enough timings: {len(records)} < {MIN_RECORDS}")
+        return
+
+    if args.command == 'bench':
+        benchmark(records, holdout_preset=args.holdout_preset)
+        return
+
+    model = CostModel.train(records)
+    model.save()
+    print(f"Trained on {len(records)} frames: " +
+          ', '.join(f"{name} {w:.3f}" for name, w in zip(FEATURES, model.weights)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+"""
+Локальная замена API загрузки кадров для проверки send_images.UploadManager.
+
+Сервер:  python mock_server.py --port 8100 --fail-rate 0.2 --drop-rate 0.05 --latency 0.05
+Бенчмарк: python mock_server.py --bench 200 --fail-rate 0.2 [--mode single|batch|both]
+
+Ошибки: fail-rate - ответ 503, drop-rate - обрыв соединения без ответа.
+Повтор с уже принятым Idempotency-Key считается дубликатом.
+Пакетная загрузка: /api/product/load_scene_materials/, --no-batch - эндпоинта нет (404),
+--max-batch - ответ 413 для пачки больше лимита. latency - накладные расходы на запрос.
+Ссылка same_as вместо файла принимается, только если такой scene_material уже загружен, иначе 404.
+Рамка обрезки и размер кадра (crop, size) сохраняются по scene_material в app['layouts'].
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+from aiohttp import web
+
+# Бенчмарк импортирует send_images - ответы для settings.py
+os.environ.setdefault('RENDER_MAKE', 'n')
+os.environ.setdefault('RENDER_WRITE_ANYWAY', 'n')
+os.environ.setdefault('RENDER_IDS', '')
+
+
+def create_app(fail_rate=0.0, drop_rate=0.0, latency=0.0, batch=True, max_batch=0):
+    stats = {'requests': 0, 'accepted': 0, 'failed': 0, 'dropped': 0, 'duplicates': 0, 'bytes': 0,
+             'batches': 0, 'rejected_batches': 0, 'references': 0, 'rejected_references': 0}
+    accepted_keys = set()
+    images = set()
+    layouts = {}
+
+    async def simulate_errors(request):
+        stats['requests'] += 1
+        if latency:
+            await asyncio.sleep(random.uniform(0.5, 1.5) * latency)
+
+        roll = random.random()
+        if roll < drop_rate:
+            stats['dropped'] += 1
+            request.transport.close()
+            return web.Response(status=500)
+        if roll < drop_rate + fail_rate:
+            stats['failed'] += 1
+            return web.Response(status=503, text='Service unavailable')
+        return None
+
+    async def read_fields(request):
+        if not request.content_type.startswith('multipart/'):
+            # Только ссылки без файлов - обычная форма
+            return dict(await request.post())
+        reader = await request.multipart()
+        fields = {}
+        async for part in reader:
+            if part.filename:
+                size = 0
+                while True:
+                    chunk = await part.read_chunk()
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                stats['bytes'] += size
+                fields[part.name] = size
+            else:
+                fields[part.name] = await part.text()
+        return fields
+
+    def store(fields, image_field, scene_material):
+        # Файл или ссылка на уже загруженный кадр
+        if 'same_as' in fields:
+            if str(fields['same_as']) not in images:
+                stats['rejected_references'] += 1
+                return 404
+            stats['references'] += 1
+        elif image_field not in fields:
+            return 400
+        images.add(str(scene_material))
+        if 'size' in fields:
+            # В пачке поля пункта уже разобраны, в одиночной загрузке - строки json
+            layouts[str(scene_material)] = {k: json.loads(v) if isinstance(v, str) else v
+                                            for k, v in fields.items() if k in ('crop', 'size')}
+        return 200
+
+    def accept(key):
+        if key in accepted_keys:
+            stats['duplicates'] += 1
+        elif key:
+            accepted_keys.add(key)
+        stats['accepted'] += 1
+
+    async def load_scene_material(request):
+        error = await simulate_errors(request)
+        if error is not None:
+            return error
+
+        fields = await read_fields(request)
+        status = store(fields, 'image', fields.get('scene_material'))
+        if status != 200:
+            return web.Response(status=status, text='Unknown same_as' if status == 404 else 'No image')
+        accept(request.headers.get('Idempotency-Key'))
+        return web.json_response({'scene_material': fields.get('scene_material')})
+
+    async def load_scene_materials(request):
+        error = await simulate_errors(request)
+        if error is not None:
+            return error
+
+        fields = await read_fields(request)
+        items = json.loads(fields['items'])
+        if max_batch and len(items) > max_batch:
+            stats['rejected_batches'] += 1
+            return web.Response(status=413, text='Too many images')
+
+        stats['batches'] += 1
+        results = []
+        for item in items:
+            status = store(dict(fields, **item), item.get('field'), item['scene_material'])
+            if status == 200:
+                accept(item.get('key'))
+            results.append({'scene_material': item['scene_material'], 'status': status})
+        return web.json_response({'results': results})
+
+    async def get_stats(request):
+        return web.json_response(stats)
+
+    app = web.Application(client_max_size=64 * 1024 ** 2)
+    app['stats'] = stats
+    app['layouts'] = layouts
+    app.router.add_post('/api/product/load_scene_material/', load_scene_material)
+    if batch:
+        app.router.add_post('/api/product/load_scene_materials/', load_scene_materials)
+    app.router.add_get('/stats', get_stats)
+    return app
+
+
+def create_files(directory, count, size):
+    files = []
+    for n in range(count):
+        path = os.path.join(directory, '%d.png' % n)
+        with open(path, 'wb') as file:
+            file.write(os.urandom(size))
+        files.append(path)
+    return files
+
+
+async def bench_mode(args, mode, tasks):
+    from send_images import BatchUploadManager, UploadManager, setup_logger
+
+    app = create_app(args.fail_rate, args.drop_rate, args.latency, not args.no_batch, args.max_batch)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', args.port).start()
+
+    base_url = 'http://127.0.0.1:%d' % args.port
+    if mode == 'batch':
+        manager = BatchUploadManager(setup_logger(), max_concurrent_uploads=args.concurrency, backoff=0.05,
+                                     target_latency=args.target_latency, base_url=base_url)
+    else:
+        manager = UploadManager(setup_logger(), max_concurrent_uploads=args.concurrency, backoff=0.05,
+                                base_url=base_url)
+
+    start_time = time.time()
+    results = await manager.process_batch(tasks)
+    wall = time.time() - start_time
+    await runner.cleanup()
+
+    print(f"[{mode}] {sum(results)} of {len(results)} uploaded in {wall:.2f}s")
+    print('  Client: %s' % manager.report())
+    print('  Server: %s' % app['stats'])
+
+
+async def bench(args):
+    from send_images import UploadTask
+
+    with tempfile.TemporaryDirectory() as directory:
+        tasks = [UploadTask(material_id=n, file_path=path, variant_pk=0, blender_name='part', model_n=1,
+                            camera_n=1, total_cameras=1, material_n=n, total_materials=args.bench)
+                 for n, path in enumerate(create_files(directory, args.bench, args.size))]
+
+        for mode in (['single', 'batch'] if args.mode == 'both' else [args.mode]):
+            await bench_mode(args, mode, tasks)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--fail-rate', type=float, default=0.0)
+    parser.add_argument('--drop-rate', type=float, default=0.0)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--bench', type=int, default=0, help='число файлов для загрузки')
+    parser.add_argument('--size', type=int, default=300 * 1024)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--mode', choices=['single', 'batch', 'both'], default='single')
+    parser.add_argument('--no-batch', action='store_true')
+    parser.add_argument('--max-batch', type=int, default=0)
+    parser.add_argument('--target-latency', type=float, default=2.0)
+    args = parser.parse_args()
+
+    if args.bench:
+        asyncio.run(bench(args))
+    else:
+        web.run_app(create_app(args.fail_rate, args.drop_rate, args.latency, not args.no_batch, args.max_batch),
+                    port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+"""
+Планировщик рендера: один раз читает ответ /api/product/render/<id>/ и
+возвращает плоский список единиц рендера (variant, model, camera, part, material).
+
+Модуль не зависит от bpy, список можно сериализовать и раздать на другие машины.
+Запуск: python planner.py 12,13 [--json | --summary]
+"""
+import json
+import os
+from collections import Counter
+from dataclasses import dataclass, asdict, field
+from itertools import groupby
+from typing import List
+
+from cost_model import get_model
+from utils.payload import fetch_product, material_definitions, material_kind
+from utils.presets import DEFAULT_PRESET, get_preset, preset_media_path
+
+# Оценка времени рендера одного кадра в секундах по типу материала, пока нет cost_model.json
+FRAME_COST = {
+    'color': 20.0,
+    'textured': 35.0,
+    'bump': 40.0,
+    'displacement': 60.0,
+    'unknown': 35.0,
+}
+
+
+@dataclass
+class RenderUnit:
+    pk: int
+    model_n: int
+    camera_n: int
+    blender_name: str
+    material: str
+    scene_material: int
+    obj_url: str
+    camera: dict
+    holdout_parts: List[str] = field(default_factory=list)
+    filepath: str = ''
+    kind: str = 'unknown'
+    preset: str = DEFAULT_PRESET
+    cost: float = 0.0
+
+    @property
+    def key(self):
+        return self.pk, self.model_n, self.camera_n, self.blender_name, self.material
+
+    @property
+    def id(self):
+        # Строковый id для Redis и журнала запусков, кадры разных пресетов различаются
+        return ':'.join(str(v) for v in self.key + (self.preset,))
+
+    def to_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+
+def get_camera_dict(camera):
+    return {k: camera[k] for k in ('pos_x', 'pos_y', 'pos_z', 'rad_x', 'rad_y', 'rad_z')}
+
+
+def get_unit_filepath(pk, model_n, camera_n, blender_name, material_id):
+    dir_name = os.path.join('variant_%d' % pk, 'model_%d' % model_n, 'camera_%d' % camera_n, blender_name)
+    return dir_name + '/' + material_id + '.png'
+
+
+def plan_product(data, pk, media_path, filter_parts=None, write_anyway=False,
+                 preset=DEFAULT_PRESET, composite_colors=False) -> List[RenderUnit]:
+    # composite_colors - settings.composite_flat_colors, однотонные кадры не рендерятся отдельно
+    definitions = material_definitions(data)
+    cost_factor = get_preset(preset)['cost_factor']
+    # Кадры не финального пресета лежат отдельно и не перетирают финальные
+    media_root = preset_media_path(media_path, preset)
+    units = []
+    seen = set()
+
+    for model_n, model_3d in enumerate(data['model_3d'], 1):
+        for camera_n, camera in enumerate(model_3d['cameras'], 1):
+            holdout_parts = [p['part']['blender_name'] for p in camera['parts']]
+
+            for part in camera['parts']:
+                blender_name = part['part']['blender_name']
+                if filter_parts and blender_name not in filter_parts:
+                    continue
+
+                for material in part['materials']:
+                    material_id = material['material']
+                    filepath = get_unit_filepath(pk, model_n, camera_n, blender_name, material_id)
+
+                    if not write_anyway:
+                        if material['image'] is not None:
+                            continue
+                        if os.path.exists(os.path.join(media_root, filepath)):
+                            continue
+
+                    kind = material_kind(definitions.get(material_id))
+                    unit = RenderUnit(
+                        pk=pk,
+                        model_n=model_n,
+                        camera_n=camera_n,
+                        blender_name=blender_name,
+                        material=material_id,
+                        scene_material=material['id'],
+                        obj_url=model_3d['obj'],
+                        camera=get_camera_dict(camera),
+                        holdout_parts=holdout_parts,
+                        filepath=filepath,
+                        kind=kind,
+                        preset=preset,
+                        cost=FRAME_COST[kind] * cost_factor,
+                    )
+
+                    if unit.key in seen:
+                        continue
+                    seen.add(unit.key)
+                    units.append(unit)
+
+    model = get_model()
+    if model is not None:
+        # Кадры одной части и материала на разных камерах рендерятся одним вызовом (group_batches),
+        # однотонные при composite_colors - одним базовым проходом камеры (render_color_units)
+        composite = [composite_colors and u.kind == 'color' for u in units]
+        batch_keys = [('composite', u.model_n, u.camera_n) if c else
+                      (u.model_n, u.blender_name, tuple(u.holdout_parts), u.material) for u, c in zip(units, composite)]
+        batches = Counter(batch_keys)
+        for unit, batch_key, c in zip(units, batch_keys, composite):
+            # Пресета или режима не было в журнале - модель не знает их масштаб, остается FRAME_COST
+            cost = model.predict(unit, batches[batch_key], c)
+            if cost is not None:
+                unit.cost = cost
+    return units
+
+
+def group_units(units, attr):
+    return [(k, list(g)) for k, g in groupby(units, key=lambda u: getattr(u, attr))]
+
+
+def summarize(units):
+    return {
+        'units': len(units),
+        'models': len({(u.pk, u.model_n) for u in units}),
+        'cameras': len({(u.pk, u.model_n, u.camera_n) for u in units}),
+        'parts': len({u.blender_name for u in units}),
+        'materials': len({u.material for u in units}),
+        'by_kind': {kind: sum(1 for u in units if u.kind == kind) for kind in sorted({u.kind for u in units})},
+        'estimated_time': round(sum(u.cost for u in units), 1),
+    }
+
+
+def print_plan(pk, summary):
+    print('*' * 50)
+    print('Plan id%d: %d units, %d models, %d cameras, %d parts, %d materials' % (
+        pk, summary['units'], summary['models'], summary['cameras'], summary['parts'], summary['materials']))
+    print('By kind: %s' % summary['by_kind'])
+    print('Estimated time: %.0fs' % summary['estimated_time'])
+    print('*' * 50)
+
+
+def main():
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('ids')
+    parser.add_argument('--json', action='store_true')
+    parser.add_argument('--summary', action='store_true', help='json {id: summarize} одной строкой')
+    parser.add_argument('--preset', default=None)
+    parser.add_argument('--parts', default=None, help='blender_name через запятую вместо settings.filter_parts')
+    args = parser.parse_args()
+
+    os.environ['RENDER_IDS'] = args.ids
+    os.environ.setdefault('RENDER_MAKE', 'y')
+    os.environ.setdefault('RENDER_WRITE_ANYWAY', 'n')
+
+    from settings import domain, ids, media_path, filter_parts, write_anyway, render_preset, composite_flat_colors
+
+    parts = [p for p in args.parts.split(',') if p] if args.parts else filter_parts
+    plan = []
+    summaries = {}
+    for pk in ids:
+        data = fetch_product(domain, pk)
+        if data is None:
+            continue
+        units = plan_product(data, pk, media_path, parts, write_anyway, args.preset or render_preset,
+                             composite_flat_colors)
+        if args.summary:
+            summaries[pk] = summarize(units)
+        elif args.json:
+            plan.extend(u.to_dict() for u in units)
+        else:
+            print_plan(pk, summarize(units))
+
+    if args.summary:
+        print(json.dumps(summaries))
+    elif args.json:
+        json.dump(plan, sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,13 +4,16 @@ import bpy
 from mathutils import Vector
 import requests
 
+from utils import fetch_object
 from utils.camera import create_camera, get_camera_location
-from utils.crete_scene import create_scene
+from utils.crete_scene import create_scene, render_settings
 from utils.fetch_object import fetch_and_save_obj
 from utils.materials.create import create_material
+from utils.render_cache import RenderCache
 
 root = os.path.dirname(os.path.abspath(__file__))
 media_path = os.path.join(root, 'media')
+render_cache = RenderCache(os.path.join(media_path, 'cache', 'render'))
 
 local = False
 domain = 'http://0.0.0.0:8000' if local else 'http://194.15.46.132:8000'
@@ -134,16 +137,32 @@ def loop_cameras(product):
             print('slug', slug)
             for material_group in interior_layer['material_groups']:
                 for material in material_group['materials']:
-                    mat = create_material(material['material'])
+                    # Полное описание материала (цвет / текстуры), как в render_object_parts.get_cache_key
+                    material_data = material['material']
+                    mat = create_material(material_data)
                     filepath = get_file_name(n, slug, material)
 
-                    if os.path.exists(filepath):
+                    key = RenderCache.make_key(
+                        obj=fetch_object.loaded_obj_hash,
+                        camera=camera,
+                        layer=slug,
+                        material=material_data,
+                        render=render_settings(),
+                    )
+
+                    # Существующий файл пропускаем, только если он отрендерен с теми же входными данными
+                    if render_cache.matches(key, filepath):
                         print('File exists', filepath)
                         continue
 
-                    apply_holdout_to_scene(slug, mat)
-                    render(filepath)
-                    apply_holdout_to_scene(slug, mat)
+                    if not render_cache.fetch(key, filepath):
+                        if os.path.exists(filepath):
+                            # Старый кадр - жесткая ссылка на свой файл кэша, рендер не должен его перезаписать
+                            os.remove(filepath)
+                        apply_holdout_to_scene(slug, mat)
+                        render(filepath)
+                        apply_holdout_to_scene(slug, mat)
+                        render_cache.store(key, filepath)
                     send_image(material['id'], filepath)
 
 
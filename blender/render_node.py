@@ -0,0 +1,153 @@
+"""
+Нода распределенного рендера: берет единицы у координатора (coordinator.py) и рендерит их.
+
+Запуск: python render_node.py -- [--redis redis://redis:6379/1] [--device 0] [--batch 8]
+или:    blender -b --python render_node.py -- --redis redis://redis:6379/1
+
+Сцена создается один раз, модель остается загруженной - координатор отдает ноде
+единицы той же модели, пока они есть. Пока идет рендер, аренда продлевается из
+обработчиков рендера (поток Python во время bpy.ops.render.render не выполняется).
+Загрузку продукта, текстур и модели до первого рендера покрывает поток heartbeat
+и вызовы heartbeat() между шагами.
+"""
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+import traceback
+
+# Нода не интерактивная - ответы для settings.py
+os.environ.setdefault('RENDER_MAKE', 'y')
+os.environ.setdefault('RENDER_WRITE_ANYWAY', 'n')
+os.environ.setdefault('RENDER_IDS', '')
+
+
+def parse_args():
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else sys.argv[1:]
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--redis', default=None)
+    parser.add_argument('--device', type=int, default=None)
+    parser.add_argument('--batch', type=int, default=8)
+    parser.add_argument('--name', default='%s-%d' % (socket.gethostname(), os.getpid()))
+    parser.add_argument('--exit-when-done', action='store_true')
+    return parser.parse_args(argv)
+
+
+args = parse_args()
+if args.device is not None:
+    os.environ['RENDER_DEVICE'] = str(args.device)
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+import bpy
+from bpy.app.handlers import persistent
+
+from coordinator import Coordinator, REDIS_URL, connect, model_key
+from planner import group_units
+from render_object_parts import fetch_product, open_manifest, render_part_materials
+from utils.crete_scene import create_scene
+from utils.fetch_object import load_model
+from utils.materials.fetch import create_material_library
+
+HEARTBEAT_INTERVAL = 10
+
+coordinator = Coordinator(connect(args.redis or REDIS_URL))
+leased_units = []
+last_heartbeat = 0
+
+
+def heartbeat(force=False):
+    global last_heartbeat
+
+    if force or time.time() - last_heartbeat > HEARTBEAT_INTERVAL:
+        last_heartbeat = time.time()
+        coordinator.heartbeat(args.name, leased_units)
+
+
+@persistent
+def heartbeat_handler(*args):
+    try:
+        heartbeat()
+    except Exception as e:
+        # Нет связи с Redis - не прерываем рендер, аренда истечет сама
+        print('Heartbeat error', e)
+
+
+def heartbeat_loop():
+    # Скачивание и подготовка текстур, загрузка модели - до первого обработчика рендера
+    while True:
+        time.sleep(HEARTBEAT_INTERVAL / 2)
+        if leased_units:
+            heartbeat_handler()
+
+
+def render_units(units, products):
+    # Единицы из spop приходят в случайном порядке, рендер группирует их по камерам
+    units.sort(key=lambda u: u.key)
+    pk = units[0].pk
+    if pk not in products:
+        data = fetch_product(pk)
+        if data is None:
+            # Не кэшируем ошибку: следующая аренда этого продукта запросит его снова
+            raise RuntimeError('Product %d: response error' % pk)
+        products.clear()
+        products[pk] = data
+    data = products[pk]
+
+    heartbeat()
+    materials = create_material_library(data, units, clear=False)
+    heartbeat()
+    manifest = open_manifest(pk, units[0].preset)
+    for model_n, model_units in group_units(units, 'model_n'):
+        load_model(pk, model_units[0].obj_url, data['parts'], reuse_loaded=True)
+        heartbeat()
+        render_part_materials(pk, model_n, model_units, manifest, materials)
+    # Журнал дописывают несколько нод - compact() запускается отдельно: python -m utils.manifest
+    materials.report()
+
+
+def serve():
+    bpy.context.scene.render.resolution_percentage = 100
+    create_scene()
+    for handlers in (bpy.app.handlers.render_stats, bpy.app.handlers.render_post):
+        handlers.append(heartbeat_handler)
+    threading.Thread(target=heartbeat_loop, daemon=True).start()
+    print('Node %s ready' % args.name)
+
+    loaded = None
+    products = {}
+    while True:
+        units = coordinator.lease(args.name, loaded, args.batch)
+        if not units:
+            if args.exit_when_done and coordinator.is_finished():
+                break
+            heartbeat(force=True)
+            time.sleep(2)
+            continue
+
+        leased_units[:] = units
+        loaded = model_key(units[0])
+        start_time = time.time()
+        try:
+            render_units(units, products)
+        except Exception:
+            # Аренда не продлевается и истечет - единицы заберет другая нода
+            traceback.print_exc()
+            loaded = None
+            leased_units.clear()
+            continue
+
+        completed = coordinator.complete(args.name, units)
+        if completed < len(units):
+            print(f"Node {args.name}: {len(units) - completed} leases expired before completion")
+        leased_units.clear()
+        print(f"Node {args.name}: {len(units)} units in {time.time() - start_time:.2f}s, "
+              f"{coordinator.status()}")
+
+    coordinator.release_node(args.name)
+
+
+serve()
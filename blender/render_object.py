@@ -1,6 +1,6 @@
-import asyncio
 import os
 import shutil
+import time
 from decimal import Decimal
 from math import radians
 
@@ -11,6 +11,8 @@ from utils.camera import create_camera
 from utils.crete_scene import create_scene
 from utils.fetch_object import fetch_and_save_obj
 from utils.materials.base import set_color_material
+from utils.pipeline import RenderPipeline
+from utils.sku_images import SkuImage
 
 root = '/Users/rostislavnikolaev/Desktop/Sites/render-server/blender'
 media_path = os.path.join(root, 'media')
@@ -43,28 +45,6 @@ def assign_materials_to_sku(materials):
             obj.data.materials.append(mat)
 
 
-async def send_sku_image(sku, index, image_file_path):
-    url = domain + '/api/product/load_sku_images/'
-
-    # Define your payload data
-    payload = {
-        'sku': sku,
-        'index': index
-    }
-
-    # Create a dictionary to hold the files to be sent in the request
-    files = {'image': open(image_file_path, 'rb')}
-
-    # Send the POST request with the payload and files
-    response = requests.post(url, data=payload, files=files)
-
-    # Check the response
-    print(response.status_code)
-    print(response.text)
-
-    return response.status_code
-
-
 def delete_dir(dir_path):
     try:
         shutil.rmtree(dir_path)
@@ -92,6 +72,9 @@ def loop_sku(sku_list, cameras=None):
         'rotation': (radians(Decimal(cam['rad_x'])), radians(Decimal(cam['rad_y'])), radians(Decimal(cam['rad_z'])))
     } for cam in cameras]
 
+    # Загрузка идет, пока рендерится следующий ракурс
+    pipeline = RenderPipeline(upload='sku', base_url=domain)
+
     i = 1
     length = len(sku_list)
     for sku in sku_list:
@@ -100,12 +83,14 @@ def loop_sku(sku_list, cameras=None):
             filepath = media_path + '/' + str(sku['id']) + '/' 'image-' + str(n + 1)
             create_camera(pos['location'], pos['rotation'])
             bpy.context.scene.render.filepath = filepath
+            start_time = time.time()
             bpy.ops.render.render(write_still=True)
-            asyncio.run(send_sku_image(sku['id'], n, f'{filepath}.png'))
+            pipeline.submit(SkuImage(sku['id'], n, f'{filepath}.png'), rendered=(start_time, time.time()))
 
         print('%d of %d' % (i, length))
         i += 1
 
+    pipeline.close()
     delete_dir(media_path)
 
 
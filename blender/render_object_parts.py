@@ -1,16 +1,46 @@
-import json
 import os
+import shutil
+import tempfile
 import time
 
 import bpy
 import requests
 
-from settings import domain, media_path, make_render, ids, filter_parts, write_anyway
-from utils.camera import create_camera, get_camera_location
-from utils.crete_scene import create_scene, create_hdr_scene
-from utils.fetch_object import fetch_and_save_obj
-from utils.materials.fetch import create_materials
+from planner import RenderUnit, plan_product, group_units, summarize, print_plan
+from send_images import UploadTask
+from settings import domain, media_path, make_render, ids, filter_parts, write_anyway, use_render_cache, \
+    render_preset, composite_flat_colors, use_checkpoints, upload_after_render, encode_output, output_formats, \
+    log_timings
+from utils import crete_scene, fetch_object, recolor, timings
+from utils.checkpoint import CheckpointStore
+from utils.camera import create_cameras, set_active_camera, bind_cameras
+from utils.crete_scene import create_scene, create_hdr_scene, render_settings
+from utils.encode import available_formats, encode_frame
+from utils.fetch_object import load_model
+from utils.manifest import Manifest
+from utils.materials.base import set_object_material
+from utils.materials.fetch import create_material_library
+from utils.payload import fetch_product as fetch_product_data
+from utils.pipeline import RenderPipeline
+from utils.presets import DEFAULT_PRESET, preset_media_path
+from utils.render_cache import RenderCache
 from utils.send_image import send_image
+from utils.timing_log import SYNC_TIMINGS_PATH, TimingLog
+from utils.timings import render_timings
+
+render_cache = RenderCache(os.path.join(media_path, 'cache', 'render')) if use_render_cache else None
+checkpoints = CheckpointStore() if use_checkpoints else None
+timing_log = TimingLog() if log_timings else None
+sync_log = TimingLog(SYNC_TIMINGS_PATH) if log_timings else None
+# Треугольники части ((obj_url, blender_name)) и всей модели (obj_url) для журнала времени
+triangle_counts = {}
+# Id запуска в журнале, кадры отмечаются только при запуске через run()
+checkpoint_run = None
+# Конвейер загрузки готовых кадров, создается в run()
+upload_pipeline = None
+# Прогресс и отмена задачи пула (utils/progress.py), передается в render_product
+job_progress = None
+encoded_formats = available_formats(output_formats) if encode_output else []
 
 
 def get_collection_by_name(name):
@@ -27,15 +57,16 @@ def deactivate_holdout_and_apply_material(collection, new_material):
     # Удаляем эффект Holdout из всех материалов объектов коллекции
     for obj in collection.objects:
         if obj.type == 'MESH':
-            obj.data.materials.clear()
-            obj.data.materials.append(new_material)
+            set_object_material(obj, new_material)
 
 
 def apply_holdout_to_collection(collection):
     if isinstance(collection, str):
         collection = get_collection_by_name(collection)
 
-    if not hasattr(apply_holdout_to_collection, '_holdout_material'):
+    # Ищем по имени: после clear_all() ранее созданный материал удален вместе со сценой
+    holdout_material = bpy.data.materials.get("Holdout_Material")
+    if holdout_material is None:
         holdout_material = bpy.data.materials.new(name="Holdout_Material")
         holdout_material.use_nodes = True
         nodes = holdout_material.node_tree.nodes
@@ -47,65 +78,54 @@ def apply_holdout_to_collection(collection):
         holdout_node = nodes.new(type='ShaderNodeHoldout')
         output_node = nodes.new(type='ShaderNodeOutputMaterial')
         links.new(holdout_node.outputs[0], output_node.inputs[0])
-        
-        apply_holdout_to_collection._holdout_material = holdout_material
-    
-    holdout_material = apply_holdout_to_collection._holdout_material
 
     for obj in collection.objects:
         if obj.type == 'MESH':
-            obj.data.materials.clear()
-            obj.data.materials.append(holdout_material)
+            set_object_material(obj, holdout_material)
 
 
-def add_objects_to_collections(parts):
-    # Удаляем все существующие коллекции, кроме коллекции по умолчанию
-    for collection in bpy.data.collections:
-        if collection.name != "Collection":
-            bpy.data.collections.remove(collection)
-
-    for part in parts:
-        new_collection = bpy.data.collections.new(part['blender_name'])
-        bpy.context.scene.collection.children.link(new_collection)
-
-        for obj in bpy.context.scene.objects:
-            if obj.type == 'MESH' and obj.name.split('.')[0].lower() == part['blender_name']:
-                new_collection.objects.link(obj)
+def temp_filepath(filepath):
+    directory, name = os.path.split(filepath)
+    return os.path.join(directory, '.tmp_' + name)
 
 
 def render(filepath):
-    bpy.context.scene.render.filepath = filepath
+    # Рендер во временный файл и переименование: прерванный рендер не оставляет битый PNG
+    tmp_path = temp_filepath(filepath)
+    bpy.context.scene.render.filepath = tmp_path
     bpy.ops.render.render(write_still=True)
+    os.replace(tmp_path, filepath)
 
 
-def write_to_json(pk, model_n, camera_n, material_id, file_path):
-    file_name = os.path.join(media_path, 'variant_%d' % pk, 'images.json')
-    new_data = [material_id, file_path]
-
-    if not os.path.exists(file_name):
-        file_data = {}
-    else:
-        with open(file_name, 'r') as file:
-            file_data = json.load(file)
-
-    variant_key = "variant_%d" % pk
-    model_key = "model_%d" % model_n
-    camera_key = "camera_%d" % camera_n
+def render_frames(filepaths):
+    """Один вызов рендера на несколько камер: кадр n сохраняется в filepaths[n - 1]"""
+    scene = bpy.context.scene
+    frames_dir = os.path.join(media_path, 'cache', 'frames')
+    os.makedirs(frames_dir, exist_ok=True)
+    output_dir = tempfile.mkdtemp(dir=frames_dir)
+    try:
+        scene.render.filepath = os.path.join(output_dir, 'frame_####')
+        bpy.ops.render.render(animation=True)
+        for frame, filepath in enumerate(filepaths, 1):
+            os.replace(os.path.join(output_dir, 'frame_%04d%s' % (frame, scene.render.file_extension)), filepath)
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
 
-    if variant_key not in file_data:
-        file_data[variant_key] = {}
 
-    if model_key not in file_data[variant_key]:
-        file_data[variant_key][model_key] = {}
+def open_manifest(pk, preset=DEFAULT_PRESET):
+    return Manifest(os.path.join(preset_media_path(media_path, preset), 'variant_%d' % pk), pk)
 
-    if camera_key not in file_data[variant_key][model_key]:
-        file_data[variant_key][model_key][camera_key] = []
 
-    if new_data not in file_data[variant_key][model_key][camera_key]:
-        file_data[variant_key][model_key][camera_key].append(new_data)
-
-    with open(file_name, 'w') as file:
-        json.dump(file_data, file)
+def get_cache_key(unit, material_data, **extra):
+    return RenderCache.make_key(
+        obj=fetch_object.loaded_obj_hash,
+        camera=unit.camera,
+        part=unit.blender_name,
+        holdout=unit.holdout_parts,
+        material=material_data,
+        render=render_settings(),
+        **extra
+    )
 
 
 def print_to_console(rendering, pk, blender_name, model_n, camera_n, camera_count, material_n, materials_count):
@@ -121,54 +141,267 @@ def print_to_console(rendering, pk, blender_name, model_n, camera_n, camera_coun
     print('\n' * 3)
 
 
-def render_part_materials(pk, model_n, model_3d):
-    for n, camera in enumerate(model_3d['cameras'], 1):
-        create_camera(*get_camera_location(camera))
-        for part in camera['parts']:
-            blender_name = part['part']['blender_name']
-
-            if len(filter_parts) == 0 or blender_name in filter_parts:
-                print('Rendering', blender_name)
-
-                dir_name = os.path.join('variant_%d' % pk, 'model_%d' % model_n, 'camera_%d' % n, blender_name)
-                media_dir = os.path.join(media_path, str(dir_name))
-                if not os.path.exists(media_dir):
-                    os.makedirs(media_dir)
-
-                for p in camera['parts']:
-                    apply_holdout_to_collection(p['part']['blender_name'])
-
-                materials_count = len(part['materials'])
-                for material_n, material in enumerate(part['materials'], 1):
-                    print_to_console(True, pk, blender_name, model_n, n, len(model_3d['cameras']), material_n,
-                                     materials_count)
-
-                    material_id = material['material']
-                    mat = bpy.data.materials.get(material_id)
-
-                    deactivate_holdout_and_apply_material(part['part']['blender_name'], mat)
-                    filepath = dir_name + '/' + material_id + '.png'
-                    media_filepath = os.path.join(media_path, filepath)
-
-                    if write_anyway or (not os.path.exists(media_filepath) and material['image'] is None):
-                        start_time = time.time()
-                        render(media_filepath)
-                        render_time = time.time() - start_time
-                        
-                        start_time = time.time()
-                        write_to_json(pk, model_n, n, material_id, filepath)
-                        json_time = time.time() - start_time
-                        
-                        print(f"Render: {render_time:.2f}s, JSON: {json_time:.2f}s")
-
-
-def render_product(data, pk):
-    create_scene()
-
-    for model_n, model_3d in enumerate(data['model_3d'], 1):
-        fetch_and_save_obj(pk, model_3d['obj'])
-        add_objects_to_collections(data['parts'])
-        render_part_materials(pk, model_n, model_3d)
+def count_triangles(objects):
+    total = 0
+    for obj in objects:
+        if obj.type == 'MESH':
+            obj.data.calc_loop_triangles()
+            total += len(obj.data.loop_triangles)
+    return total
+
+
+def get_triangles(unit):
+    key = (unit.obj_url, unit.blender_name)
+    if key not in triangle_counts:
+        collection = get_collection_by_name(unit.blender_name)
+        triangle_counts[key] = count_triangles(collection.all_objects) if collection else 0
+    if unit.obj_url not in triangle_counts:
+        triangle_counts[unit.obj_url] = count_triangles(bpy.context.scene.objects)
+    return triangle_counts[key], triangle_counts[unit.obj_url]
+
+
+def log_timing(unit, render_time, json_time, batch, mode):
+    scene = bpy.context.scene
+    scale = scene.render.resolution_percentage / 100
+    triangles, scene_triangles = get_triangles(unit)
+    timing_log.append({
+        'pk': unit.pk,
+        'model_n': unit.model_n,
+        'camera_n': unit.camera_n,
+        'blender_name': unit.blender_name,
+        'material': unit.material,
+        'obj_url': unit.obj_url,
+        'kind': unit.kind,
+        'preset': unit.preset,
+        'pixels': int(scene.render.resolution_x * scale) * int(scene.render.resolution_y * scale),
+        'samples': scene.cycles.samples,
+        'device': scene.cycles.device,
+        'persistent_data': scene.render.use_persistent_data,
+        'triangles': triangles,
+        'scene_triangles': scene_triangles,
+        'batch': batch,
+        'mode': mode,
+        'render_time': render_time,
+        'json_time': json_time,
+    })
+
+
+def get_media_filepath(unit):
+    media_filepath = os.path.join(preset_media_path(media_path, unit.preset), unit.filepath)
+    if not os.path.exists(os.path.dirname(media_filepath)):
+        os.makedirs(os.path.dirname(media_filepath))
+    return media_filepath
+
+
+def finish_unit(model_n, unit, manifest, materials, render_time, batch=1, mode='single'):
+    # render_time 0 - кадр из кэша; batch - кадров в одном вызове рендера
+    finish_time = time.time()
+    materials.release(unit.material)
+    media_filepath = os.path.join(preset_media_path(media_path, unit.preset), unit.filepath)
+
+    extra = {}
+    result = None
+    if encode_output:
+        # Кадр только что отрендерен или взят из кэша - всегда во весь кадр
+        result = encode_frame(media_filepath, encoded_formats)
+        extra = result.manifest_extra()
+        print(f"Encoded: {result.source_bytes / 1024:.0f} -> {result.bytes / 1024:.0f} KB, crop {result.crop}")
+
+    start_time = time.time()
+    manifest.append(model_n, unit.camera_n, unit.material, unit.filepath, preset=unit.preset, **extra)
+    json_time = time.time() - start_time
+
+    if timing_log and render_time:
+        log_timing(unit, render_time, json_time, batch, mode)
+
+    if checkpoints and checkpoint_run:
+        checkpoints.record(checkpoint_run, unit, media_filepath, render_time)
+
+    if upload_pipeline and unit.preset == DEFAULT_PRESET:
+        upload_pipeline.submit(UploadTask(
+            material_id=unit.scene_material,
+            file_path=media_filepath,
+            variant_pk=unit.pk,
+            blender_name=unit.blender_name,
+            model_n=model_n,
+            camera_n=unit.camera_n,
+            crop=result.crop if result else None,
+            size=result.size if result else None,
+        ), rendered=(finish_time - render_time, finish_time) if render_time else None)
+
+    if job_progress:
+        job_progress.unit_done(unit, render_time)
+
+    print(f"Render: {render_time:.2f}s, JSON: {json_time:.2f}s")
+
+
+def render_color_units(model_n, units, manifest, materials):
+    """Однотонные материалы камеры: один базовый рендер и перекраска по маскам частей"""
+    pending = []
+    for unit in units:
+        media_filepath = get_media_filepath(unit)
+        key = get_cache_key(unit, materials.definitions.get(unit.material), mode='composite') if render_cache else None
+
+        if key and render_cache.fetch(key, media_filepath):
+            print('Cache hit', unit.filepath)
+            finish_unit(model_n, unit, manifest, materials, 0)
+        else:
+            pending.append((unit, media_filepath, key))
+
+    if not pending:
+        return
+
+    if job_progress:
+        job_progress.unit_started(pending[0][0])
+    start_time = time.time()
+    output_dir = tempfile.mkdtemp(prefix='recolor_')
+    try:
+        part_indices = recolor.render_base_pass(units[0].holdout_parts, output_dir)
+        passes, masks = recolor.load_passes(output_dir, part_indices)
+    finally:
+        recolor.restore_scene()
+        shutil.rmtree(output_dir, ignore_errors=True)
+    base_time = time.time() - start_time
+    print(f"Base pass: {base_time:.2f}s for {len(pending)} colors")
+
+    for unit, media_filepath, key in pending:
+        if job_progress:
+            job_progress.unit_started(unit)
+        start_time = time.time()
+        mask = masks[part_indices[unit.blender_name]]
+        pixels = recolor.compose_color(passes, mask, materials.flat_color(unit.material))
+
+        if os.path.exists(media_filepath):
+            os.remove(media_filepath)
+        recolor.save_png(pixels, temp_filepath(media_filepath))
+        os.replace(temp_filepath(media_filepath), media_filepath)
+        if key:
+            render_cache.store(key, media_filepath)
+        # Базовый проход делится между цветами камеры
+        render_time = base_time / len(pending) + time.time() - start_time
+        finish_unit(model_n, unit, manifest, materials, render_time, len(pending), 'composite')
+
+
+def group_batches(units):
+    # Кадры одной части с одним материалом на разных камерах рендерятся одним вызовом
+    batches = {}
+    for unit in units:
+        batches.setdefault((unit.blender_name, tuple(unit.holdout_parts), unit.material), []).append(unit)
+    return list(batches.values())
+
+
+def render_part_materials(pk, model_n, units, manifest, materials):
+    cameras = create_cameras({u.camera_n: u.camera for u in units})
+    if units[0].preset != crete_scene.current_preset:
+        crete_scene.apply_preset(units[0].preset)
+
+    if composite_flat_colors:
+        color_units = [u for u in units if materials.flat_color(u.material)]
+        for camera_n, camera_units in group_units(color_units, 'camera_n'):
+            print('Compositing %d colors, camera %d' % (len(camera_units), camera_n))
+            set_active_camera(cameras[camera_n])
+            render_color_units(model_n, camera_units, manifest, materials)
+        units = [u for u in units if u not in color_units]
+
+    holdout_for = None
+    batches = group_batches(units)
+
+    for batch_n, batch in enumerate(batches, 1):
+        unit = batch[0]
+        if (unit.blender_name, unit.holdout_parts) != holdout_for:
+            holdout_for = (unit.blender_name, unit.holdout_parts)
+            print('Rendering', unit.blender_name)
+
+            for blender_name in unit.holdout_parts:
+                apply_holdout_to_collection(blender_name)
+
+        if job_progress:
+            job_progress.unit_started(unit)
+        print_to_console(True, pk, unit.blender_name, model_n, unit.camera_n, len(cameras), batch_n, len(batches))
+
+        start_time = time.time()
+        pending = []
+        for unit in batch:
+            media_filepath = get_media_filepath(unit)
+            key = get_cache_key(unit, materials.definitions.get(unit.material)) if render_cache else None
+
+            if key and render_cache.fetch(key, media_filepath):
+                print('Cache hit', unit.filepath)
+            else:
+                if os.path.exists(media_filepath):
+                    # Файл может быть ссылкой на кэш - не перезаписываем его на месте
+                    os.remove(media_filepath)
+                pending.append((unit, media_filepath, key))
+
+        if pending:
+            mat = materials.get(unit.material)
+            deactivate_holdout_and_apply_material(unit.blender_name, mat)
+
+            if len(pending) == 1:
+                set_active_camera(cameras[pending[0][0].camera_n])
+                render(pending[0][1])
+            else:
+                print('Cameras', ', '.join(str(u.camera_n) for u, _, _ in pending))
+                bind_cameras([cameras[u.camera_n] for u, _, _ in pending])
+                render_frames([path for _, path, _ in pending])
+
+            for _, media_filepath, key in pending:
+                if key:
+                    render_cache.store(key, media_filepath)
+
+        render_time = (time.time() - start_time) / max(len(pending), 1)
+        rendered = [u for u, _, _ in pending]
+        for unit in batch:
+            finish_unit(model_n, unit, manifest, materials, render_time if unit in rendered else 0,
+                        len(pending), 'batch' if len(pending) > 1 else 'single')
+
+
+def render_product(data, pk, warm=False, preset=None, units=None, parts=None, progress=None):
+    # warm - сцена уже создана воркером пула, модель может быть загружена
+    # units - план из журнала прерванного запуска, файлы на диске не проверяются
+    # parts - фильтр частей вместо settings.filter_parts, progress - JobProgress задачи пула
+    global job_progress
+    preset = preset or render_preset
+    timings.register()
+    render_timings.reset()
+
+    if units is None:
+        units = plan_product(data, pk, media_path, parts or filter_parts, write_anyway, preset, composite_flat_colors)
+        if checkpoints and checkpoint_run:
+            checkpoints.plan(checkpoint_run, units)
+    print_plan(pk, summarize(units))
+
+    if progress:
+        progress.start(units)
+    if not units:
+        # Нечего рендерить - не строим материалы и не загружаем OBJ
+        return units
+
+    materials = create_material_library(data, units, clear=not warm)
+    if not warm:
+        create_scene()
+
+    manifest = open_manifest(pk, preset)
+    job_progress = progress
+    try:
+        for model_n, model_units in group_units(units, 'model_n'):
+            if progress:
+                progress.check()
+            load_model(pk, model_units[0].obj_url, data['parts'], reuse_loaded=warm)
+            render_part_materials(pk, model_n, model_units, manifest, materials)
+    finally:
+        # При отмене готовые кадры остаются в манифесте
+        job_progress = None
+        manifest.compact()
+    materials.report()
+    render_timings.report()
+    if sync_log:
+        sync_log.append(dict(render_timings.summary(), pk=pk, preset=preset))
+
+    if render_cache:
+        print('Render cache: %s' % render_cache.stats())
+
+    return units
 
 
 def send_part_materials(pk, model_n, model_3d):
@@ -203,22 +436,46 @@ def send_product(data, pk):
         send_part_materials(pk, model_n, model_3d)
 
 
-def run():
-    for i in ids:
-        url = '%s/api/product/render/%d/' % (domain, i)
-        response = requests.get(url)
-        if not response.ok:
-            print('Response error')
-            return
-
-        data = response.json()
-
-        if make_render:
-            bpy.context.scene.render.resolution_percentage = 100
-            create_materials(data)
-            render_product(data, i)
-        else:
-            send_product(data, i)
-
-
-run()
+def fetch_product(pk):
+    return fetch_product_data(domain, pk)
+
+
+def run(resume=None):
+    """resume - id прерванного запуска из журнала (resume.py)"""
+    global checkpoint_run, upload_pipeline
+
+    if make_render and checkpoints:
+        checkpoint_run = resume or checkpoints.start_run(ids, render_preset, write_anyway)
+    if make_render and upload_after_render:
+        # PNG уже сжат в finish_unit - процессу загрузки кодировать не нужно
+        upload_pipeline = RenderPipeline(encode=not encode_output)
+
+    try:
+        for i in ids:
+            data = fetch_product(i)
+            if data is None:
+                # Продукт не попал в запуск - следующий запуск без resume отрендерит его по файлам
+                print('Product %d: response error, skipped' % i)
+                continue
+
+            if make_render:
+                bpy.context.scene.render.resolution_percentage = 100
+                pending = checkpoints.pending(checkpoint_run, i) if resume else None
+                units = [RenderUnit.from_dict(u) for u in pending] if pending is not None else None
+                render_product(data, i, units=units)
+            else:
+                send_product(data, i)
+    finally:
+        # Кадры, уже отданные процессу загрузки, догружаются и при падении рендера;
+        # запуск в журнале остается незавершенным - resume.py продолжит его
+        if upload_pipeline:
+            upload_pipeline.close()
+            upload_pipeline = None
+
+    if checkpoint_run:
+        print('Run %d: %s' % (checkpoint_run, checkpoints.stats(checkpoint_run)))
+        checkpoints.finish_run(checkpoint_run)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,45 @@
+"""
+Продолжение прерванного запуска render_object_parts по журналу (utils/checkpoint.py).
+
+Запуск: python resume.py [-- --run 3]
+или:    blender -b --python resume.py [-- --run 3]
+
+Без --run берется последний незавершенный запуск. ids, пресет и write_anyway
+читаются из журнала, settings.py ничего не спрашивает. Для продуктов, план
+которых уже сохранен, рендерятся только неготовые единицы без обхода media/.
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.checkpoint import CheckpointStore
+
+
+def parse_args():
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else sys.argv[1:]
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--run', type=int, default=None)
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    run = CheckpointStore().get_run(args.run)
+    if run is None:
+        print('Nothing to resume')
+        return
+
+    print('Resuming run %d: ids %s, preset %s' % (run['id'], run['ids'], run['preset']))
+    os.environ['RENDER_MAKE'] = 'y'
+    os.environ['RENDER_WRITE_ANYWAY'] = 'y' if run['write_anyway'] else 'n'
+    os.environ['RENDER_IDS'] = run['ids']
+    os.environ['RENDER_PRESET'] = run['preset']
+
+    from render_object_parts import run as render_run
+    render_run(resume=run['id'])
+
+
+main()
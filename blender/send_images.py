@@ -1,15 +1,24 @@
 import os
 import asyncio
+import hashlib
+import json
+import random
+import time
 import aiohttp
-from typing import List, Dict
+from contextlib import ExitStack
+from typing import List, Dict, Optional
 from dataclasses import dataclass
 from datetime import datetime
 import platform
 import logging
 from logging.handlers import RotatingFileHandler
 
-from render_object_parts import print_to_console
-from settings import domain, media_path, filter_parts, ids
+from settings import domain, media_path, filter_parts, ids, upload_batch, upload_dedup
+from utils.dedup import DedupIndex, print_report as dedup_report, split_duplicates
+from utils.manifest import Manifest
+from utils.render_cache import file_hash
+
+DEDUP_INDEX_PATH = os.path.join(media_path, 'cache', 'dedup_index.json')
 
 
 # Настройка логирования в файл
@@ -41,28 +50,115 @@ class UploadTask:
     blender_name: str
     model_n: int
     camera_n: int
-    total_cameras: int
-    material_n: int
-    total_materials: int
+    # Только для журнала; конвейер рендера (utils/pipeline.py) их не знает
+    total_cameras: Optional[int] = None
+    material_n: Optional[int] = None
+    total_materials: Optional[int] = None
+    # scene_material с такой же картинкой: вместо файла отправляется ссылка (utils/dedup.py)
+    same_as: Optional[int] = None
+    # Кадр обрезан по альфе (utils/encode.py): рамка [x, y, w, h] в исходном кадре [W, H]
+    crop: Optional[List[int]] = None
+    size: Optional[List[int]] = None
+
+
+def layout_fields(task):
+    # Без рамки и размера сервер не сможет совместить обрезанные слои частей
+    fields = {}
+    if task.crop:
+        fields['crop'] = task.crop
+    if task.size:
+        fields['size'] = task.size
+    return fields
+
+
+def sent_bytes(task):
+    return 0 if task.same_as is not None else os.path.getsize(task.file_path)
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+# Статусы, после которых повтор имеет смысл: перегрузка, таймаут, ошибки сервера
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+# Сервер не принял ссылку same_as - отправляем сам файл
+REFERENCE_REJECTED_STATUSES = {400, 404, 409, 422}
+# Ответы сервера без поддержки пакетной загрузки
+BATCH_UNSUPPORTED_STATUSES = {404, 405, 415, 501}
 
 
 class UploadManager:
-    def __init__(self, logger, max_concurrent_uploads: int = 10):
+    def __init__(self, logger, max_concurrent_uploads: int = 10, retries: int = 4, backoff: float = 0.5,
+                 max_backoff: float = 30, timeout: float = 300, base_url: str = domain):
         self.semaphore = asyncio.Semaphore(max_concurrent_uploads)
+        self.max_concurrent_uploads = max_concurrent_uploads
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.base_url = base_url
         self.active_uploads = 0
         self.completed_uploads = 0
         self.total_uploads = 0
         self.start_time = None
         self.logger = logger
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.latencies = []
+        self.retry_count = 0
+        self.failed = 0
+        self.uploaded_bytes = 0
+        self.stats_start = time.time()
+
+    @staticmethod
+    def idempotency_key(task: UploadTask) -> str:
+        key = '%s-%s' % (task.material_id, file_hash(task.file_path)[:16])
+        # Ссылка и загрузка файла - разные запросы для сервера
+        return key + '-ref%s' % task.same_as if task.same_as is not None else key
+
+    def create_session(self) -> aiohttp.ClientSession:
+        """Одна сессия на весь запуск: keep-alive соединения переиспользуются между файлами"""
+        connector = aiohttp.TCPConnector(limit=self.max_concurrent_uploads, keepalive_timeout=60)
+        return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+
+    def retry_delay(self, attempt: int, retry_after=None) -> float:
+        if retry_after:
+            try:
+                return min(self.max_backoff, float(retry_after))
+            except ValueError:
+                pass
+        # Экспоненциальная задержка с полным джиттером
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    async def post_file(self, session: aiohttp.ClientSession, task: UploadTask, idempotency_key: str):
+        # Файл открывается на одну попытку и закрывается после отправки
+        with open(task.file_path, 'rb') as file:
+            data = aiohttp.FormData()
+            data.add_field('scene_material', str(task.material_id))
+            for name, value in layout_fields(task).items():
+                data.add_field(name, json.dumps(value))
+            if task.same_as is not None:
+                data.add_field('same_as', str(task.same_as))
+            else:
+                data.add_field('image', file, filename=os.path.basename(task.file_path))
+
+            async with session.post(f"{self.base_url}/api/product/load_scene_material/", data=data,
+                                    headers={'Idempotency-Key': idempotency_key}) as response:
+                await response.read()
+                return response.status, response.headers.get('Retry-After')
 
     async def upload_file(self, session: aiohttp.ClientSession, task: UploadTask) -> bool:
-        """Асинхронная загрузка одного файла"""
+        """Асинхронная загрузка одного файла с повторами"""
         async with self.semaphore:
             self.active_uploads += 1
             try:
                 # Логируем прогресс
                 elapsed = datetime.now() - self.start_time
-                progress = (self.completed_uploads / self.total_uploads) * 100
+                progress = (self.completed_uploads / max(1, self.total_uploads)) * 100
                 self.logger.info(
                     f"Progress: {progress:.1f}% | "
                     f"Active: {self.active_uploads} | "
@@ -71,45 +167,231 @@ class UploadManager:
                     f"File: {os.path.basename(task.file_path)}"
                 )
 
-                # Формируем данные для отправки
-                data = aiohttp.FormData()
-                data.add_field('scene_material', str(task.material_id))
-                data.add_field('image',
-                               open(task.file_path, 'rb'),
-                               filename=os.path.basename(task.file_path))
-
-                async with session.post(f"{domain}/api/product/load_scene_material/",
-                                        data=data) as response:
-                    success = response.status == 200
-                    if success:
+                # Один ключ на все попытки: сервер может отбросить повтор уже принятой загрузки
+                idempotency_key = self.idempotency_key(task)
+                start_time = time.time()
+
+                attempt = 0
+                while attempt <= self.retries:
+                    retry_after = None
+                    try:
+                        status, retry_after = await self.post_file(session, task, idempotency_key)
+                        error = 'status %d' % status
+                    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                        status, error = None, '%s: %s' % (type(e).__name__, e)
+
+                    if status in (200, 201):
+                        self.latencies.append(time.time() - start_time)
+                        self.uploaded_bytes += sent_bytes(task)
                         self.logger.info(f"Successfully uploaded {os.path.basename(task.file_path)}")
-                    else:
-                        self.logger.error(f"Failed to upload {os.path.basename(task.file_path)}: {response.status}")
-                    return success
+                        return True
+
+                    if status in REFERENCE_REJECTED_STATUSES and task.same_as is not None:
+                        self.logger.info(f"Reference to {task.same_as} rejected ({status}), "
+                                         f"uploading {os.path.basename(task.file_path)}")
+                        task.same_as = None
+                        idempotency_key = self.idempotency_key(task)
+                        # Отправка файла вместо ссылки - не повтор, попытка не тратится
+                        continue
+                    if status is not None and status not in RETRY_STATUSES:
+                        break
+                    if attempt < self.retries:
+                        self.retry_count += 1
+                        delay = self.retry_delay(attempt, retry_after)
+                        self.logger.info(f"Retry {attempt + 1} for {os.path.basename(task.file_path)} "
+                                         f"in {delay:.1f}s: {error}")
+                        await asyncio.sleep(delay)
+                    attempt += 1
+
+                self.failed += 1
+                self.logger.error(f"Failed to upload {os.path.basename(task.file_path)}: {error}")
+                return False
 
             except Exception as e:
+                self.failed += 1
                 self.logger.error(f"Error uploading {task.file_path}: {str(e)}")
                 return False
             finally:
                 self.active_uploads -= 1
                 self.completed_uploads += 1
 
-    async def process_batch(self, tasks: List[UploadTask]) -> List[bool]:
+    async def process_batch(self, tasks: List[UploadTask], session: aiohttp.ClientSession = None) -> List[bool]:
         """Обработка группы задач параллельно"""
         self.total_uploads = len(tasks)
         self.completed_uploads = 0
         self.start_time = datetime.now()
 
-        async with aiohttp.ClientSession() as session:
-            upload_tasks = [
-                self.upload_file(session, task) for task in tasks
-            ]
-            return await asyncio.gather(*upload_tasks)
+        if session is not None:
+            return await asyncio.gather(*[self.upload_file(session, task) for task in tasks])
+
+        async with self.create_session() as session:
+            return await asyncio.gather(*[self.upload_file(session, task) for task in tasks])
+
+    def report(self) -> Dict:
+        elapsed = max(time.time() - self.stats_start, 1e-6)
+        return {
+            'uploaded': len(self.latencies),
+            'failed': self.failed,
+            'retries': self.retry_count,
+            'files_per_second': len(self.latencies) / elapsed,
+            'mb_per_second': self.uploaded_bytes / 1024 ** 2 / elapsed,
+            'p50': percentile(self.latencies, 50),
+            'p95': percentile(self.latencies, 95),
+        }
+
+    def log_report(self):
+        report = self.report()
+        self.logger.info(
+            f"Uploaded {report['uploaded']}, failed {report['failed']}, retries {report['retries']} | "
+            f"{report['files_per_second']:.1f} files/s, {report['mb_per_second']:.1f} MB/s | "
+            f"p50 {report['p50']:.2f}s, p95 {report['p95']:.2f}s"
+        )
+        return report
+
+
+class BatchUploadManager(UploadManager):
+    """Несколько кадров в одном multipart запросе, размер пачки подстраивается под задержку запроса"""
+
+    def __init__(self, logger, max_concurrent_uploads: int = 4, batch_size: int = 8, min_batch: int = 1,
+                 max_batch: int = 64, target_latency: float = 2.0, **kwargs):
+        super().__init__(logger, max_concurrent_uploads, **kwargs)
+        self.batch_size = batch_size
+        self.min_batch = min_batch
+        self.max_batch = max_batch
+        self.target_latency = target_latency
+        self.batch_supported = True
+
+    def reset_stats(self):
+        super().reset_stats()
+        self.requests = 0
+        self.batched = 0
+
+    def adapt(self, latency: float, ok: bool):
+        # AIMD: растем, пока запрос заметно быстрее целевой задержки, при ошибке или медленном запросе - вдвое меньше
+        if not ok or latency > self.target_latency:
+            self.batch_size = max(self.min_batch, self.batch_size // 2)
+        elif latency < self.target_latency / 2:
+            self.batch_size = min(self.max_batch, self.batch_size * 2)
+
+    async def post_batch(self, session: aiohttp.ClientSession, tasks: List[UploadTask]):
+        items = []
+        for n, task in enumerate(tasks):
+            item = {'scene_material': task.material_id, 'key': self.idempotency_key(task), **layout_fields(task)}
+            if task.same_as is not None:
+                item['same_as'] = task.same_as
+            else:
+                item['field'] = 'image_%d' % n
+            items.append(item)
+        batch_key = hashlib.sha256(''.join(item['key'] for item in items).encode()).hexdigest()[:32]
+
+        with ExitStack() as stack:
+            data = aiohttp.FormData()
+            data.add_field('items', json.dumps(items), content_type='application/json')
+            for item, task in zip(items, tasks):
+                if 'field' not in item:
+                    continue
+                file = stack.enter_context(open(task.file_path, 'rb'))
+                data.add_field(item['field'], file, filename=os.path.basename(task.file_path))
+
+            async with session.post(f"{self.base_url}/api/product/load_scene_materials/", data=data,
+                                    headers={'Idempotency-Key': batch_key}) as response:
+                body = await response.json(content_type=None) if response.status == 200 else None
+                return response.status, response.headers.get('Retry-After'), body
+
+    async def upload_batch(self, session: aiohttp.ClientSession, tasks: List[UploadTask]) -> List[bool]:
+        start_time = time.time()
+        error = None
+
+        for attempt in range(self.retries + 1):
+            retry_after = None
+            try:
+                self.requests += 1
+                status, retry_after, body = await self.post_batch(session, tasks)
+                error = 'status %d' % status
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                status, body, error = None, None, '%s: %s' % (type(e).__name__, e)
+
+            if status == 200:
+                latency = time.time() - start_time
+                self.adapt(latency, True)
+                statuses = {str(r['scene_material']): r['status'] for r in (body or {}).get('results', [])}
+                results = [statuses.get(str(task.material_id)) in (200, 201) for task in tasks]
+
+                for task, ok in zip(tasks, results):
+                    if ok:
+                        self.latencies.append(latency)
+                        self.uploaded_bytes += sent_bytes(task)
+                        self.completed_uploads += 1
+                self.batched += sum(results)
+                self.logger.info(f"Batch of {len(tasks)} uploaded in {latency:.2f}s, next batch {self.batch_size}")
+
+                # Отклоненные сервером кадры - по одному, со своими повторами
+                for n, task in enumerate(tasks):
+                    if not results[n]:
+                        results[n] = await self.upload_file(session, task)
+                return results
+
+            if status in BATCH_UNSUPPORTED_STATUSES:
+                self.logger.info(f"Batch upload not supported ({status}), falling back to single uploads")
+                self.batch_supported = False
+                break
+            if status == 413 and len(tasks) > 1:
+                # Пачка больше лимита сервера - делим пополам и больше не растем выше половины
+                self.max_batch = max(self.min_batch, min(self.max_batch, len(tasks) // 2))
+                self.batch_size = min(self.batch_size, self.max_batch)
+                half = len(tasks) // 2
+                return await self.upload_batch(session, tasks[:half]) + await self.upload_batch(session, tasks[half:])
+            if status is not None and status not in RETRY_STATUSES:
+                break
+
+            self.adapt(time.time() - start_time, False)
+            if attempt < self.retries:
+                self.retry_count += 1
+                delay = self.retry_delay(attempt, retry_after)
+                self.logger.info(f"Retry {attempt + 1} for batch of {len(tasks)} in {delay:.1f}s: {error}")
+                await asyncio.sleep(delay)
+
+        if self.batch_supported:
+            self.logger.error(f"Failed to upload batch of {len(tasks)}: {error}, retrying files one by one")
+        return [await self.upload_file(session, task) for task in tasks]
+
+    async def process_batch(self, tasks: List[UploadTask], session: aiohttp.ClientSession = None) -> List[bool]:
+        self.total_uploads = len(tasks)
+        self.completed_uploads = 0
+        self.start_time = datetime.now()
+
+        if session is None:
+            async with self.create_session() as session:
+                return await self.process_batch(tasks, session)
+
+        results = [False] * len(tasks)
+        pending = list(enumerate(tasks))[::-1]
+
+        async def worker():
+            while pending:
+                if not self.batch_supported:
+                    n, task = pending.pop()
+                    results[n] = await self.upload_file(session, task)
+                    continue
+
+                chunk = [pending.pop() for _ in range(min(self.batch_size, len(pending)))]
+                for (n, _), ok in zip(chunk, await self.upload_batch(session, [task for _, task in chunk])):
+                    results[n] = ok
+
+        await asyncio.gather(*[worker() for _ in range(self.max_concurrent_uploads)])
+        return results
+
+    def report(self) -> Dict:
+        report = super().report()
+        report.update({'requests': self.requests, 'batched': self.batched, 'batch_size': self.batch_size})
+        return report
 
 
 async def process_model_3d(data: Dict, pk: int) -> List[UploadTask]:
     """Подготовка списка задач для загрузки"""
     tasks = []
+    # Рамка обрезки и размер кадра - из манифеста рендера
+    manifest = Manifest(os.path.join(media_path, 'variant_%d' % pk), pk)
 
     for model_n, model_3d in enumerate(data['model_3d'], 1):
         for camera_n, camera in enumerate(model_3d['cameras'], 1):
@@ -131,6 +413,7 @@ async def process_model_3d(data: Dict, pk: int) -> List[UploadTask]:
                         media_filepath = os.path.join(media_path, filepath)
 
                         if os.path.exists(media_filepath) and material['image'] is None:
+                            record = manifest.get(model_n, camera_n, material_id, filepath) or {}
                             task = UploadTask(
                                 material_id=material['id'],
                                 file_path=media_filepath,
@@ -140,25 +423,53 @@ async def process_model_3d(data: Dict, pk: int) -> List[UploadTask]:
                                 camera_n=camera_n,
                                 total_cameras=len(model_3d['cameras']),
                                 material_n=material_n,
-                                total_materials=materials_count
+                                total_materials=materials_count,
+                                crop=record.get('crop'),
+                                size=record.get('size'),
                             )
                             tasks.append(task)
 
     return tasks
 
 
+async def upload_product(upload_manager, session, upload_tasks, index):
+    """Загрузка с поиском повторов: сначала оригиналы, потом ссылки на них"""
+    originals, references = split_duplicates(index, upload_tasks)
+    results = await upload_manager.process_batch(originals, session)
+
+    for task, ok in zip(originals, results):
+        if not ok:
+            index.discard(task.material_id)
+    failed = {task.material_id for task, ok in zip(originals, results) if not ok}
+    for task in references:
+        # Оригинал из этой пачки не загрузился - отправляем файл
+        if task.same_as in failed:
+            task.same_as = None
+
+    if references:
+        start_time = upload_manager.start_time
+        results += await upload_manager.process_batch(references, session)
+        upload_manager.start_time = start_time
+    index.save()
+    return originals, references, results
+
+
 async def main():
     logger = setup_logger()
-    upload_manager = UploadManager(logger, max_concurrent_uploads=10)
+    if upload_batch:
+        upload_manager = BatchUploadManager(logger)
+    else:
+        upload_manager = UploadManager(logger, max_concurrent_uploads=10)
+    index = DedupIndex(DEDUP_INDEX_PATH, upload_dedup) if upload_dedup != 'off' else None
 
     logger.info("Starting upload process")
 
-    for product_id in ids:
-        try:
-            logger.info(f"Processing product {product_id}")
+    async with upload_manager.create_session() as session:
+        for product_id in ids:
+            try:
+                logger.info(f"Processing product {product_id}")
 
-            # Получаем данные о продукте
-            async with aiohttp.ClientSession() as session:
+                # Получаем данные о продукте
                 url = f'{domain}/api/product/render/{product_id}/'
                 async with session.get(url) as response:
                     if response.status != 200:
@@ -166,29 +477,35 @@ async def main():
                         continue
                     data = await response.json()
 
-            # Подготавливаем задачи для загрузки
-            upload_tasks = await process_model_3d(data, product_id)
-
-            if not upload_tasks:
-                logger.info(f"No files to upload for product {product_id}")
-                continue
-
-            logger.info(f"Starting upload of {len(upload_tasks)} files for product {product_id}")
-
-            # Запускаем параллельную загрузку
-            results = await upload_manager.process_batch(upload_tasks)
-
-            # Выводим итоговую статистику
-            success_count = sum(1 for r in results if r)
-            logger.info(
-                f"Completed product {product_id}. "
-                f"Successfully uploaded {success_count} of {len(results)} files. "
-                f"Time elapsed: {(datetime.now() - upload_manager.start_time).seconds}s"
-            )
+                # Подготавливаем задачи для загрузки
+                upload_tasks = await process_model_3d(data, product_id)
+
+                if not upload_tasks:
+                    logger.info(f"No files to upload for product {product_id}")
+                    continue
+
+                logger.info(f"Starting upload of {len(upload_tasks)} files for product {product_id}")
+
+                # Запускаем параллельную загрузку в общей сессии
+                if index is not None:
+                    originals, references, results = await upload_product(upload_manager, session,
+                                                                           upload_tasks, index)
+                    dedup_report(product_id, originals, references)
+                else:
+                    results = await upload_manager.process_batch(upload_tasks, session)
+
+                # Выводим итоговую статистику
+                success_count = sum(1 for r in results if r)
+                logger.info(
+                    f"Completed product {product_id}. "
+                    f"Successfully uploaded {success_count} of {len(results)} files. "
+                    f"Time elapsed: {(datetime.now() - upload_manager.start_time).seconds}s"
+                )
 
-        except Exception as e:
-            logger.error(f"Error processing product {product_id}: {str(e)}")
+            except Exception as e:
+                logger.error(f"Error processing product {product_id}: {str(e)}")
 
+    upload_manager.log_report()
     logger.info("Upload process completed")
 
 
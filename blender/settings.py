@@ -12,7 +12,59 @@ media_path = os.path.join(root, 'media')
 filter_parts = []
 manual_ids = []
 
-make_render = input('Render? (y/n): ').lower() == 'y'
-write_anyway = input('Write anyway? (y/n): ').lower() == 'y'
-ids = manual_ids if len(manual_ids) > 0 else [int(i) for i in input('Enter ids: ').replace(' ', '').split(',')]
+
+def ask(question, env_name):
+    # Воркеры и CI передают ответы через переменные окружения, без input()
+    value = os.environ.get(env_name)
+    if value is None:
+        value = input(question)
+    return value
+
+
+make_render = ask('Render? (y/n): ', 'RENDER_MAKE').lower() == 'y'
+write_anyway = ask('Write anyway? (y/n): ', 'RENDER_WRITE_ANYWAY').lower() == 'y'
+ids = manual_ids if len(manual_ids) > 0 else [
+    int(i) for i in ask('Enter ids: ', 'RENDER_IDS').replace(' ', '').split(',') if i
+]
 hdr = True
+# Повторно использовать кадры с теми же входными данными (media/cache/render)
+use_render_cache = True
+# Максимальный размер кэша OBJ моделей (media/cache/obj)
+obj_cache_max_bytes = 5 * 1024 ** 3
+# Сохранять импортированные модели как .blend библиотеки (media/cache/blend)
+use_mesh_cache = True
+# Максимальный размер стороны текстуры после подготовки (0 - оригиналы)
+texture_max_size = 2048
+# Журнал запусков для продолжения после падения (media/cache/checkpoints.sqlite3, resume.py)
+use_checkpoints = True
+# Время рендера кадров с признаками сцены для cost_model.py (media/cache/timings.jsonl)
+log_timings = True
+# Загружать кадры во время рендера (utils/pipeline.py), а не отдельным запуском отправки
+upload_after_render = os.environ.get('RENDER_UPLOAD') == '1'
+# Отправка кадров пачками (send_images.BatchUploadManager), сервер должен поддерживать load_scene_materials
+upload_batch = os.environ.get('RENDER_UPLOAD_BATCH') == '1'
+# Повторы кадров отправлять ссылкой (utils/dedup.py): off / exact / perceptual
+upload_dedup = os.environ.get('RENDER_DEDUP', 'off')
+# Обрезка кадров по альфе и сжатие после рендера (utils/encode.py): RENDER_ENCODE=1
+encode_output = os.environ.get('RENDER_ENCODE') == '1'
+# Дополнительные форматы рядом с PNG, например RENDER_OUTPUT_FORMATS=webp,avif
+output_formats = [f for f in os.environ.get('RENDER_OUTPUT_FORMATS', '').replace(' ', '').split(',') if f]
+# Пресет качества по умолчанию: draft / preview / final (utils/presets.py)
+render_preset = os.environ.get('RENDER_PRESET', 'final')
+# Однотонные материалы собирать из проходов базового рендера камеры (utils/recolor.py)
+composite_flat_colors = os.environ.get('RENDER_COMPOSITE_COLORS') == '1'
+# Cycles persistent data: BVH и шейдеры переживают кадр (RENDER_PERSISTENT_DATA=0 - для сравнения)
+use_persistent_data = os.environ.get('RENDER_PERSISTENT_DATA', '1') == '1'
+# Однотонные материалы - один общий материал, между кадрами меняется только цвет
+share_flat_colors = True
+
+# Индекс GPU устройства для воркера пула (None - все устройства)
+render_device = int(os.environ['RENDER_DEVICE']) if os.environ.get('RENDER_DEVICE') else None
+
+# CPU рендер, если нет GPU (CPU ноды, CI): RENDER_ALLOW_CPU=1
+allow_cpu_render = os.environ.get('RENDER_ALLOW_CPU') == '1'
+cpu_threads = int(os.environ.get('RENDER_THREADS', 0))
+cpu_noise_threshold = 0.03
+cpu_tile_size = 256
+# Ограничение времени на кадр в секундах для CPU (0 - без ограничения)
+cpu_time_limit = float(os.environ.get('RENDER_CPU_TIME_LIMIT', 0))
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Скрипты импортируются как из blender/; ответы для settings.py, как у нод и воркеров
+os.environ.setdefault('RENDER_MAKE', 'y')
+os.environ.setdefault('RENDER_WRITE_ANYWAY', 'n')
+os.environ.setdefault('RENDER_IDS', '')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
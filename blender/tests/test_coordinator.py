@@ -0,0 +1,99 @@
+from coordinator import Coordinator, MemoryRedis, fake_units, simulate
+
+
+def make_coordinator(units=10, models=1, ttl=60):
+    coordinator = Coordinator(MemoryRedis(), ttl=ttl)
+    coordinator.submit(fake_units(units, models=models))
+    return coordinator
+
+
+def lease_expires(coordinator, unit):
+    return coordinator.redis.zscore(coordinator.key('leases'), unit.id)
+
+
+def test_lease_takes_units_of_one_model():
+    coordinator = make_coordinator(models=2)
+    units = coordinator.lease('a', count=4)
+
+    assert len(units) == 4
+    assert len({(u.pk, u.model_n) for u in units}) == 1
+    assert coordinator.status() == {'pending': 6, 'leased': 4, 'done': 0, 'nodes': 1}
+    owners = coordinator.redis.hgetall(coordinator.key('owners'))
+    assert {owners[u.id] for u in units} == {'a'}
+
+
+def test_lease_prefers_loaded_model():
+    coordinator = make_coordinator(models=2)
+    first = coordinator.lease('a', count=2)
+    model = '%d:%d' % (first[0].pk, first[0].model_n)
+
+    units = coordinator.lease('a', prefer=model, count=2)
+    assert {'%d:%d' % (u.pk, u.model_n) for u in units} == {model}
+
+
+def test_complete_marks_done():
+    coordinator = make_coordinator()
+    units = coordinator.lease('a', count=3)
+
+    assert coordinator.complete('a', units) == 3
+    assert coordinator.status()['leased'] == 0
+    assert coordinator.status()['done'] == 3
+
+
+def test_expired_lease_is_reaped_back_to_pending():
+    coordinator = make_coordinator(units=4)
+    units = coordinator.lease('a', count=4)
+    expires = max(lease_expires(coordinator, u) for u in units)
+
+    assert coordinator.reap(now=expires - 1) == 0
+    assert coordinator.reap(now=expires + 1) == 4
+    assert coordinator.status() == {'pending': 4, 'leased': 0, 'done': 0, 'nodes': 0}
+    assert coordinator.redis.hgetall(coordinator.key('owners')) == {}
+
+
+def test_heartbeat_extends_only_own_leases():
+    coordinator = make_coordinator(units=2, ttl=10)
+    units = coordinator.lease('a', count=2)
+    before = lease_expires(coordinator, units[0])
+
+    assert coordinator.heartbeat('b', units) == 0
+    assert lease_expires(coordinator, units[0]) == before
+    assert coordinator.heartbeat('a', units) == 2
+    assert lease_expires(coordinator, units[0]) >= before
+
+
+def test_late_complete_does_not_release_new_owner():
+    coordinator = make_coordinator(units=2)
+    units = coordinator.lease('a', count=2)
+    coordinator.reap(now=max(lease_expires(coordinator, u) for u in units) + 1)
+    again = coordinator.lease('b', count=2)
+    assert {u.id for u in again} == {u.id for u in units}
+
+    # Нода a дорендерила после истечения аренды: кадры готовы, аренда b остается
+    assert coordinator.complete('a', units) == 0
+    assert coordinator.status()['leased'] == 2
+    owners = coordinator.redis.hgetall(coordinator.key('owners'))
+    assert set(owners.values()) == {'b'}
+
+
+def test_simulation_finishes_all_units_despite_crashes(capsys):
+    simulate('memory', nodes=3, units=60, crash=0.05, batch=4, ttl=0.2)
+    out = capsys.readouterr().out
+    assert "'pending': 0, 'leased': 0, 'done': 60" in out
+
+
+def test_empty_model_is_dropped_only_with_pending_units_gone():
+    coordinator = make_coordinator(units=2)
+    units = coordinator.lease('a', count=2)
+    model = '%d:%d' % (units[0].pk, units[0].model_n)
+    pending = coordinator.key('pending:' + model)
+    keys = [pending, coordinator.key('leases'), coordinator.key('owners'), coordinator.key('models')]
+
+    # Очередь пополнилась (reap/submit) после пустого spop: модель остается в models
+    coordinator.redis.sadd(pending, units[0].id)
+    assert coordinator.lease_script(keys=keys, args=[0, 0, 'a', model]) == []
+    assert coordinator.redis.smembers(coordinator.key('models')) == {model}
+
+    coordinator.redis.srem(pending, units[0].id)
+    assert coordinator.lease('a', count=2) == []
+    assert coordinator.redis.smembers(coordinator.key('models')) == set()
@@ -0,0 +1,34 @@
+from cost_model import CostModel, synthetic_records, unit_record
+from planner import RenderUnit
+
+
+def unit(preset='final', kind='textured'):
+    return RenderUnit(pk=1, model_n=1, camera_n=1, blender_name='part_0', material='m', scene_material=1,
+                      obj_url='obj_1', camera={}, kind=kind, preset=preset)
+
+
+def test_preset_missing_from_journal_is_not_predicted():
+    # Только final: веса пикселей и сэмплов не обучены, draft нельзя считать по модели
+    model = CostModel.train([r for r in synthetic_records(600) if r['preset'] == 'final'])
+    assert model.predict(unit('final')) > 0
+    assert model.predict(unit('draft')) is None
+
+
+def test_composite_mode_needs_composite_timings():
+    records = [r for r in synthetic_records(600) if r['preset'] == 'final']
+    model = CostModel.train(records)
+    assert unit_record(unit(kind='color'), {}, 3, composite=True)['mode'] == 'composite'
+    assert unit_record(unit(kind='textured'), {}, 3, composite=True)['mode'] == 'batch'
+    assert model.predict(unit(kind='color'), 3, composite=True) is None
+
+    for r in records[:100]:
+        r['mode'] = 'composite'
+    assert CostModel.train(records).predict(unit(kind='color'), 3, composite=True) > 0
+
+
+def test_saved_model_keeps_presets(tmp_path):
+    model = CostModel.train(synthetic_records(200))
+    model.save(str(tmp_path / 'cost_model.json'))
+    loaded = CostModel.load(str(tmp_path / 'cost_model.json'))
+    assert loaded.presets == model.presets
+    assert loaded.predict(unit('draft')) == model.predict(unit('draft'))
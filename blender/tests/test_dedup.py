@@ -0,0 +1,50 @@
+from PIL import Image
+
+from utils.dedup import DedupIndex
+
+
+def save_frame(directory, name, box, color=(128, 128, 128, 255), size=(200, 100)):
+    image = Image.new('RGBA', size, (0, 0, 0, 0))
+    image.paste(Image.new('RGBA', (box[2] - box[0], box[3] - box[1]), color), box[:2])
+    path = directory / name
+    image.save(path)
+    return str(path)
+
+
+def test_perceptual_matches_near_color_at_same_position(tmp_path):
+    index = DedupIndex(str(tmp_path / 'index.json'), 'perceptual')
+    index.add(index.fingerprint(save_frame(tmp_path, 'a.png', (10, 10, 60, 60))), 1)
+
+    near = save_frame(tmp_path, 'b.png', (10, 10, 60, 60), (129, 128, 128, 255))
+    assert index.lookup(index.fingerprint(near)) == 1
+
+
+def test_perceptual_rejects_same_color_part_elsewhere(tmp_path):
+    index = DedupIndex(str(tmp_path / 'index.json'), 'perceptual')
+    index.add(index.fingerprint(save_frame(tmp_path, 'a.png', (10, 10, 60, 60))), 1)
+
+    other_part = save_frame(tmp_path, 'b.png', (120, 30, 170, 80))
+    assert index.lookup(index.fingerprint(other_part)) is None
+
+
+def test_cropped_frames_compare_with_crop_rect(tmp_path):
+    # Обрезанные по альфе кадры одинаковы по пикселям, отличаются только рамкой
+    path = save_frame(tmp_path, 'a.png', (0, 0, 50, 50), size=(50, 50))
+    for mode in ('exact', 'perceptual'):
+        index = DedupIndex(str(tmp_path / ('%s.json' % mode)), mode)
+        index.add(index.fingerprint(path, [10, 10, 50, 50], [200, 100]), 1)
+
+        assert index.lookup(index.fingerprint(path, [10, 10, 50, 50], [200, 100])) == 1
+        assert index.lookup(index.fingerprint(path, [120, 30, 50, 50], [200, 100])) is None
+
+
+def test_reuploaded_material_drops_old_pixels(tmp_path):
+    old = save_frame(tmp_path, 'old.png', (10, 10, 60, 60))
+    new = save_frame(tmp_path, 'new.png', (10, 10, 60, 60), (200, 30, 30, 255))
+    for mode in ('exact', 'perceptual'):
+        index = DedupIndex(str(tmp_path / ('%s.json' % mode)), mode)
+        index.add(index.fingerprint(old), 1)
+        index.add(index.fingerprint(new), 1)
+
+        assert index.lookup(index.fingerprint(old)) is None
+        assert index.lookup(index.fingerprint(new)) == 1
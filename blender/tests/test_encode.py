@@ -0,0 +1,71 @@
+import os
+
+from PIL import Image
+
+from utils.encode import available_formats, encode_frame
+
+
+def save_frame(path, box, size=(200, 100)):
+    image = Image.new('RGBA', size, (0, 0, 0, 0))
+    image.paste(Image.new('RGBA', (box[2] - box[0], box[3] - box[1]), (200, 30, 30, 255)), box[:2])
+    image.save(path)
+    return str(path)
+
+
+def test_crop_rect_includes_padding_and_keeps_frame_size(tmp_path):
+    path = save_frame(tmp_path / 'frame.png', (50, 20, 80, 60))
+    result = encode_frame(path, padding=2)
+
+    assert result.size == [200, 100]
+    assert result.crop == [48, 18, 34, 44]
+    with Image.open(path) as image:
+        assert image.size == (34, 44)
+    assert result.manifest_extra() == {'size': [200, 100], 'crop': [48, 18, 34, 44]}
+
+
+def test_padding_is_clipped_at_frame_edges(tmp_path):
+    path = save_frame(tmp_path / 'frame.png', (0, 0, 10, 100))
+    assert encode_frame(path, padding=5).crop == [0, 0, 15, 100]
+
+
+def test_invisible_part_leaves_one_transparent_pixel(tmp_path):
+    path = str(tmp_path / 'empty.png')
+    Image.new('RGBA', (200, 100), (0, 0, 0, 0)).save(path)
+    result = encode_frame(path)
+
+    assert result.crop == [0, 0, 1, 1]
+    assert result.size == [200, 100]
+    with Image.open(path) as image:
+        assert image.size == (1, 1)
+        assert image.getpixel((0, 0))[3] == 0
+
+
+def test_out_path_leaves_hardlinked_source_untouched(tmp_path):
+    # Кадр из кэша рендеров - жесткая ссылка на файл кэша
+    cached = save_frame(tmp_path / 'cached.png', (50, 20, 80, 60))
+    source = str(tmp_path / 'frame.png')
+    os.link(cached, source)
+    before = open(cached, 'rb').read()
+
+    formats = available_formats(['webp'])
+    result = encode_frame(source, formats, out_path=str(tmp_path / 'out' / 'frame.png'))
+
+    assert open(source, 'rb').read() == before
+    assert open(cached, 'rb').read() == before
+    assert result.path == str(tmp_path / 'out' / 'frame.png')
+    assert set(result.variants) == set(formats)
+    with Image.open(result.path) as image:
+        assert image.size == (34, 44)
+
+
+def test_in_place_encode_does_not_write_through_hardlink(tmp_path):
+    cached = save_frame(tmp_path / 'cached.png', (50, 20, 80, 60))
+    source = str(tmp_path / 'frame.png')
+    os.link(cached, source)
+    before = open(cached, 'rb').read()
+
+    encode_frame(source)
+
+    assert open(cached, 'rb').read() == before
+    with Image.open(source) as image:
+        assert image.size == (34, 44)
@@ -0,0 +1,60 @@
+import asyncio
+import threading
+
+from aiohttp import web
+
+from utils import pipeline
+from utils.sku_images import SkuImage
+
+
+def serve_sku_images(received):
+    """Сервер загрузки в отдельном потоке: RenderPipeline загружает через свой asyncio.run"""
+    started = threading.Event()
+    state = {}
+
+    async def handler(request):
+        fields = await request.post()
+        received.append(int(fields['sku']))
+        return web.Response(text='ok')
+
+    async def run():
+        app = web.Application()
+        app.router.add_post('/api/product/load_sku_images/', handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', 0).start()
+        state['port'] = runner.addresses[0][1]
+        state['stop'] = asyncio.Event()
+        started.set()
+        await state['stop'].wait()
+        await runner.cleanup()
+
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_until_complete, args=(run(),), daemon=True)
+    thread.start()
+    started.wait(5)
+    return state, lambda: (loop.call_soon_threadsafe(state['stop'].set), thread.join(5))
+
+
+def test_dead_upload_process_falls_back_to_inline(tmp_path, monkeypatch):
+    # Процесс загрузки завершается сразу: подтверждений не будет
+    monkeypatch.setattr(pipeline, 'PIPELINE_PYTHON', 'false')
+    monkeypatch.setattr(pipeline, 'SLOT_POLL_INTERVAL', 0.05)
+    received = []
+    state, stop = serve_sku_images(received)
+    try:
+        render = pipeline.RenderPipeline(upload='sku', encode=False, max_pending=1,
+                                         base_url='http://127.0.0.1:%d' % state['port'])
+        render.process.wait(5)
+        for n in range(3):
+            path = tmp_path / ('%d.png' % n)
+            path.write_bytes(b'frame')
+            render.submit(SkuImage(sku=n, index=0, file_path=str(path)))
+        results = render.close()
+    finally:
+        stop()
+
+    assert render.inline is not None
+    # Первый кадр мог уйти в упавший процесс до того, как stdin закрылся
+    assert results[1:] == [True, True]
+    assert set(received) >= {1, 2}
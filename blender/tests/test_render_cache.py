@@ -0,0 +1,22 @@
+import os
+
+from utils.render_cache import RenderCache
+
+
+def test_existing_output_matches_only_its_own_key(tmp_path):
+    cache = RenderCache(str(tmp_path / 'cache'))
+    output = tmp_path / 'frame.png'
+    output.write_bytes(b'old render')
+    old_key = RenderCache.make_key(material={'color': 'red'})
+    new_key = RenderCache.make_key(material={'color': 'blue'})
+    cache.store(old_key, str(output))
+
+    assert cache.matches(old_key, str(output))
+    assert not cache.matches(new_key, str(output))
+
+    # Копия вместо жесткой ссылки (другая файловая система) сравнивается по содержимому
+    copy = tmp_path / 'copy.png'
+    copy.write_bytes(b'old render')
+    assert cache.matches(old_key, str(copy))
+    os.remove(str(output))
+    assert not cache.matches(old_key, str(output))
@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import random
+
+from aiohttp import web
+
+from mock_server import create_app
+from send_images import BatchUploadManager, UploadManager, UploadTask
+
+logger = logging.getLogger('test_upload')
+
+
+def make_tasks(directory, count, size=1024):
+    tasks = []
+    for n in range(count):
+        path = directory / ('%d.png' % n)
+        path.write_bytes(bytes([n % 256]) * size + n.to_bytes(4, 'big'))
+        tasks.append(UploadTask(material_id=n, file_path=str(path), variant_pk=1, blender_name='part',
+                                model_n=1, camera_n=1))
+    return tasks
+
+
+async def upload(app, manager_class, tasks, **kwargs):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    try:
+        manager = manager_class(logger, backoff=0.001, max_backoff=0.01,
+                                base_url='http://127.0.0.1:%d' % runner.addresses[0][1], **kwargs)
+        results = await manager.process_batch(tasks)
+    finally:
+        await runner.cleanup()
+    return manager, results
+
+
+def recording_app(statuses):
+    """Отвечает статусами по очереди (дальше 200) и запоминает Idempotency-Key запросов"""
+    keys = []
+
+    async def handler(request):
+        await request.read()
+        keys.append(request.headers.get('Idempotency-Key'))
+        status = statuses[len(keys) - 1] if len(keys) <= len(statuses) else 200
+        return web.Response(status=status, headers={'Retry-After': '0'} if status == 429 else {})
+
+    app = web.Application()
+    app.router.add_post('/api/product/load_scene_material/', handler)
+    return app, keys
+
+
+def test_retries_until_success_with_one_idempotency_key(tmp_path):
+    app, keys = recording_app([503, 429, 502])
+    tasks = make_tasks(tmp_path, 1)
+
+    manager, results = asyncio.run(upload(app, UploadManager, tasks))
+
+    assert results == [True]
+    assert manager.retry_count == 3
+    assert len(keys) == 4
+    assert len(set(keys)) == 1 and keys[0] == UploadManager.idempotency_key(tasks[0])
+
+
+def test_client_error_is_not_retried(tmp_path):
+    app, keys = recording_app([400])
+
+    manager, results = asyncio.run(upload(app, UploadManager, make_tasks(tmp_path, 1)))
+
+    assert results == [False]
+    assert manager.retry_count == 0
+    assert manager.failed == 1
+    assert len(keys) == 1
+
+
+def test_gives_up_after_retries(tmp_path):
+    app, keys = recording_app([503] * 10)
+
+    manager, results = asyncio.run(upload(app, UploadManager, make_tasks(tmp_path, 1), retries=2))
+
+    assert results == [False]
+    assert len(keys) == 3
+
+
+def test_flaky_server_receives_every_file(tmp_path):
+    random.seed(3)
+    app = create_app(fail_rate=0.3, drop_rate=0.1)
+    tasks = make_tasks(tmp_path, 30)
+
+    manager, results = asyncio.run(upload(app, UploadManager, tasks, retries=8))
+
+    assert all(results)
+    assert manager.retry_count > 0
+    assert app['stats']['accepted'] - app['stats']['duplicates'] == len(tasks)
+
+
+def test_idempotency_key_depends_on_content_and_reference(tmp_path):
+    task, other = make_tasks(tmp_path, 2)
+    key = UploadManager.idempotency_key(task)
+
+    assert UploadManager.idempotency_key(task) == key
+    assert UploadManager.idempotency_key(other) != key
+    task.same_as = other.material_id
+    assert UploadManager.idempotency_key(task) == key + '-ref%d' % other.material_id
+
+
+def test_413_caps_batch_size(tmp_path):
+    app = create_app(max_batch=5)
+    tasks = make_tasks(tmp_path, 120)
+
+    manager, results = asyncio.run(upload(app, BatchUploadManager, tasks, max_concurrent_uploads=2,
+                                          batch_size=8, target_latency=10))
+
+    assert all(results)
+    assert manager.max_batch <= 5
+    assert manager.batch_size <= 5
+    # Отказы только пока лимит не найден, а не после каждого роста пачки
+    assert app['stats']['rejected_batches'] <= 2
+    assert app['stats']['batches'] >= len(tasks) / 5
+
+
+def test_aimd_grows_on_fast_and_halves_on_slow_batches():
+    manager = BatchUploadManager(logger, batch_size=8, min_batch=2, max_batch=32, target_latency=2.0)
+
+    manager.adapt(0.5, True)
+    assert manager.batch_size == 16
+    manager.adapt(0.5, True)
+    manager.adapt(0.5, True)
+    assert manager.batch_size == 32
+    manager.adapt(1.5, True)
+    assert manager.batch_size == 32
+    manager.adapt(3.0, True)
+    assert manager.batch_size == 16
+    manager.adapt(0.1, False)
+    manager.adapt(0.1, False)
+    manager.adapt(0.1, False)
+    assert manager.batch_size == 2
+
+
+def test_batch_falls_back_to_single_uploads(tmp_path):
+    app = create_app(batch=False)
+    tasks = make_tasks(tmp_path, 10)
+
+    manager, results = asyncio.run(upload(app, BatchUploadManager, tasks))
+
+    assert all(results)
+    assert not manager.batch_supported
+    assert app['stats']['accepted'] == len(tasks)
+
+
+def test_crop_and_size_are_sent_with_single_and_batch_uploads(tmp_path):
+    for manager_class in (UploadManager, BatchUploadManager):
+        app = create_app()
+        tasks = make_tasks(tmp_path, 3)
+        tasks[0].crop, tasks[0].size = [10, 20, 300, 400], [1950, 1300]
+        tasks[1].size = [1950, 1300]
+
+        manager, results = asyncio.run(upload(app, manager_class, tasks))
+
+        assert all(results)
+        assert app['layouts'] == {'0': {'crop': [10, 20, 300, 400], 'size': [1950, 1300]},
+                                  '1': {'size': [1950, 1300]}}
+
+
+def test_rejected_reference_on_last_attempt_still_sends_file(tmp_path):
+    # 503, 503, затем ссылка отклонена на последней попытке - файл все равно отправляется
+    app, keys = recording_app([503, 503, 409])
+    tasks = make_tasks(tmp_path, 1)
+    tasks[0].same_as = 99
+
+    manager, results = asyncio.run(upload(app, UploadManager, tasks, retries=2))
+
+    assert results == [True]
+    assert tasks[0].same_as is None
+    assert len(keys) == 4
+    assert keys[-1] == UploadManager.idempotency_key(tasks[0])
@@ -4,25 +4,60 @@ from math import radians
 import bpy
 
 
-def create_camera(location, rotation):
-    # Удаляем все камеры в сцене
-    for obj in bpy.context.scene.objects:
-        if obj.type == 'CAMERA':
-            bpy.data.objects.remove(obj, do_unlink=True)
-
-    # Создаем новую камеру
-    camera_data = bpy.data.cameras.new(name="Camera")
-    camera_object = bpy.data.objects.new("Camera", camera_data)
+def get_camera_object(name):
+    # Камера создается один раз и переиспользуется, положение обновляется
+    camera_object = bpy.data.objects.get(name)
+    if camera_object is None or camera_object.type != 'CAMERA':
+        camera_data = bpy.data.cameras.new(name=name)
+        camera_object = bpy.data.objects.new(name, camera_data)
+    if bpy.context.scene.objects.get(camera_object.name) is None:
+        bpy.context.collection.objects.link(camera_object)
+    return camera_object
 
-    # Link the camera object to the scene
-    bpy.context.collection.objects.link(camera_object)
 
-    # Set the scene's camera to the newly created camera
+def set_active_camera(camera_object):
+    # Маркеры переключают камеру при смене кадра - для одиночного кадра убираем их
+    bpy.context.scene.timeline_markers.clear()
     bpy.context.scene.camera = camera_object
 
-    # Optionally, set the camera location and rotation
+
+def create_camera(location, rotation, name='Camera'):
+    camera_object = get_camera_object(name)
     camera_object.location = location
     camera_object.rotation_euler = rotation
+    set_active_camera(camera_object)
+    return camera_object
+
+
+def create_cameras(cameras):
+    """cameras - {номер: данные камеры из model_3d}, возвращает {номер: объект}"""
+    camera_objects = {}
+    for n, camera in cameras.items():
+        camera_object = get_camera_object('Camera_%d' % n)
+        camera_object.location, camera_object.rotation_euler = get_camera_location(camera)
+        camera_objects[n] = camera_object
+
+    # Камеры прошлой модели, которых нет в текущей
+    used = {obj.name for obj in camera_objects.values()}
+    for obj in list(bpy.context.scene.objects):
+        if obj.type == 'CAMERA' and obj.name.startswith('Camera_') and obj.name not in used:
+            bpy.data.objects.remove(obj, do_unlink=True)
+
+    return camera_objects
+
+
+def bind_cameras(camera_objects):
+    """Кадр n рендерится камерой camera_objects[n - 1] через маркеры таймлайна"""
+    scene = bpy.context.scene
+    scene.timeline_markers.clear()
+    for frame, camera_object in enumerate(camera_objects, 1):
+        marker = scene.timeline_markers.new('F_%d' % frame, frame=frame)
+        marker.camera = camera_object
+
+    scene.frame_start = 1
+    scene.frame_end = len(camera_objects)
+    scene.frame_set(1)
+    scene.camera = camera_objects[0]
 
 
 def get_camera_location(camera):
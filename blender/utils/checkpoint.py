@@ -0,0 +1,99 @@
+"""
+Журнал запусков рендера в SQLite (media/cache/checkpoints.sqlite3).
+
+Запуск (run) хранит ids, пресет и write_anyway; для каждого продукта
+сохраняется план - список единиц рендера. Готовая единица отмечается одной
+транзакцией вместе с sha256 файла и временем рендера. Продолжение запуска
+(resume.py) берет из журнала неготовые единицы и не обходит media/.
+"""
+import json
+import os
+import sqlite3
+import time
+
+from utils.render_cache import file_hash
+
+CHECKPOINT_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'media', 'cache', 'checkpoints.sqlite3'
+)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ids TEXT NOT NULL,
+    preset TEXT NOT NULL,
+    write_anyway INTEGER NOT NULL,
+    started REAL NOT NULL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS units (
+    run_id INTEGER NOT NULL,
+    unit_id TEXT NOT NULL,
+    pk INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    sha256 TEXT,
+    seconds REAL,
+    finished REAL,
+    PRIMARY KEY (run_id, unit_id)
+);
+'''
+
+
+class CheckpointStore:
+    def __init__(self, path=CHECKPOINT_PATH):
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        # WAL: запись единицы - одна короткая транзакция, падение Blender ее не портит
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+
+    def start_run(self, ids, preset, write_anyway):
+        with self.db:
+            cursor = self.db.execute(
+                'INSERT INTO runs (ids, preset, write_anyway, started) VALUES (?, ?, ?, ?)',
+                (','.join(str(i) for i in ids), preset, int(write_anyway), time.time())
+            )
+        return cursor.lastrowid
+
+    def finish_run(self, run_id):
+        with self.db:
+            self.db.execute('UPDATE runs SET finished = ? WHERE id = ?', (time.time(), run_id))
+
+    def get_run(self, run_id=None):
+        """Запуск по id, по умолчанию - последний незавершенный"""
+        if run_id is None:
+            row = self.db.execute('SELECT * FROM runs WHERE finished IS NULL ORDER BY id DESC LIMIT 1').fetchone()
+        else:
+            row = self.db.execute('SELECT * FROM runs WHERE id = ?', (run_id,)).fetchone()
+        return dict(row) if row else None
+
+    def plan(self, run_id, units):
+        with self.db:
+            self.db.executemany(
+                'INSERT OR IGNORE INTO units (run_id, unit_id, pk, data) VALUES (?, ?, ?, ?)',
+                [(run_id, u.id, u.pk, json.dumps(u.to_dict())) for u in units]
+            )
+
+    def pending(self, run_id, pk):
+        """Неготовые единицы продукта или None, если продукт в этом запуске не планировался"""
+        rows = self.db.execute('SELECT data, finished FROM units WHERE run_id = ? AND pk = ?', (run_id, pk)).fetchall()
+        if not rows:
+            return None
+        return [json.loads(row['data']) for row in rows if row['finished'] is None]
+
+    def record(self, run_id, unit, file_path, seconds):
+        with self.db:
+            self.db.execute(
+                'UPDATE units SET sha256 = ?, seconds = ?, finished = ? WHERE run_id = ? AND unit_id = ?',
+                (file_hash(file_path), seconds, time.time(), run_id, unit.id)
+            )
+
+    def stats(self, run_id):
+        row = self.db.execute(
+            'SELECT COUNT(*) AS units, COUNT(finished) AS done, SUM(seconds) AS seconds FROM units WHERE run_id = ?',
+            (run_id,)
+        ).fetchone()
+        return dict(row)
@@ -1,10 +1,15 @@
+import os
+
 import bpy
 import platform
 
 import settings
+from utils.presets import get_preset
+from utils.render_cache import file_hash
 
 
 hdri_path = 'recources/world.exr'
+current_preset = None
 
 
 def create_hdr_scene():
@@ -89,8 +94,42 @@ def create_new_scene():
     world.color = (1, 1, 1)
 
 
+def enable_devices(devices):
+    # Воркер пула может быть закреплен за одним устройством
+    for n, device in enumerate(devices):
+        device.use = settings.render_device is None or n == settings.render_device
+        if device.use:
+            print(f"  Включено: {device.name}")
+
+
+def customize_cpu_render():
+    # Профиль для CPU нод и CI: адаптивный сэмплинг, OIDN, потоки по числу ядер
+    scene = bpy.context.scene
+    threads = settings.cpu_threads or os.cpu_count()
+    print(f"Используем CPU ({threads} потоков)")
+
+    bpy.context.preferences.addons['cycles'].preferences.compute_device_type = 'NONE'
+    scene.cycles.device = 'CPU'
+
+    scene.cycles.use_adaptive_sampling = True
+    scene.cycles.adaptive_threshold = settings.cpu_noise_threshold
+    scene.cycles.adaptive_min_samples = 0
+
+    scene.cycles.use_denoising = True
+    scene.cycles.denoiser = 'OPENIMAGEDENOISE'
+    print("  Деноизер: OpenImageDenoise")
+
+    scene.cycles.use_auto_tile = True
+    scene.cycles.tile_size = settings.cpu_tile_size
+
+    scene.render.threads_mode = 'FIXED'
+    scene.render.threads = threads
+
+    # 0 - без ограничения времени на кадр
+    scene.cycles.time_limit = settings.cpu_time_limit
+
+
 def customize_render():
-    size = 1 * 0.65
     bpy.context.scene.render.engine = 'CYCLES'
 
     bpy.context.preferences.addons['cycles'].preferences.refresh_devices()
@@ -101,10 +140,13 @@ def customize_render():
     for d in gpu_devices:
         print(f"  {d.name}, type: {d.type}")
 
-    if not gpu_devices:
+    if not gpu_devices and not settings.allow_cpu_render:
         raise RuntimeError("Не найдено ни одного GPU устройства! Рендеринг на CPU запрещен.")
 
-    bpy.context.scene.cycles.device = 'GPU'
+    if not gpu_devices:
+        customize_cpu_render()
+    else:
+        bpy.context.scene.cycles.device = 'GPU'
 
     optix_devices = [d for d in gpu_devices if d.type == 'OPTIX']
     metal_devices = [d for d in gpu_devices if d.type == 'METAL']
@@ -113,9 +155,7 @@ def customize_render():
     if optix_devices:
         print("Используем OPTIX устройства (самый быстрый вариант)")
         bpy.context.preferences.addons['cycles'].preferences.compute_device_type = 'OPTIX'
-        for device in optix_devices:
-            device.use = True
-            print(f"  Включено: {device.name}")
+        enable_devices(optix_devices)
         
         available_denoisers = list(bpy.context.scene.cycles.bl_rna.properties['denoiser'].enum_items.keys())
         if 'OPTIX' in available_denoisers:
@@ -128,9 +168,7 @@ def customize_render():
     elif metal_devices:
         print("Используем METAL устройства (Apple)")
         bpy.context.preferences.addons['cycles'].preferences.compute_device_type = 'METAL'
-        for device in metal_devices:
-            device.use = True
-            print(f"  Включено: {device.name}")
+        enable_devices(metal_devices)
         
         available_denoisers = list(bpy.context.scene.cycles.bl_rna.properties['denoiser'].enum_items.keys())
         if 'OPENIMAGEDENOISE' in available_denoisers:
@@ -140,9 +178,7 @@ def customize_render():
     elif cuda_devices:
         print("Используем CUDA устройства")
         bpy.context.preferences.addons['cycles'].preferences.compute_device_type = 'CUDA'
-        for device in cuda_devices:
-            device.use = True
-            print(f"  Включено: {device.name}")
+        enable_devices(cuda_devices)
         
         available_denoisers = list(bpy.context.scene.cycles.bl_rna.properties['denoiser'].enum_items.keys())
         if 'OPENIMAGEDENOISE' in available_denoisers:
@@ -151,12 +187,59 @@ def customize_render():
 
     bpy.context.preferences.addons['cycles'].preferences.refresh_devices()
 
-    bpy.context.scene.cycles.samples = 200
-
-    bpy.context.scene.render.resolution_x = int(3000 * size)
-    bpy.context.scene.render.resolution_y = int(2000 * size)
-    bpy.context.scene.render.image_settings.file_format = 'PNG'
+    apply_preset(settings.render_preset)
     bpy.context.scene.render.film_transparent = True
+    bpy.context.scene.render.use_persistent_data = settings.use_persistent_data
+
+
+def apply_preset(name):
+    global current_preset
+
+    preset = get_preset(name)
+    scene = bpy.context.scene
+
+    scene.cycles.samples = preset['samples']
+    scene.cycles.use_adaptive_sampling = True
+    threshold = preset['noise_threshold']
+    if scene.cycles.device == 'CPU':
+        threshold = max(threshold, settings.cpu_noise_threshold)
+    scene.cycles.adaptive_threshold = threshold
+    scene.cycles.use_denoising = preset['denoise']
+
+    scene.cycles.max_bounces = preset['bounces']['max']
+    scene.cycles.diffuse_bounces = preset['bounces']['diffuse']
+    scene.cycles.glossy_bounces = preset['bounces']['glossy']
+    scene.cycles.transmission_bounces = preset['bounces']['transmission']
+
+    scene.render.resolution_x, scene.render.resolution_y = preset['resolution']
+    scene.render.image_settings.file_format = preset['file_format']
+
+    current_preset = name
+    print(f"Render preset: {name}")
+
+
+def render_settings():
+    # Настройки, влияющие на результат рендера (часть ключа кэша рендеров)
+    scene = bpy.context.scene
+    return {
+        'engine': scene.render.engine,
+        'device': scene.cycles.device,
+        'samples': scene.cycles.samples,
+        'bounces': [scene.cycles.max_bounces, scene.cycles.diffuse_bounces, scene.cycles.glossy_bounces,
+                    scene.cycles.transmission_bounces],
+        'denoise': scene.cycles.use_denoising,
+        'adaptive': [scene.cycles.use_adaptive_sampling, scene.cycles.adaptive_threshold],
+        'time_limit': scene.cycles.time_limit,
+        'denoiser': scene.cycles.denoiser,
+        'blur_glossy': scene.cycles.blur_glossy,
+        'resolution': [scene.render.resolution_x, scene.render.resolution_y, scene.render.resolution_percentage],
+        'file_format': scene.render.image_settings.file_format,
+        'film_transparent': scene.render.film_transparent,
+        'filter_size': scene.render.filter_size,
+        'hdri': file_hash(hdri_path) if os.path.exists(hdri_path) else None,
+        # Текстуры уменьшаются до этого размера (utils/materials/preprocess.py) - меняются пиксели кадра
+        'texture_max_size': settings.texture_max_size,
+    }
 
 
 def create_light(coords=(8, -4, 8)):
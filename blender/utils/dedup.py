@@ -0,0 +1,158 @@
+"""
+Поиск одинаковых кадров перед загрузкой.
+
+Разные материалы часто дают одинаковую картинку (один цвет у разных SKU).
+Хэш считается по пикселям RGBA, а не по байтам PNG, поэтому разное сжатие
+не мешает. Перцептивный режим сравнивает dHash (форма) и средний цвет: dHash
+сам по себе не различает цвета, а здесь различие как раз в цвете.
+
+Обе проверки учитывают положение части в кадре (рамка по альфе и размер
+кадра): разные части одного серого цвета дают похожий dHash и тот же средний
+цвет, но лежат в разных местах. Для кадров, обрезанных utils/encode.py, рамка
+берется из задачи загрузки (crop, size).
+
+Для повтора на сервер уходит ссылка same_as=<scene_material уже загруженного
+кадра> вместо файла. Индекс загруженных кадров хранится в
+media/cache/dedup_index.json и переживает запуски.
+"""
+import hashlib
+import json
+import os
+
+from PIL import Image, ImageStat
+
+MODES = ('off', 'exact', 'perceptual')
+
+
+def layout(image, crop=None, size=None):
+    """[x, y, w, h, W, H] - непрозрачная часть в исходном кадре"""
+    if crop and size:
+        return list(crop) + list(size)
+    bbox = image.convert('RGBA').getchannel('A').getbbox() or (0, 0, 0, 0)
+    return [bbox[0], bbox[1], bbox[2] - bbox[0], bbox[3] - bbox[1]] + list(image.size)
+
+
+def pixel_hash(image, crop=None):
+    digest = hashlib.sha256(('%dx%d' % image.size).encode())
+    if crop:
+        # Одинаковые пиксели в разных местах кадра - разные кадры
+        digest.update(json.dumps(list(crop)).encode())
+    digest.update(image.convert('RGBA').tobytes())
+    return digest.hexdigest()
+
+
+def dhash(image, size=8):
+    # Разница соседних пикселей уменьшенной копии, прозрачное - на белом фоне
+    background = Image.new('RGBA', image.size, (255, 255, 255, 255))
+    gray = Image.alpha_composite(background, image.convert('RGBA')).convert('L')
+    pixels = list(gray.resize((size + 1, size), Image.LANCZOS).getdata())
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            value = value << 1 | (pixels[row * (size + 1) + col] > pixels[row * (size + 1) + col + 1])
+    return value
+
+
+def mean_color(image):
+    rgba = image.convert('RGBA')
+    alpha = rgba.getchannel('A')
+    if alpha.getbbox() is None:
+        return [0.0, 0.0, 0.0]
+    # Средний цвет только по непрозрачным пикселям
+    return [round(v, 1) for v in ImageStat.Stat(rgba.convert('RGB'), mask=alpha).mean]
+
+
+class DedupIndex:
+    def __init__(self, path, mode='exact', max_distance=4, color_tolerance=2.0):
+        self.path = path
+        self.mode = mode
+        self.max_distance = max_distance
+        self.color_tolerance = color_tolerance
+        self.exact = {}
+        self.perceptual = []
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                data = json.load(file)
+            self.exact = data.get('exact', {})
+            self.perceptual = data.get('perceptual', [])
+
+    def fingerprint(self, file_path, crop=None, size=None):
+        """crop, size - рамка обрезки и исходный размер, если кадр обрезан по альфе"""
+        with Image.open(file_path) as image:
+            image.load()
+        if self.mode == 'perceptual':
+            # dHash по непрозрачной части: форма сравнивается без пустых полей кадра
+            bbox = image.convert('RGBA').getchannel('A').getbbox()
+            cropped = image.crop(bbox) if bbox else image
+            return {'hash': pixel_hash(image, crop), 'dhash': dhash(cropped), 'color': mean_color(image),
+                    'layout': layout(image, crop, size)}
+        return {'hash': pixel_hash(image, crop)}
+
+    def lookup(self, fingerprint):
+        """scene_material уже загруженного такого же кадра или None"""
+        if fingerprint['hash'] in self.exact:
+            return self.exact[fingerprint['hash']]
+
+        if self.mode == 'perceptual':
+            for entry in self.perceptual:
+                if len(entry) < 4:
+                    # Запись индекса без рамки - положение части неизвестно
+                    continue
+                value, color, scene_material, entry_layout = entry
+                if entry_layout == fingerprint['layout'] and \
+                        bin(value ^ fingerprint['dhash']).count('1') <= self.max_distance and \
+                        max(abs(a - b) for a, b in zip(color, fingerprint['color'])) <= self.color_tolerance:
+                    return scene_material
+        return None
+
+    def add(self, fingerprint, scene_material):
+        # Материал загружается заново с другими пикселями: прежние записи указывали бы на новую картинку
+        self.discard(scene_material)
+        self.exact.setdefault(fingerprint['hash'], scene_material)
+        if self.mode == 'perceptual':
+            self.perceptual.append([fingerprint['dhash'], fingerprint['color'], scene_material,
+                                    fingerprint['layout']])
+
+    def discard(self, scene_material):
+        # Оригинал не загрузился - на него нельзя ссылаться
+        self.exact = {k: v for k, v in self.exact.items() if v != scene_material}
+        self.perceptual = [entry for entry in self.perceptual if entry[2] != scene_material]
+
+    def save(self):
+        if not os.path.exists(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump({'exact': self.exact, 'perceptual': self.perceptual}, file)
+        os.replace(tmp_path, self.path)
+
+
+def split_duplicates(index, tasks):
+    """
+    Делит задачи загрузки на оригиналы и ссылки.
+
+    Возвращает (originals, references): у ссылок заполнен same_as.
+    Если оригинал еще не загружен, same_as - id задачи-оригинала из этой же пачки,
+    такие ссылки отправляются после оригиналов.
+    """
+    originals, references = [], []
+    for task in tasks:
+        fingerprint = index.fingerprint(task.file_path, task.crop, task.size)
+
+        same_as = index.lookup(fingerprint)
+        if same_as is not None and same_as != task.material_id:
+            task.same_as = same_as
+            references.append(task)
+        else:
+            originals.append(task)
+            # В индекс сразу, чтобы повторы из этой же пачки ссылались на него;
+            # если загрузка не удастся, upload_product уберет его (index.discard)
+            index.add(fingerprint, task.material_id)
+
+    return originals, references
+
+
+def print_report(pk, originals, references):
+    total = len(originals) + len(references)
+    ratio = len(references) / total if total else 0
+    print(f"Dedup id{pk}: {total} frames, {len(originals)} unique, {len(references)} references ({ratio:.0%})")
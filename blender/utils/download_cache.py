@@ -0,0 +1,191 @@
+"""
+Дисковый кэш загрузок по URL.
+
+Повторные запросы идут с If-None-Match / If-Modified-Since, ответ пишется
+потоком во временный файл и атомарно переименовывается. Размер кэша
+ограничен, старые файлы удаляются по LRU.
+
+Кэш общий для воркеров пула и нод: index.json меняется только под файловой
+блокировкой index.lock, перед записью индекс перечитывается с диска, чтобы
+не затереть записи других процессов. Файлы, выданные недавно (EVICT_MIN_AGE),
+не удаляются - их может читать другой процесс.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: только блокировка между потоками одного процесса
+    fcntl = None
+
+CHUNK_SIZE = 1024 * 1024
+EVICT_MIN_AGE = 600
+
+
+class DownloadCache:
+    def __init__(self, cache_dir, max_bytes, timeout=60):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.index_path = os.path.join(cache_dir, 'index.json')
+        self.lock_path = os.path.join(cache_dir, 'index.lock')
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+        self.index = self.load_index()
+
+    def load_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        with open(self.index_path, 'r') as file:
+            return json.load(file)
+
+    @contextmanager
+    def index_lock(self):
+        """Блокировка индекса между потоками и процессами, индекс перечитывается с диска"""
+        with self.lock:
+            with open(self.lock_path, 'a') as lock_file:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    self.index = self.load_index()
+                    yield self.index
+                finally:
+                    if fcntl:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def save_index(self):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.json')
+        with os.fdopen(fd, 'w') as file:
+            json.dump(self.index, file)
+        os.replace(tmp_path, self.index_path)
+
+    def file_path(self, url):
+        ext = os.path.splitext(url.split('?')[0])[1]
+        return os.path.join(self.cache_dir, hashlib.sha1(url.encode()).hexdigest() + ext)
+
+    def get(self, url):
+        """Путь к локальной копии и sha256 содержимого, (None, None) при ошибке"""
+        with self.index_lock() as index:
+            entry = index.get(url)
+        path = self.file_path(url)
+
+        headers = {}
+        if entry and os.path.exists(path):
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        else:
+            entry = None
+
+        try:
+            with requests.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+                if response.status_code == 304 and entry:
+                    result = self.touch(url, path, entry)
+                    if result is not None:
+                        self.hits += 1
+                        return result
+                    # Файл удалил другой процесс между запросом и ответом - качаем заново
+                    return self.get(url)
+
+                if response.status_code != 200:
+                    print(f"Failed to fetch {url}. Status code: {response.status_code}")
+                    return (path, entry['sha256']) if entry else (None, None)
+
+                self.misses += 1
+                sha256, size = self.stream_to_file(response, path)
+                entry = {
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified'),
+                    'sha256': sha256,
+                    'size': size,
+                }
+        except requests.exceptions.RequestException as e:
+            if entry is None:
+                raise
+            # Сервер недоступен - отдаем последнюю сохраненную копию
+            print(f"Using cached {url}: {e}")
+            result = self.touch(url, path, entry)
+            if result is None:
+                raise
+            self.stale += 1
+            return result
+
+        with self.index_lock() as index:
+            entry['used'] = time.time()
+            index[url] = entry
+            self.evict(keep=url)
+            self.save_index()
+
+        return path, entry['sha256']
+
+    def stream_to_file(self, response, path):
+        digest = hashlib.sha256()
+        size = 0
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    file.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        return digest.hexdigest(), size
+
+    def touch(self, url, path, entry):
+        """Отметка использования; None, если файл тем временем удален другим процессом"""
+        with self.index_lock() as index:
+            if not os.path.exists(path):
+                index.pop(url, None)
+                self.save_index()
+                return None
+            entry = dict(index.get(url, entry), used=time.time())
+            index[url] = entry
+            self.save_index()
+        return path, entry['sha256']
+
+    def evict(self, keep=None):
+        # Вызывается под index_lock: used других процессов уже в индексе
+        total = sum(entry['size'] for entry in self.index.values())
+        min_used = time.time() - EVICT_MIN_AGE
+
+        for url, entry in sorted(self.index.items(), key=lambda i: i[1].get('used', 0)):
+            if total <= self.max_bytes:
+                break
+            if url == keep or entry.get('used', 0) > min_used:
+                continue
+
+            path = self.file_path(url)
+            if os.path.exists(path):
+                os.remove(path)
+            total -= entry['size']
+            del self.index[url]
+            print(f"Evicted from cache: {url}")
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'stale': self.stale,
+            'files': len(self.index),
+            'bytes': sum(entry['size'] for entry in self.index.values()),
+        }
@@ -0,0 +1,150 @@
+"""
+Кодирование готовых кадров.
+
+Кадр части - RGBA PNG во весь кадр, большая часть пикселей прозрачна из-за
+holdout. Кадр обрезается по рамке непрозрачных пикселей, смещение и исходный
+размер попадают в манифест (images.json: [материал, файл, {"crop": [x, y, w, h],
+"size": [W, H]}]), чтобы фронтенд мог совместить части. PNG пересохраняется
+с максимальным сжатием, рядом можно записать WebP / AVIF.
+
+Проверка без Blender: python -m utils.encode --formats webp,avif --out /tmp/encoded media/variant_12/**/*.png
+"""
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from PIL import Image, features
+
+FORMAT_OPTIONS = {
+    'png': {'format': 'PNG', 'optimize': True},
+    'webp': {'format': 'WEBP', 'quality': 90, 'alpha_quality': 100, 'method': 6},
+    'avif': {'format': 'AVIF', 'quality': 80, 'speed': 6},
+}
+
+
+@dataclass
+class EncodeResult:
+    path: str
+    size: List[int]
+    crop: Optional[List[int]]
+    source_bytes: int
+    bytes: int
+    variants: Dict[str, str] = field(default_factory=dict)
+    variant_bytes: Dict[str, int] = field(default_factory=dict)
+    seconds: float = 0.0
+
+    def manifest_extra(self):
+        extra = {'size': self.size}
+        if self.crop:
+            extra['crop'] = self.crop
+        if self.variants:
+            extra['variants'] = {fmt: os.path.basename(path) for fmt, path in self.variants.items()}
+        return extra
+
+
+def available_formats(formats):
+    result = []
+    for fmt in formats:
+        if fmt != 'png' and not features.check(fmt):
+            print('Pillow is built without %s support, skipping' % fmt)
+            continue
+        result.append(fmt)
+    return result
+
+
+def alpha_bbox(image, threshold=0):
+    alpha = image.getchannel('A')
+    if threshold:
+        alpha = alpha.point(lambda a: 255 if a > threshold else 0)
+    return alpha.getbbox()
+
+
+def save_image(image, path, fmt):
+    tmp_path = '%s.tmp.%s' % (os.path.splitext(path)[0], fmt)
+    image.save(tmp_path, **FORMAT_OPTIONS[fmt])
+    os.replace(tmp_path, path)
+
+
+def encode_frame(path, formats=(), crop=True, out_path=None, padding=2):
+    """Обрезка по альфе и сжатие; out_path - писать в другой файл, исходный не трогать"""
+    start_time = time.time()
+    out_path = out_path or path
+    source_bytes = os.path.getsize(path)
+
+    with Image.open(path) as image:
+        image.load()
+    size = list(image.size)
+
+    crop_rect = None
+    if crop and 'A' in image.getbands():
+        bbox = alpha_bbox(image)
+        if bbox is None:
+            # Часть не видна с этой камеры - оставляем один прозрачный пиксель
+            bbox = (0, 0, 1, 1)
+        else:
+            bbox = (max(0, bbox[0] - padding), max(0, bbox[1] - padding),
+                    min(image.width, bbox[2] + padding), min(image.height, bbox[3] + padding))
+        crop_rect = [bbox[0], bbox[1], bbox[2] - bbox[0], bbox[3] - bbox[1]]
+        image = image.crop(bbox)
+
+    if out_path != path and not os.path.exists(os.path.dirname(out_path) or '.'):
+        os.makedirs(os.path.dirname(out_path))
+    save_image(image, out_path, 'png')
+
+    result = EncodeResult(out_path, size, crop_rect, source_bytes, os.path.getsize(out_path))
+    for fmt in formats:
+        if fmt == 'png':
+            continue
+        variant_path = '%s.%s' % (os.path.splitext(out_path)[0], fmt)
+        save_image(image, variant_path, fmt)
+        result.variants[fmt] = variant_path
+        result.variant_bytes[fmt] = os.path.getsize(variant_path)
+
+    result.seconds = time.time() - start_time
+    return result
+
+
+def print_report(results):
+    if not results:
+        return
+
+    source = sum(r.source_bytes for r in results)
+    png = sum(r.bytes for r in results)
+    line = f"Encoded {len(results)} frames in {sum(r.seconds for r in results):.1f}s: " \
+           f"{source / 1024 ** 2:.1f} MB -> png {png / 1024 ** 2:.1f} MB ({png / max(source, 1):.0%})"
+    for fmt in sorted({fmt for r in results for fmt in r.variant_bytes}):
+        total = sum(r.variant_bytes.get(fmt, 0) for r in results)
+        line += f", {fmt} {total / 1024 ** 2:.1f} MB ({total / max(source, 1):.0%})"
+    print(line)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--formats', default='', help='webp,avif')
+    parser.add_argument('--no-crop', action='store_true')
+    parser.add_argument('--out', default=None, help='папка для результатов, иначе файлы заменяются')
+    args = parser.parse_args()
+
+    formats = available_formats([f for f in args.formats.split(',') if f])
+    # Структура папок сохраняется: у кадров разных частей одинаковые имена файлов
+    root = os.path.commonpath([os.path.abspath(path) for path in args.files])
+    if len(args.files) == 1:
+        root = os.path.dirname(root)
+
+    results = []
+    for path in args.files:
+        out_path = os.path.join(args.out, os.path.relpath(os.path.abspath(path), root)) if args.out else None
+        result = encode_frame(path, formats, crop=not args.no_crop, out_path=out_path)
+        print(f"  {os.path.basename(path)}: {result.size} crop {result.crop}, "
+              f"{result.source_bytes / 1024:.0f} -> {result.bytes / 1024:.0f} KB "
+              + ' '.join(f"{fmt} {b / 1024:.0f} KB" for fmt, b in result.variant_bytes.items()))
+        results.append(result)
+    print_report(results)
+
+
+if __name__ == '__main__':
+    main()
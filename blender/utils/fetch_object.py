@@ -1,30 +1,116 @@
-from io import BytesIO
+import os
 
 import bpy
-import requests
-import os
 
-from settings import media_path
+from settings import media_path, obj_cache_max_bytes, use_mesh_cache
+from utils.download_cache import DownloadCache
+from utils.mesh_cache import library_key, library_path, save_library, load_library, collect_model
+from utils.render_cache import link_file
+
+obj_cache = DownloadCache(os.path.join(media_path, 'cache', 'obj'), obj_cache_max_bytes)
+blend_cache_dir = os.path.join(media_path, 'cache', 'blend')
+
+# URL и хэш модели, которая сейчас загружена в сцену
+loaded_obj_url = None
+loaded_obj_hash = None
+loaded_model_key = None
 
 
-def fetch_and_save_obj(pk, obj_url):
+def clear_model():
+    global loaded_model_key
+
     bpy.ops.object.select_all(action='DESELECT')
     bpy.ops.object.select_by_type(type='LIGHT')
     bpy.ops.object.select_by_type(type='MESH')
     bpy.ops.object.delete()
 
-    response = requests.get(obj_url)
-    if response.status_code == 200:
-        obj_file_path = os.path.join(media_path, 'variant_%d' % pk, 'model.obj')
+    # Удаляем все существующие коллекции, кроме коллекции по умолчанию
+    for collection in bpy.data.collections:
+        if collection.name != "Collection":
+            bpy.data.collections.remove(collection)
+
+    for mesh in list(bpy.data.meshes):
+        if mesh.users == 0:
+            bpy.data.meshes.remove(mesh)
+
+    loaded_model_key = None
+
+
+def add_objects_to_collections(parts):
+    # Удаляем все существующие коллекции, кроме коллекции по умолчанию
+    for collection in bpy.data.collections:
+        if collection.name != "Collection":
+            bpy.data.collections.remove(collection)
+
+    for part in parts:
+        new_collection = bpy.data.collections.new(part['blender_name'])
+        bpy.context.scene.collection.children.link(new_collection)
+
+        for obj in bpy.context.scene.objects:
+            if obj.type == 'MESH' and obj.name.split('.')[0].lower() == part['blender_name']:
+                new_collection.objects.link(obj)
+
+
+def import_obj(pk, cached_path):
+    clear_model()
 
-        if not os.path.exists(os.path.dirname(obj_file_path)):
-            os.makedirs(os.path.dirname(obj_file_path))
+    obj_file_path = os.path.join(media_path, 'variant_%d' % pk, 'model.obj')
+    link_file(cached_path, obj_file_path)
+    print(f"File saved successfully at: {obj_file_path}")
 
-        with open(obj_file_path, 'wb') as obj_file:
-            obj_file.write(response.content)
+    bpy.ops.wm.obj_import(filepath=obj_file_path)
 
-        print(f"File saved successfully at: {obj_file_path}")
 
-        bpy.ops.wm.obj_import(filepath=obj_file_path)
+def fetch_and_save_obj(pk, obj_url, reuse_loaded=False):
+    global loaded_obj_url, loaded_obj_hash
+
+    cached_path, obj_hash = obj_cache.get(obj_url)
+    print(f"OBJ cache: {obj_cache.stats()}")
+
+    if cached_path is None:
+        print(f"Failed to fetch object from {obj_url}")
+        return
+
+    if reuse_loaded and loaded_obj_url == obj_url and loaded_obj_hash == obj_hash:
+        print(f"Model already loaded: {obj_url}")
+        return
+
+    import_obj(pk, cached_path)
+    loaded_obj_url = obj_url
+    loaded_obj_hash = obj_hash
+
+
+def load_model(pk, obj_url, parts, reuse_loaded=False):
+    """Загрузка модели с разбивкой по коллекциям частей, через кэш .blend библиотек"""
+    global loaded_obj_url, loaded_obj_hash, loaded_model_key
+
+    if not use_mesh_cache:
+        fetch_and_save_obj(pk, obj_url, reuse_loaded)
+        add_objects_to_collections(parts)
+        return
+
+    cached_path, obj_hash = obj_cache.get(obj_url)
+    if cached_path is None:
+        print(f"Failed to fetch object from {obj_url}")
+        return
+
+    part_names = [part['blender_name'] for part in parts]
+    key = library_key(obj_hash, part_names)
+
+    if reuse_loaded and loaded_model_key == key:
+        print(f"Model already loaded: {obj_url}")
+        return
+
+    path = library_path(blend_cache_dir, key)
+    if os.path.exists(path):
+        clear_model()
+        load_library(path)
     else:
-        print(f"Failed to fetch object from {obj_url}. Status code: {response.status_code}")
\ No newline at end of file
+        import_obj(pk, cached_path)
+        add_objects_to_collections(parts)
+        collect_model(bpy.context.scene.objects)
+        save_library(path, part_names)
+
+    loaded_obj_url = obj_url
+    loaded_obj_hash = obj_hash
+    loaded_model_key = key
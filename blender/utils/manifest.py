@@ -0,0 +1,118 @@
+"""
+Журнал отрендеренных изображений варианта.
+
+Каждый кадр дописывается одной строкой в images.jsonl (append + fsync), без
+перечитывания файла. images.json в прежнем вложенном формате собирается
+отдельным шагом compact(): python -m utils.manifest media/variant_12
+"""
+import json
+import os
+import sys
+
+# Поля записи, которые попадают в images.json третьим элементом: [материал, файл, {...}]
+IMAGE_FIELDS = ('crop', 'size', 'variants')
+
+
+class Manifest:
+    def __init__(self, variant_dir, pk):
+        self.pk = pk
+        self.journal_path = os.path.join(variant_dir, 'images.jsonl')
+        self.json_path = os.path.join(variant_dir, 'images.json')
+        # (model_n, camera_n, material_id) -> {file_path: запись}
+        self.index = {}
+        self.torn_tail = False
+        self.load()
+
+    def _add(self, record):
+        key = (record['model'], record['camera'], record['material'])
+        self.index.setdefault(key, {})[record['file']] = record
+
+    def load(self):
+        # Уже собранный images.json - базовое состояние (в том числе для старых вариантов)
+        if os.path.exists(self.json_path):
+            with open(self.json_path, 'r') as file:
+                file_data = json.load(file)
+
+            for models in file_data.values():
+                for model_key, cameras in models.items():
+                    for camera_key, entries in cameras.items():
+                        for entry in entries:
+                            self._add({
+                                'model': int(model_key.split('_')[1]),
+                                'camera': int(camera_key.split('_')[1]),
+                                'material': entry[0],
+                                'file': entry[1],
+                                # Третий элемент - рамка обрезки и варианты (utils/encode.py)
+                                **(entry[2] if len(entry) > 2 else {}),
+                            })
+
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'r') as file:
+                for line in file:
+                    self.torn_tail = not line.endswith('\n')
+                    try:
+                        self._add(json.loads(line))
+                    except ValueError:
+                        # Оборванная при падении строка - пропускаем
+                        print(f'Skip broken manifest line in {self.journal_path}')
+
+    def contains(self, model_n, camera_n, material_id, file_path):
+        return file_path in self.index.get((model_n, camera_n, material_id), {})
+
+    def get(self, model_n, camera_n, material_id, file_path):
+        return self.index.get((model_n, camera_n, material_id), {}).get(file_path)
+
+    def append(self, model_n, camera_n, material_id, file_path, **extra):
+        if self.contains(model_n, camera_n, material_id, file_path) and not extra:
+            return False
+
+        record = {'model': model_n, 'camera': camera_n, 'material': material_id, 'file': file_path, **extra}
+
+        if not os.path.exists(os.path.dirname(self.journal_path)):
+            os.makedirs(os.path.dirname(self.journal_path))
+
+        with open(self.journal_path, 'a') as file:
+            if self.torn_tail:
+                file.write('\n')
+                self.torn_tail = False
+            file.write(json.dumps(record) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+
+        self._add(record)
+        return True
+
+    def to_dict(self):
+        variant_key = 'variant_%d' % self.pk
+        file_data = {variant_key: {}}
+
+        for (model_n, camera_n, material_id), records in sorted(self.index.items(), key=lambda i: i[0][:2]):
+            camera_data = file_data[variant_key].setdefault('model_%d' % model_n, {}) \
+                .setdefault('camera_%d' % camera_n, [])
+            for record in records.values():
+                entry = [record['material'], record['file']]
+                image = {k: record[k] for k in IMAGE_FIELDS if k in record}
+                if image:
+                    entry.append(image)
+                camera_data.append(entry)
+
+        return file_data
+
+    def compact(self):
+        tmp_path = self.json_path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(self.to_dict(), file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.json_path)
+        return self.json_path
+
+
+def compact_variant(variant_dir):
+    pk = int(os.path.basename(os.path.normpath(variant_dir)).split('_')[1])
+    return Manifest(variant_dir, pk).compact()
+
+
+if __name__ == '__main__':
+    for path in sys.argv[1:]:
+        print('Compacted', compact_variant(path))
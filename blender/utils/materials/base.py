@@ -3,8 +3,10 @@ import os
 import bpy
 import requests
 
-CURRENT_PATH = os.getcwd()
-
+from settings import texture_max_size
+from utils.materials.prefetch import texture_path
+from utils.materials.preprocess import preprocess_texture
+from utils.render_cache import file_hash
 
 
 def check_and_create_dirs(path):
@@ -21,6 +23,18 @@ def clear_all():
         print(obj)
 
 
+def set_object_material(obj, material):
+    # Материал в слоте объекта, а не меша: меш не помечается измененным и BVH не перестраивается
+    if not obj.material_slots:
+        obj.data.materials.append(None)
+
+    for slot in obj.material_slots:
+        if slot.link != 'OBJECT':
+            slot.link = 'OBJECT'
+        if slot.material != material:
+            slot.material = material
+
+
 def set_color_material(material, color_rgb):
     principled_bsdf = material.node_tree.nodes.get('Principled BSDF')
     (r, g, b) = color_rgb
@@ -30,7 +44,55 @@ def set_color_material(material, color_rgb):
         principled_bsdf.inputs['Base Color'].default_value = (r, g, b, 1)
 
 
-def process_texture_response(response, file_path):
+def image_bytes(image):
+    width, height = image.size
+    return width * height * image.channels * (4 if image.is_float else 1)
+
+
+class TextureRegistry:
+    """Один image datablock на файл текстуры (по пути и по хэшу содержимого)"""
+
+    def __init__(self):
+        # Храним имена, а не ссылки - datablock может быть удален вместе с материалами
+        self.by_path = {}
+        self.by_hash = {}
+        self.requests = 0
+        self.shared = 0
+        self.saved_bytes = 0
+
+    @staticmethod
+    def lookup(name):
+        return bpy.data.images.get(name) if name else None
+
+    def get(self, file_path):
+        self.requests += 1
+
+        image = self.lookup(self.by_path.get(file_path))
+        if image is None:
+            content_hash = file_hash(file_path)
+            image = self.lookup(self.by_hash.get(content_hash))
+
+            if image is None:
+                image = bpy.data.images.load(file_path, check_existing=True)
+                self.by_hash[content_hash] = image.name
+                self.by_path[file_path] = image.name
+                return image
+
+            self.by_path[file_path] = image.name
+
+        self.shared += 1
+        self.saved_bytes += image_bytes(image)
+        return image
+
+    def report(self):
+        print(f"Textures: {self.requests} requested, {len(self.by_hash)} images, {self.shared} shared, "
+              f"~{self.saved_bytes / 1024 ** 2:.0f} MB saved")
+
+
+texture_registry = TextureRegistry()
+
+
+def process_texture_response(response, file_path, kind=None):
     if response.status_code == 200:
         file_content = response.content
 
@@ -43,26 +105,29 @@ def process_texture_response(response, file_path):
             file.write(file_content)
 
         # Загружаем текстуру в Blender
-        texture = bpy.data.images.load(file_path, check_existing=False)
-        return texture
+        return get_texture(file_path, kind)
     else:
         print(f'Ошибка при загрузке текстуры. Код ответа: {response.status_code}')
         return None
 
 
-def load_texture(url):
-    # Получаем имя файла из URL
-    file_name = url.split('/')[-1]
-    # Формируем полный путь к файлу
-    file_path = os.path.join(CURRENT_PATH, 'media/materials', file_name)
+def get_texture(file_path, kind=None):
+    # Уменьшенная под рендер копия, если тип карты известен
+    if kind and texture_max_size:
+        file_path = preprocess_texture(file_path, kind, texture_max_size, measure=False).path
+    return texture_registry.get(file_path)
+
+
+def load_texture(url, kind=None):
+    # Путь к файлу по имени из URL (туда же пишет prefetch_textures)
+    file_path = texture_path(url)
 
     # Проверяем, существует ли файл
     if os.path.exists(file_path):
         print(f'Файл уже существует: {file_path}')
         # Загружаем текстуру из существующего файла в Blender
-        texture = bpy.data.images.load(file_path, check_existing=False)
-        return texture
+        return get_texture(file_path, kind)
     else:
         # Если файл не существует, загружаем его
         response = requests.get(url)
-        return process_texture_response(response, file_path)
+        return process_texture_response(response, file_path, kind)
@@ -46,25 +46,25 @@ def create_texture_material(material, blender_material):
     # Загружаем необходимые текстуры
     color = blender_material.get('color')
     col = blender_material.get('col')
-    base_color = load_texture(col) if col else None
+    base_color = load_texture(col, 'col') if col else None
 
     nrm_gl = blender_material.get('nrm_gl')
-    normal_map = load_texture(nrm_gl) if nrm_gl else None
+    normal_map = load_texture(nrm_gl, 'nrm_gl') if nrm_gl else None
 
     rgh = blender_material.get('rgh')
-    roughness_map = load_texture(rgh) if rgh else None
+    roughness_map = load_texture(rgh, 'rgh') if rgh else None
 
     mtl = blender_material.get('mtl')
-    metallic_map = load_texture(mtl) if mtl else None
+    metallic_map = load_texture(mtl, 'mtl') if mtl else None
 
     disp = blender_material.get('disp')
-    displacement_map = load_texture(disp) if disp else None
+    displacement_map = load_texture(disp, 'disp') if disp else None
 
     bump = blender_material.get('bump')
-    bump_map = load_texture(bump) if bump else None
+    bump_map = load_texture(bump, 'bump') if bump else None
 
     ao = blender_material.get('ao')
-    ao_map = load_texture(ao) if ao else None
+    ao_map = load_texture(ao, 'ao') if ao else None
 
     # Создаем узлы
     tex_coordinate = nodes.new("ShaderNodeTexCoord")
@@ -74,6 +74,7 @@ def create_texture_material(material, blender_material):
     links.new(mapping_node.inputs["Vector"], tex_coordinate.outputs["UV"])
 
     displacement_node = nodes.new("ShaderNodeDisplacement")
+    base_color_node = None
 
     if color:
         set_color_to_material(material, color['rgb'])
@@ -130,10 +131,15 @@ def create_texture_material(material, blender_material):
         # Привязываем AO карту к MixRGB узлу
         links.new(mix_rgb_node.inputs[2], ao_map_node.outputs["Color"])
 
-        # Привязываем Base Color к MixRGB узлу
-        base_color_node = create_texture_node(material, base_color)
-        links.new(base_color_node.inputs["Vector"], mapping_node.outputs["Vector"])
-        links.new(mix_rgb_node.inputs[1], base_color_node.outputs['Color'])
+        # Привязываем Base Color к MixRGB узлу (узел базового цвета уже создан выше)
+        if base_color_node is None and base_color:
+            base_color_node = create_texture_node(material, base_color)
+            links.new(base_color_node.inputs["Vector"], mapping_node.outputs["Vector"])
+        if base_color_node is not None:
+            links.new(mix_rgb_node.inputs[1], base_color_node.outputs['Color'])
+        elif color:
+            (r, g, b) = color['rgb']
+            mix_rgb_node.inputs[1].default_value = (r, g, b, 1)
 
         # Результат MixRGB направляем в Base Color узла Principled BSDF
         links.new(mix_rgb_node.outputs['Color'], material.node_tree.nodes['Principled BSDF'].inputs['Base Color'])
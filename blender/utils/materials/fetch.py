@@ -1,5 +1,18 @@
-from utils.materials.base import clear_all
-from utils.materials.create import create_material
+from collections import Counter
+
+import bpy
+
+from utils.materials.base import clear_all, texture_registry
+from utils.materials.create import create_material, set_color_to_material
+from settings import texture_max_size, share_flat_colors
+from utils.materials.prefetch import prefetch_textures, texture_map, texture_path, texture_urls
+from utils.materials.preprocess import preprocess_textures
+from utils.payload import material_definitions
+
+# Имена материалов, созданных для текущего продукта
+created_materials = []
+# Общий материал однотонных цветов, между кадрами меняется только Base Color
+SHARED_COLOR_MATERIAL = 'Shared_Color'
 
 
 def fetch_and_loop_materials(data):
@@ -7,9 +20,101 @@ def fetch_and_loop_materials(data):
         print(part)
         for material_group in part['material_groups']:
             for material in material_group['materials']:
-                create_material(material)
+                mat = create_material(material)
+                created_materials.append(mat.name)
+
+
+def remove_unused_images():
+    for image in list(bpy.data.images):
+        if image.users == 0:
+            bpy.data.images.remove(image)
+
+
+def clear_materials():
+    # Удаляем только материалы продукта, сцена и модели остаются загруженными
+    for name in created_materials:
+        material = bpy.data.materials.get(name)
+        if material:
+            bpy.data.materials.remove(material)
+    created_materials.clear()
+    remove_unused_images()
+
+
+def create_materials(data, clear=True):
+    if clear:
+        clear_all()
+        created_materials.clear()
+    else:
+        clear_materials()
+
+    # Материалы создаем только когда все текстуры уже на диске
+    prefetch_textures(texture_urls(data))
+    fetch_and_loop_materials(data)
+    texture_registry.report()
+
+
+class MaterialLibrary:
+    """Материалы создаются при первом обращении и удаляются после последнего кадра с ними"""
+
+    def __init__(self, data, units):
+        self.definitions = material_definitions(data)
+        self.remaining = Counter(unit.material for unit in units)
+        self.built = 0
+        self.evicted = 0
+
+    def get(self, name):
+        rgb = self.flat_color(name) if share_flat_colors else None
+        if rgb is not None:
+            return self.shared_color(rgb)
+
+        material = bpy.data.materials.get(name)
+        if material is None:
+            material = create_material(self.definitions[name])
+            created_materials.append(material.name)
+            self.built += 1
+        return material
+
+    def shared_color(self, rgb):
+        material = bpy.data.materials.get(SHARED_COLOR_MATERIAL)
+        if material is None:
+            material = bpy.data.materials.new(name=SHARED_COLOR_MATERIAL)
+            material.use_nodes = True
+            self.built += 1
+        set_color_to_material(material, rgb)
+        return material
+
+    def flat_color(self, name):
+        # RGB однотонного материала, None для текстурных
+        color = (self.definitions.get(name) or {}).get('color')
+        return color['rgb'] if color else None
+
+    def release(self, name):
+        self.remaining[name] -= 1
+        if self.remaining[name] > 0:
+            return
+
+        material = bpy.data.materials.get(name)
+        if material is not None:
+            bpy.data.materials.remove(material)
+            remove_unused_images()
+            self.evicted += 1
+
+    def report(self):
+        print(f"Materials: {len(self.remaining)} planned, {self.built} built, {self.evicted} evicted")
+        texture_registry.report()
+
 
+def create_material_library(data, units, clear=True):
+    if clear:
+        clear_all()
+        created_materials.clear()
+    else:
+        clear_materials()
 
-def create_materials(data):
-    clear_all()
-    fetch_and_loop_materials(data)
\ No newline at end of file
+    library = MaterialLibrary(data, units)
+    textures = texture_map(data, set(library.remaining))
+    prefetch_textures(list(textures))
+    if texture_max_size:
+        # Уменьшаем текстуры заранее и параллельно, load_texture возьмет готовые файлы
+        preprocess_textures([(texture_path(url), kind) for url, kind in textures.items()], texture_max_size)
+    return library
@@ -0,0 +1,111 @@
+"""
+Параллельная предзагрузка текстур материалов.
+
+Собирает все URL текстур из ответа сервера и скачивает их до создания
+материалов: общий пул соединений, потоковая запись во временный файл и
+атомарное переименование. load_texture затем берет файлы с диска.
+"""
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.payload import iter_materials
+
+TEXTURE_KEYS = ('col', 'nrm_gl', 'rgh', 'mtl', 'disp', 'bump', 'ao')
+TEXTURES_DIR = os.path.join(os.getcwd(), 'media/materials')
+CHUNK_SIZE = 256 * 1024
+
+
+@dataclass
+class TextureDownload:
+    url: str
+    path: str
+    status: str
+    bytes: int = 0
+    seconds: float = 0.0
+
+
+def texture_path(url):
+    return os.path.join(TEXTURES_DIR, url.split('/')[-1])
+
+
+def texture_map(data, names=None):
+    # URL -> тип карты; names - ограничить материалами с этими именами
+    textures = {}
+    for material in iter_materials(data):
+        if names is not None and str(material['id']) not in names:
+            continue
+        blender_material = (material.get('material') or {}).get('blender_material') or {}
+        for key in TEXTURE_KEYS:
+            url = blender_material.get(key)
+            if url and url not in textures:
+                textures[url] = key
+    return textures
+
+
+def texture_urls(data, names=None):
+    return list(texture_map(data, names))
+
+
+def download_texture(session, url, timeout=60):
+    path = texture_path(url)
+    if os.path.exists(path):
+        return TextureDownload(url, path, 'cached', os.path.getsize(path))
+
+    start_time = time.time()
+    size = 0
+    try:
+        with session.get(url, stream=True, timeout=timeout) as response:
+            if response.status_code != 200:
+                return TextureDownload(url, path, 'error %d' % response.status_code)
+
+            fd, tmp_path = tempfile.mkstemp(dir=TEXTURES_DIR, suffix='.part')
+            try:
+                with os.fdopen(fd, 'wb') as file:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        file.write(chunk)
+                        size += len(chunk)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+    except requests.exceptions.RequestException as e:
+        return TextureDownload(url, path, 'error %s' % e.__class__.__name__)
+
+    return TextureDownload(url, path, 'downloaded', size, time.time() - start_time)
+
+
+def prefetch_textures(urls, max_workers=8):
+    if not os.path.exists(TEXTURES_DIR):
+        os.makedirs(TEXTURES_DIR)
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    start_time = time.time()
+    with session, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(lambda url: download_texture(session, url), urls))
+
+    print_report(results, time.time() - start_time)
+    return results
+
+
+def print_report(results, elapsed):
+    downloaded = [r for r in results if r.status == 'downloaded']
+    for r in downloaded:
+        print(f"  {os.path.basename(r.path)}: {r.bytes / 1024:.0f} KB, {r.seconds:.2f}s")
+    for r in results:
+        if r.status.startswith('error'):
+            print(f"  {r.url}: {r.status}")
+
+    total_bytes = sum(r.bytes for r in downloaded)
+    print(f"Textures: {len(results)} total, {len(downloaded)} downloaded, "
+          f"{sum(1 for r in results if r.status == 'cached')} cached, "
+          f"{total_bytes / 1024 ** 2:.1f} MB in {elapsed:.2f}s")
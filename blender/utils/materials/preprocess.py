@@ -0,0 +1,177 @@
+"""
+Подготовка текстур под разрешение рендера.
+
+Текстура уменьшается до max_size по большей стороне и сохраняется в
+компактном формате по типу карты: цвет - 8 бит RGB, roughness / metallic / ao -
+8 бит grayscale, нормали - 8 бит RGB, displacement / bump - 16 бит grayscale
+(только если исходник 16 бит). Результат кэшируется рядом с оригиналом:
+wood_col.jpg -> wood_col.2048px.jpg
+
+Проверка без Blender: python -m utils.materials.preprocess --max-size 2048 media/materials/*
+"""
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from PIL import Image
+
+# Тип карты -> (режим, расширение)
+MAP_FORMATS = {
+    'col': ('RGB', '.jpg'),
+    'nrm_gl': ('RGB', '.png'),
+    'rgh': ('L', '.png'),
+    'mtl': ('L', '.png'),
+    'ao': ('L', '.png'),
+    'disp': ('I;16', '.png'),
+    'bump': ('I;16', '.png'),
+}
+HIGH_PRECISION_MODES = ('I;16', 'I;16B', 'I', 'F')
+JPEG_QUALITY = 92
+
+
+@dataclass
+class PreprocessResult:
+    source: str
+    path: str
+    source_bytes: int
+    bytes: int
+    source_decode: float = 0.0
+    decode: float = 0.0
+    cached: bool = False
+
+
+def guess_kind(path):
+    name = os.path.splitext(os.path.basename(path))[0].lower()
+    for kind in MAP_FORMATS:
+        if name.endswith(kind) or '_%s' % kind in name:
+            return kind
+    return 'col'
+
+
+def derived_path(path, kind, max_size):
+    stem = os.path.splitext(path)[0]
+    return '%s.%dpx%s' % (stem, max_size, MAP_FORMATS[kind][1])
+
+
+def decode_time(path):
+    start_time = time.time()
+    with Image.open(path) as image:
+        image.load()
+    return time.time() - start_time
+
+
+def to_8bit(image, mode):
+    if image.mode == 'F':
+        # Float-карты (EXR/TIFF) в диапазоне 0..1: convert('I') обрежет их до 0
+        image = image.point(lambda v: v * 255).convert('L')
+    elif image.mode in HIGH_PRECISION_MODES:
+        # Масштабируем 16 бит в 8, а не обрезаем
+        image = image.convert('I').point(lambda v: v * (1 / 256)).convert('L')
+    return image.convert(mode)
+
+
+def has_alpha(image):
+    # Палитровый PNG хранит прозрачность в info, а не в отдельном канале
+    return 'A' in image.getbands() or 'transparency' in image.info
+
+
+def convert(image, kind):
+    mode = MAP_FORMATS[kind][0]
+
+    if mode == 'I;16':
+        # 16 бит нужны только если исходная карта высоты 16 бит
+        if image.mode == 'F':
+            return image.point(lambda v: v * 65535).convert('I').convert('I;16')
+        if image.mode in HIGH_PRECISION_MODES:
+            return image if image.mode == 'I;16' else image.convert('I').convert('I;16')
+        return image.convert('L')
+
+    if mode == 'RGB' and kind == 'col' and has_alpha(image):
+        return image.convert('RGBA')
+
+    return to_8bit(image, mode)
+
+
+def preprocess_texture(path, kind, max_size, measure=True):
+    target = derived_path(path, kind, max_size)
+    source_bytes = os.path.getsize(path)
+
+    # Цветная карта с альфой сохраняется в PNG
+    for candidate in (target, os.path.splitext(target)[0] + '.png'):
+        if os.path.exists(candidate) and os.path.getmtime(candidate) >= os.path.getmtime(path):
+            return PreprocessResult(path, candidate, source_bytes, os.path.getsize(candidate), cached=True)
+
+    with Image.open(path) as image:
+        image = convert(image, kind)
+        if max(image.size) > max_size:
+            scale = max_size / max(image.size)
+            size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+            image = image.resize(size, Image.LANCZOS)
+
+        if target.endswith('.jpg') and image.mode != 'RGB':
+            # Цвет с альфой в JPEG не сохранить
+            target = os.path.splitext(target)[0] + '.png'
+
+        # Уникальный временный файл: одну текстуру могут готовить несколько потоков и нод
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target) or '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                if target.endswith('.jpg'):
+                    image.save(file, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+                else:
+                    image.save(file, 'PNG', optimize=True)
+            os.replace(tmp_path, target)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    result = PreprocessResult(path, target, source_bytes, os.path.getsize(target))
+    if measure:
+        result.source_decode = decode_time(path)
+        result.decode = decode_time(target)
+    return result
+
+
+def preprocess_textures(items, max_size, max_workers=4):
+    """items - список (путь, тип карты); Pillow отпускает GIL, поэтому потоки"""
+    # URL с одинаковым именем файла дают один путь - готовим его один раз
+    items = list(dict((path, kind) for path, kind in items if os.path.exists(path)).items())
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(lambda item: preprocess_texture(item[0], item[1], max_size), items))
+    print_report(results)
+    return results
+
+
+def print_report(results):
+    created = [r for r in results if not r.cached]
+    for r in created:
+        print(f"  {os.path.basename(r.path)}: {r.source_bytes / 1024:.0f} -> {r.bytes / 1024:.0f} KB, "
+              f"decode {r.source_decode:.3f} -> {r.decode:.3f}s")
+
+    saved_bytes = sum(r.source_bytes - r.bytes for r in results)
+    saved_decode = sum(r.source_decode - r.decode for r in created)
+    print(f"Preprocessed textures: {len(created)} created, {len(results) - len(created)} cached, "
+          f"{saved_bytes / 1024 ** 2:.1f} MB and {saved_decode:.2f}s decode saved")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--max-size', type=int, default=2048)
+    parser.add_argument('--kind', choices=list(MAP_FORMATS), default=None)
+    args = parser.parse_args()
+
+    results = []
+    for path in args.files:
+        if '.%dpx.' % args.max_size in path:
+            continue
+        results.append(preprocess_texture(path, args.kind or guess_kind(path), args.max_size))
+    print_report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Кэш импортированных моделей в виде .blend библиотек.
+
+OBJ парсится один раз, результат вместе с коллекциями частей сохраняется в
+media/cache/blend/<key>.blend (ключ - хэш OBJ и список частей). Повторная
+загрузка той же модели (в том числе другим воркером) - append из библиотеки.
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+import bpy
+
+MODEL_COLLECTION = 'Model'
+
+
+def library_key(obj_hash, part_names):
+    payload = json.dumps({'obj': obj_hash, 'parts': sorted(part_names), 'blender': bpy.app.version_string})
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def library_path(cache_dir, key):
+    return os.path.join(cache_dir, key + '.blend')
+
+
+def save_library(path, part_names):
+    collections = [bpy.data.collections[name] for name in [MODEL_COLLECTION] + list(part_names)
+                   if name in bpy.data.collections]
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Уникальный временный файл: одну модель могут сохранять несколько воркеров и нод
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.blend')
+    os.close(fd)
+    try:
+        bpy.data.libraries.write(tmp_path, set(collections), fake_user=True)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    print(f"Model library saved: {path}")
+
+
+def load_library(path):
+    with bpy.data.libraries.load(path, link=False) as (data_from, data_to):
+        data_to.collections = list(data_from.collections)
+
+    for collection in data_to.collections:
+        collection.use_fake_user = False
+        bpy.context.scene.collection.children.link(collection)
+    print(f"Model library loaded: {path}")
+
+
+def collect_model(objects):
+    # Все меши модели, включая те, что не входят ни в одну часть
+    collection = bpy.data.collections.new(MODEL_COLLECTION)
+    bpy.context.scene.collection.children.link(collection)
+    for obj in objects:
+        if obj.type == 'MESH' and obj.name not in collection.objects:
+            collection.objects.link(obj)
+    return collection
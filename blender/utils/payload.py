@@ -0,0 +1,39 @@
+"""Разбор ответа /api/product/render/<id>/ без bpy (используется планировщиком)."""
+import requests
+
+
+def fetch_product(domain, pk):
+    url = '%s/api/product/render/%d/' % (domain, pk)
+    response = requests.get(url)
+    if not response.ok:
+        print('Response error')
+        return None
+    return response.json()
+
+
+def iter_materials(data):
+    for part in data['parts']:
+        for material_group in part['material_groups']:
+            for material in material_group['materials']:
+                yield material
+
+
+def material_definitions(data):
+    # Имя материала в Blender -> описание материала из ответа сервера
+    return {str(material['id']): material for material in iter_materials(data)}
+
+
+def material_kind(material_data):
+    if material_data is None:
+        return 'unknown'
+    if material_data.get('color'):
+        return 'color'
+
+    blender_material = (material_data.get('material') or {}).get('blender_material') or {}
+    if blender_material.get('color'):
+        return 'color'
+    if blender_material.get('disp'):
+        return 'displacement'
+    if blender_material.get('bump'):
+        return 'bump'
+    return 'textured'
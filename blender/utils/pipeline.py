@@ -0,0 +1,302 @@
+"""
+Конвейер рендер -> кодирование -> загрузка.
+
+Кодирование и загрузка идут в отдельном процессе (python -m utils.pipeline).
+Пока идет bpy.ops.render.render, потоки Python внутри Blender не выполняются,
+поэтому поток кодирования и asyncio цикл в процессе Blender работали только
+между кадрами. Рендер передает процессу готовые кадры строками json в stdin,
+процесс отвечает строкой json на каждый обработанный кадр.
+
+Обратное давление: кадров в работе не больше max_pending; если загрузка
+отстает, submit() ждет подтверждения и рендер приостанавливается.
+
+Перекрытие считается по времени: submit() получает интервал рендера кадра,
+процесс возвращает интервалы кодирования и загрузки, report() печатает,
+какая их доля пришлась на рендер.
+
+Если процесс загрузки упал, submit() не ждет подтверждений, которые не придут:
+оставшиеся кадры кодируются и загружаются в процессе рендера, по одному.
+Кадры, отданные упавшему процессу, считаются не загруженными.
+"""
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import asdict
+from datetime import datetime
+
+from PIL import Image
+
+BLENDER_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Как часто submit() проверяет, жив ли процесс загрузки, пока ждет свободный слот
+SLOT_POLL_INTERVAL = 1.0
+# Python с aiohttp и Pillow для процесса загрузки; в Blender 2.9+ sys.executable - встроенный Python
+PIPELINE_PYTHON = os.environ.get('RENDER_PIPELINE_PYTHON', sys.executable)
+
+
+def optimize_png(file_path):
+    # Пересохранение PNG без потерь с максимальным сжатием
+    with Image.open(file_path) as image:
+        image.load()
+    tmp_path = file_path + '.tmp'
+    image.save(tmp_path, 'PNG', optimize=True)
+    os.replace(tmp_path, file_path)
+    return file_path
+
+
+def merge_intervals(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def overlap(work, render):
+    """Секунды работы (интервалы кодирования/загрузки), пришедшиеся на рендер"""
+    render = merge_intervals(render)
+    total = 0.0
+    for start, end in merge_intervals(work):
+        for render_start, render_end in render:
+            total += max(0.0, min(end, render_end) - max(start, render_start))
+    return total
+
+
+class RenderPipeline:
+    def __init__(self, upload='scene_material', encode=True, max_pending=8, max_concurrent_uploads=10,
+                 base_url=None):
+        """upload - scene_material (send_images.UploadManager) или sku (utils/sku_images.py)"""
+        self.options = (upload, encode, base_url)
+        self.inline = None
+        command = [PIPELINE_PYTHON, '-m', 'utils.pipeline', '--upload', upload,
+                   '--concurrency', str(max_concurrent_uploads)]
+        if not encode:
+            command.append('--no-encode')
+        if base_url:
+            command += ['--base-url', base_url]
+
+        # Ответы для settings.py: stdin процесса занят кадрами, input() недоступен
+        env = dict(os.environ)
+        for name, value in (('RENDER_MAKE', 'n'), ('RENDER_WRITE_ANYWAY', 'n'), ('RENDER_IDS', '')):
+            env.setdefault(name, value)
+        self.process = subprocess.Popen(command, cwd=BLENDER_ROOT, env=env, text=True, bufsize=1,
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.results = {}
+        self.worker_stats = {}
+        self.render_intervals = []
+        self.stats = {'frames': 0, 'uploaded': 0, 'failed': 0, 'blocked': 0.0}
+        self.start_time = time.time()
+
+        self.reader = threading.Thread(target=self.read_loop, daemon=True)
+        self.reader.start()
+
+    def submit(self, item, rendered=None):
+        """item - dataclass задачи с полем file_path, rendered - (начало, конец) рендера кадра;
+        блокирует рендер, если в работе max_pending кадров"""
+        start_time = time.time()
+        acquired = False
+        while self.inline is None and not acquired:
+            acquired = self.slots.acquire(timeout=SLOT_POLL_INTERVAL)
+            if not acquired and not self.is_alive():
+                self.fail_over()
+        self.stats['blocked'] += time.time() - start_time
+
+        if rendered:
+            self.render_intervals.append(tuple(rendered))
+        message = {'id': self.stats['frames'], 'task': asdict(item)}
+        self.stats['frames'] += 1
+
+        if self.inline is None:
+            try:
+                self.process.stdin.write(json.dumps(message) + '\n')
+                self.process.stdin.flush()
+                return
+            except (BrokenPipeError, OSError, ValueError):
+                self.fail_over()
+        asyncio.run(self.upload_inline(message))
+
+    def is_alive(self):
+        return self.process.poll() is None and self.reader.is_alive()
+
+    def fail_over(self):
+        print('Pipeline process exited with code %s, uploading remaining frames inline' % self.process.poll())
+        upload, encode, base_url = self.options
+        self.inline = PipelineWorker(InlineOutput(self.handle), upload, encode, 1, base_url)
+
+    async def upload_inline(self, message):
+        async with self.inline.create_session() as session:
+            await self.inline.process(session, message)
+
+    def handle(self, message):
+        if 'stats' in message:
+            self.worker_stats = message['stats']
+            return
+        self.results[message['id']] = message['ok']
+        self.stats['uploaded' if message['ok'] else 'failed'] += 1
+        if self.inline is None:
+            self.slots.release()
+
+    def read_loop(self):
+        for line in self.process.stdout:
+            self.handle(json.loads(line))
+
+    def close(self):
+        """Дожидается кодирования и загрузки всех кадров"""
+        try:
+            self.process.stdin.close()
+        except (BrokenPipeError, OSError):
+            # Процесс уже упал - его кадры считаются не загруженными
+            pass
+        self.reader.join()
+        self.process.wait()
+        if self.process.returncode:
+            print('Pipeline process exited with code %d' % self.process.returncode)
+
+        self.report()
+        return [self.results.get(n, False) for n in range(self.stats['frames'])]
+
+    def overlap(self):
+        intervals = self.worker_stats.get('intervals', {})
+        work = intervals.get('encode', []) + intervals.get('upload', [])
+        busy = sum(end - start for start, end in merge_intervals(work))
+        return busy, overlap(work, self.render_intervals)
+
+    def report(self):
+        wall = time.time() - self.start_time
+        busy, during_render = self.overlap()
+        print(f"Pipeline: {self.stats['frames']} frames, {self.stats['uploaded']} uploaded, "
+              f"{self.stats['failed']} failed in {wall:.1f}s; render blocked {self.stats['blocked']:.1f}s, "
+              f"encode {self.worker_stats.get('encode', 0):.1f}s, upload {self.worker_stats.get('upload', 0):.1f}s")
+        if busy and self.render_intervals:
+            print(f"Pipeline overlap: {during_render:.1f}s of {busy:.1f}s encode/upload during render "
+                  f"({during_render / busy:.0%})")
+        if self.worker_stats.get('report'):
+            print('Uploads: %s' % self.worker_stats['report'])
+
+
+class InlineOutput:
+    """Подтверждения PipelineWorker в процессе рендера - сразу в RenderPipeline.handle"""
+
+    def __init__(self, handle):
+        self.handle = handle
+
+    def write(self, line):
+        self.handle(json.loads(line))
+
+    def flush(self):
+        pass
+
+
+class PipelineWorker:
+    """Процесс загрузки: кадры из stdin, подтверждения в stdout"""
+
+    def __init__(self, output, upload, encode, concurrency, base_url):
+        self.output = output
+        self.encode = encode
+        self.stats = {'encode': 0.0, 'upload': 0.0, 'intervals': {'encode': [], 'upload': []}}
+
+        if upload == 'sku':
+            from utils.sku_images import SkuImage, send_sku_image
+            from settings import domain
+
+            self.manager = None
+            self.make_task = lambda data: SkuImage(**data)
+            self.upload = lambda session, task: send_sku_image(session, task, base_url or domain)
+        else:
+            from send_images import UploadManager, UploadTask, setup_logger
+
+            options = {'base_url': base_url} if base_url else {}
+            self.manager = UploadManager(setup_logger(), concurrency, **options)
+            self.make_task = lambda data: UploadTask(**data)
+            self.upload = self.manager.upload_file
+
+    def create_session(self):
+        if self.manager is not None:
+            return self.manager.create_session()
+
+        import aiohttp
+        return aiohttp.ClientSession()
+
+    def timed(self, kind, start_time):
+        end_time = time.time()
+        self.stats[kind] += end_time - start_time
+        self.stats['intervals'][kind].append((start_time, end_time))
+
+    def send(self, message):
+        self.output.write(json.dumps(message) + '\n')
+        self.output.flush()
+
+    async def process(self, session, message):
+        task = self.make_task(message['task'])
+        loop = asyncio.get_running_loop()
+
+        if self.encode:
+            start_time = time.time()
+            try:
+                # Pillow отпускает GIL - кодирование в потоке не останавливает загрузки
+                task.file_path = await loop.run_in_executor(None, optimize_png, task.file_path)
+            except Exception as e:
+                print('Encode error', task.file_path, e)
+            self.timed('encode', start_time)
+
+        start_time = time.time()
+        try:
+            ok = bool(await self.upload(session, task))
+        except Exception as e:
+            print('Upload error', task.file_path, e)
+            ok = False
+        self.timed('upload', start_time)
+        self.send({'id': message['id'], 'ok': ok})
+
+    async def run(self, source):
+        loop = asyncio.get_running_loop()
+        session = self.create_session()
+        pending = set()
+        try:
+            while True:
+                line = await loop.run_in_executor(None, source.readline)
+                if not line:
+                    break
+                if self.manager is not None:
+                    if self.manager.start_time is None:
+                        self.manager.start_time = datetime.now()
+                    self.manager.total_uploads += 1
+                pending.add(asyncio.ensure_future(self.process(session, json.loads(line))))
+                pending = {future for future in pending if not future.done()}
+            if pending:
+                await asyncio.gather(*pending)
+        finally:
+            await session.close()
+
+        self.stats['report'] = self.manager.log_report() if self.manager is not None else None
+        self.send({'stats': self.stats})
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--upload', choices=['scene_material', 'sku'], default='scene_material')
+    parser.add_argument('--no-encode', action='store_true')
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--base-url', default=None)
+    args = parser.parse_args()
+
+    # stdout - канал подтверждений, print() загрузчика уходит в stderr
+    output = os.fdopen(os.dup(sys.stdout.fileno()), 'w', buffering=1)
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+
+    worker = PipelineWorker(output, args.upload, not args.no_encode, args.concurrency, args.base_url)
+    asyncio.run(worker.run(sys.stdin))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""Пресеты качества рендера. Выбираются для задачи или единицы рендера по имени."""
+import os
+
+DEFAULT_PRESET = 'final'
+
+RENDER_PRESETS = {
+    # Быстрая проверка каталога
+    'draft': {
+        'samples': 32,
+        'noise_threshold': 0.1,
+        'resolution': (975, 650),
+        'denoise': True,
+        'bounces': {'max': 4, 'diffuse': 2, 'glossy': 2, 'transmission': 4},
+        'file_format': 'PNG',
+        'cost_factor': 0.15,
+    },
+    'preview': {
+        'samples': 96,
+        'noise_threshold': 0.05,
+        'resolution': (1462, 975),
+        'denoise': True,
+        'bounces': {'max': 8, 'diffuse': 3, 'glossy': 3, 'transmission': 8},
+        'file_format': 'PNG',
+        'cost_factor': 0.45,
+    },
+    # Публикация, прежние настройки customize_render
+    'final': {
+        'samples': 200,
+        'noise_threshold': 0.01,
+        'resolution': (int(3000 * 0.65), int(2000 * 0.65)),
+        'denoise': True,
+        'bounces': {'max': 12, 'diffuse': 4, 'glossy': 4, 'transmission': 12},
+        'file_format': 'PNG',
+        'cost_factor': 1.0,
+    },
+}
+
+
+def get_preset(name):
+    if name not in RENDER_PRESETS:
+        raise ValueError('Unknown render preset: %s' % name)
+    return RENDER_PRESETS[name]
+
+
+def preset_media_path(media_path, name):
+    # final пишет в media/ как раньше, остальные - в media/presets/<name>/
+    if name == DEFAULT_PRESET:
+        return media_path
+    return os.path.join(media_path, 'presets', name)
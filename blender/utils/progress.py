@@ -0,0 +1,72 @@
+"""
+Прогресс задачи пула для API (project/jobs.py).
+
+render_product сообщает о начале и конце каждой единицы, воркер пересылает
+снимок прогресса пулу через multiprocessing.connection. Отмена проверяется
+между единицами: текущий кадр дорендеривается, оставшиеся не начинаются.
+
+ETA - оставшаяся оценка планировщика (RenderUnit.cost), умноженная на
+отношение фактического времени к оценке по уже готовым кадрам.
+"""
+import time
+
+
+class RenderCancelled(Exception):
+    pass
+
+
+class JobProgress:
+    def __init__(self, send=None, is_cancelled=None, interval=1.0):
+        """send(dict) - отправка снимка, is_cancelled() - запрошена ли отмена"""
+        self.send = send
+        self.is_cancelled = is_cancelled
+        self.interval = interval
+        self.frames_total = 0
+        self.frames_done = 0
+        self.cost_total = 0.0
+        self.cost_done = 0.0
+        self.render_time = 0.0
+        self.current = None
+        self.start_time = time.time()
+        self.sent_at = 0.0
+
+    def start(self, units):
+        self.frames_total += len(units)
+        self.cost_total += sum(u.cost for u in units)
+        self.publish(force=True)
+
+    def unit_started(self, unit):
+        self.check()
+        self.current = unit.id
+
+    def unit_done(self, unit, render_time):
+        self.frames_done += 1
+        self.cost_done += unit.cost
+        self.render_time += render_time
+        self.publish(force=self.frames_done == self.frames_total)
+
+    def check(self):
+        if self.is_cancelled and self.is_cancelled():
+            raise RenderCancelled()
+
+    def eta(self):
+        remaining = max(self.cost_total - self.cost_done, 0.0)
+        if self.cost_done and self.render_time:
+            remaining *= self.render_time / self.cost_done
+        return round(remaining, 1)
+
+    def snapshot(self):
+        return {
+            'frames_done': self.frames_done,
+            'frames_total': self.frames_total,
+            'current': self.current,
+            'eta': self.eta(),
+            'elapsed': round(time.time() - self.start_time, 1),
+        }
+
+    def publish(self, force=False):
+        # Кадры из кэша идут пачкой - не чаще раза в interval
+        if self.send is None or not force and time.time() - self.sent_at < self.interval:
+            return
+        self.sent_at = time.time()
+        self.send(self.snapshot())
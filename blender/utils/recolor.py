@@ -0,0 +1,154 @@
+"""
+Перекраска частей без повторного рендера.
+
+Для камеры один раз рендерится базовый проход: все части с белым материалом,
+у каждой части свой pass_index. Компоновщик сохраняет в EXR проходы
+DiffDir / DiffInd / GlossDir / GlossInd, альфу и сглаженные маски частей
+(ID Mask). Кадр части с однотонным материалом собирается в numpy:
+
+    rgb = color * (DiffDir + DiffInd) + GlossDir + GlossInd,  alpha = mask * alpha
+
+Текстурные материалы по-прежнему рендерятся обычным способом.
+"""
+import os
+
+import bpy
+import numpy as np
+
+from utils.materials.base import set_object_material
+
+BASE_MATERIAL = 'Recolor_Base'
+LIGHT_PASSES = ('DiffDir', 'DiffInd', 'GlossDir', 'GlossInd')
+
+
+def get_base_material():
+    material = bpy.data.materials.get(BASE_MATERIAL)
+    if material is None:
+        material = bpy.data.materials.new(name=BASE_MATERIAL)
+        material.use_nodes = True
+        principled_bsdf = material.node_tree.nodes.get('Principled BSDF')
+        principled_bsdf.inputs['Base Color'].default_value = (1, 1, 1, 1)
+    return material
+
+
+def set_passes(enabled):
+    view_layer = bpy.context.view_layer
+    view_layer.use_pass_diffuse_direct = enabled
+    view_layer.use_pass_diffuse_indirect = enabled
+    view_layer.use_pass_glossy_direct = enabled
+    view_layer.use_pass_glossy_indirect = enabled
+    view_layer.use_pass_object_index = enabled
+    view_layer.cycles.denoising_store_passes = enabled
+
+
+def setup_compositor(output_dir, part_indices):
+    scene = bpy.context.scene
+    scene.use_nodes = True
+    tree = scene.node_tree
+    tree.nodes.clear()
+
+    render_layers = tree.nodes.new('CompositorNodeRLayers')
+    composite = tree.nodes.new('CompositorNodeComposite')
+    tree.links.new(render_layers.outputs['Image'], composite.inputs['Image'])
+
+    file_output = tree.nodes.new('CompositorNodeOutputFile')
+    file_output.base_path = output_dir
+    file_output.format.file_format = 'OPEN_EXR'
+    file_output.format.color_depth = '32'
+    file_output.format.color_mode = 'RGBA'
+    file_output.file_slots.clear()
+
+    file_output.file_slots.new('Image')
+    tree.links.new(render_layers.outputs['Image'], file_output.inputs['Image'])
+
+    for name in LIGHT_PASSES:
+        file_output.file_slots.new(name)
+        output = render_layers.outputs[name]
+
+        if scene.cycles.use_denoising:
+            # Проходы освещения шумные, деноизер применяется только к Combined
+            denoise = tree.nodes.new('CompositorNodeDenoise')
+            tree.links.new(output, denoise.inputs['Image'])
+            tree.links.new(render_layers.outputs['Denoising Normal'], denoise.inputs['Normal'])
+            tree.links.new(render_layers.outputs['Denoising Albedo'], denoise.inputs['Albedo'])
+            output = denoise.outputs['Image']
+
+        tree.links.new(output, file_output.inputs[name])
+
+    for index in part_indices.values():
+        id_mask = tree.nodes.new('CompositorNodeIDMask')
+        id_mask.index = index
+        id_mask.use_antialiasing = True
+        tree.links.new(render_layers.outputs['IndexOB'], id_mask.inputs['ID value'])
+
+        slot = 'Mask%d' % index
+        file_output.file_slots.new(slot)
+        tree.links.new(id_mask.outputs['Alpha'], file_output.inputs[slot])
+
+
+def restore_scene():
+    bpy.context.scene.use_nodes = False
+    set_passes(False)
+
+
+def render_base_pass(part_names, output_dir):
+    """Рендер базового прохода, возвращает {имя части: pass_index}"""
+    base_material = get_base_material()
+    part_indices = {}
+
+    for index, name in enumerate(part_names, 1):
+        part_indices[name] = index
+        collection = bpy.data.collections.get(name)
+        if collection is None:
+            continue
+        for obj in collection.objects:
+            if obj.type == 'MESH':
+                obj.pass_index = index
+                set_object_material(obj, base_material)
+
+    set_passes(True)
+    setup_compositor(output_dir, part_indices)
+    bpy.ops.render.render()
+
+    return part_indices
+
+
+def pass_path(output_dir, slot):
+    return os.path.join(output_dir, '%s%04d.exr' % (slot, bpy.context.scene.frame_current))
+
+
+def load_pass(output_dir, slot):
+    image = bpy.data.images.load(pass_path(output_dir, slot), check_existing=False)
+    width, height = image.size
+    pixels = np.empty(width * height * 4, dtype=np.float32)
+    image.pixels.foreach_get(pixels)
+    bpy.data.images.remove(image)
+    return pixels.reshape(height, width, 4)
+
+
+def load_passes(output_dir, part_indices):
+    passes = {name: load_pass(output_dir, name) for name in ('Image',) + LIGHT_PASSES}
+    masks = {index: load_pass(output_dir, 'Mask%d' % index)[:, :, 0] for index in part_indices.values()}
+    return passes, masks
+
+
+def compose_color(passes, mask, rgb):
+    color = np.array(rgb, dtype=np.float32)
+    diffuse = passes['DiffDir'][:, :, :3] + passes['DiffInd'][:, :, :3]
+    glossy = passes['GlossDir'][:, :, :3] + passes['GlossInd'][:, :, :3]
+
+    result = np.empty(passes['Image'].shape, dtype=np.float32)
+    # Буфер Blender хранит премультиплицированный цвет. Маска ID уже учитывает
+    # покрытие пикселя частью на краях, альфа Image поверх нее ослабила бы край дважды
+    result[:, :, :3] = (diffuse * color + glossy) * mask[:, :, None]
+    result[:, :, 3] = mask
+    return result
+
+
+def save_png(pixels, filepath):
+    height, width = pixels.shape[:2]
+    image = bpy.data.images.new('Recolor_Output', width, height, alpha=True, float_buffer=True)
+    image.pixels.foreach_set(pixels.ravel())
+    # save_render применяет цветовое управление сцены, как и обычный рендер
+    image.save_render(filepath, scene=bpy.context.scene)
+    bpy.data.images.remove(image)
@@ -0,0 +1,92 @@
+"""
+Кэш рендеров по содержимому: ключ - хэш всех входных данных кадра
+(OBJ, камера, описание материала, настройки рендера, HDRI, видимые части).
+
+Готовые PNG лежат в media/cache/render/<ab>/<key>.png, выходные пути
+рендера становятся жесткими ссылками на файлы кэша.
+"""
+import hashlib
+import json
+import os
+import shutil
+
+# Меняем при изменении логики построения сцены, чтобы сбросить кэш
+CACHE_VERSION = 1
+
+_file_hashes = {}
+
+
+def file_hash(path):
+    stat = os.stat(path)
+    cache_key = (os.path.abspath(path), stat.st_mtime, stat.st_size)
+
+    if cache_key not in _file_hashes:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b''):
+                digest.update(chunk)
+        _file_hashes[cache_key] = digest.hexdigest()
+
+    return _file_hashes[cache_key]
+
+
+def link_file(src, dst):
+    if not os.path.exists(os.path.dirname(dst)):
+        os.makedirs(os.path.dirname(dst))
+
+    tmp_path = dst + '.link'
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(src, tmp_path)
+    except OSError:
+        # Другая файловая система - копируем
+        shutil.copy2(src, tmp_path)
+    os.replace(tmp_path, dst)
+
+
+class RenderCache:
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(**inputs):
+        payload = json.dumps({'version': CACHE_VERSION, **inputs}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.png')
+
+    def fetch(self, key, output_path):
+        cached_path = self.path(key)
+        if not os.path.exists(cached_path):
+            self.misses += 1
+            return False
+
+        link_file(cached_path, output_path)
+        self.hits += 1
+        return True
+
+    def matches(self, key, output_path):
+        """Выходной файл - рендер с этим ключом: жесткая ссылка на файл кэша или его копия"""
+        cached_path = self.path(key)
+        if not os.path.exists(cached_path) or not os.path.exists(output_path):
+            return False
+        return os.path.samefile(cached_path, output_path) or file_hash(cached_path) == file_hash(output_path)
+
+    def store(self, key, output_path):
+        if not os.path.exists(output_path):
+            return
+
+        # Файл кэша и выходной путь - один и тот же файл (жесткая ссылка)
+        link_file(output_path, self.path(key))
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else 0.0,
+        }
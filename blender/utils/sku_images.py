@@ -0,0 +1,35 @@
+"""
+Загрузка картинок SKU для render_object.py, без bpy и settings: функция
+отправки выполняется в процессе загрузки конвейера (utils/pipeline.py).
+"""
+import os
+from dataclasses import dataclass
+
+import aiohttp
+
+
+@dataclass
+class SkuImage:
+    sku: int
+    index: int
+    file_path: str
+
+
+async def send_sku_image(session, image, base_url):
+    url = base_url + '/api/product/load_sku_images/'
+
+    # Define your payload data
+    data = aiohttp.FormData()
+    data.add_field('sku', str(image.sku))
+    data.add_field('index', str(image.index))
+
+    with open(image.file_path, 'rb') as file:
+        data.add_field('image', file, filename=os.path.basename(image.file_path))
+
+        # Send the POST request with the payload and files
+        async with session.post(url, data=data) as response:
+            # Check the response
+            print(response.status)
+            print(await response.text())
+
+            return response.status == 200
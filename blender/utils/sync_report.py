@@ -0,0 +1,62 @@
+"""
+Сравнение времени синхронизации сцены с persistent data и без.
+
+Читает сводки продуктов из media/cache/sync_timings.jsonl (пишет
+render_product) и печатает среднее время синхронизации кадра по режимам.
+Сравниваются только продукты, отрендеренные в обоих режимах с тем же пресетом.
+
+Без bpy: python -m utils.sync_report [--timings media/cache/sync_timings.jsonl]
+"""
+from statistics import mean
+
+from utils.timing_log import SYNC_TIMINGS_PATH, load_timings
+
+
+def compare(records):
+    # (pk, preset) -> режим -> последняя сводка
+    latest = {}
+    for record in records:
+        if record.get('frames'):
+            latest.setdefault((record['pk'], record['preset']), {})[record['persistent_data']] = record
+
+    pairs = [modes for modes in latest.values() if True in modes and False in modes]
+    if not pairs:
+        return None
+
+    result = {'products': len(pairs)}
+    for name, mode in (('before', False), ('after', True)):
+        summaries = [modes[mode] for modes in pairs]
+        frames = sum(s['frames'] for s in summaries)
+        result[name] = {
+            'frames': frames,
+            'sync_mean': sum(s['sync_total'] for s in summaries) / frames,
+            'sync_mean_warm': mean(s['sync_mean_warm'] for s in summaries),
+            'render_mean': mean(s['render_mean'] for s in summaries),
+        }
+    return result
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--timings', default=SYNC_TIMINGS_PATH)
+    args = parser.parse_args()
+
+    result = compare(load_timings(args.timings))
+    if result is None:
+        print('No products rendered both with and without persistent data')
+        return
+
+    print(f"Products: {result['products']}")
+    for name, label in (('before', 'without persistent data'), ('after', 'with persistent data')):
+        r = result[name]
+        print(f"  {label:24} {r['frames']:5d} frames, sync mean {r['sync_mean']:.2f}s "
+              f"(warm {r['sync_mean_warm']:.2f}s), render mean {r['render_mean']:.2f}s")
+    before, after = result['before']['sync_mean'], result['after']['sync_mean']
+    if before:
+        print(f"  sync time per frame: {1 - after / before:.0%} less")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""
+Журнал времени рендера кадров для cost_model.py (media/cache/timings.jsonl).
+
+Одна строка json на отрендеренный кадр (кадры из кэша не пишутся): время
+рендера и записи манифеста плюс признаки сцены - пресет, разрешение, сэмплы,
+тип материала, треугольники части и сцены, сколько кадров в вызове рендера.
+"""
+import json
+import os
+import time
+
+TIMINGS_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'media', 'cache', 'timings.jsonl'
+)
+# Сводки синхронизации сцены по продуктам (utils/timings.py, utils/sync_report.py)
+SYNC_TIMINGS_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'media', 'cache', 'sync_timings.jsonl'
+)
+
+
+class TimingLog:
+    def __init__(self, path=TIMINGS_PATH):
+        self.path = path
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+    def append(self, record):
+        record = dict(record, time=time.time())
+        # Дописывание строки целиком: журнал читается и во время рендера
+        with open(self.path, 'a') as file:
+            file.write(json.dumps(record) + '\n')
+
+
+def load_timings(path=TIMINGS_PATH):
+    if not os.path.exists(path):
+        return []
+
+    records = []
+    with open(path, 'r') as file:
+        for line in file:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # Строка, оборванная падением процесса
+                continue
+    return records
@@ -0,0 +1,96 @@
+"""
+Время синхронизации сцены и рендера по кадрам.
+
+Обработчики render_pre / render_stats / render_post: синхронизация - от начала
+кадра до первого сообщения Cycles о сэмплах, рендер - от него до конца кадра.
+Сводка по продукту дописывается в media/cache/sync_timings.jsonl. Сравнение
+с persistent data и без: отрендерить те же продукты с RENDER_PERSISTENT_DATA=1
+и =0, затем python -m utils.sync_report
+"""
+import re
+import time
+from statistics import mean, median
+
+import bpy
+from bpy.app.handlers import persistent
+
+SAMPLE_PATTERN = re.compile(r'Sample \d+')
+
+
+class RenderTimings:
+    def __init__(self):
+        self.frames = []
+        self.frame_start = None
+        self.sample_start = None
+
+    def reset(self):
+        self.frames = []
+
+    def on_pre(self):
+        self.frame_start = time.time()
+        self.sample_start = None
+
+    def on_stats(self, stats):
+        if self.frame_start is not None and self.sample_start is None and SAMPLE_PATTERN.search(stats):
+            self.sample_start = time.time()
+
+    def on_post(self):
+        if self.frame_start is None:
+            return
+        end_time = time.time()
+        sample_start = self.sample_start or end_time
+        self.frames.append({'sync': sample_start - self.frame_start, 'render': end_time - sample_start})
+        self.frame_start = None
+
+    def summary(self):
+        if not self.frames:
+            return {'frames': 0}
+
+        sync = [f['sync'] for f in self.frames]
+        render = [f['render'] for f in self.frames]
+        return {
+            'frames': len(self.frames),
+            'persistent_data': bpy.context.scene.render.use_persistent_data,
+            'sync_total': sum(sync),
+            'sync_mean': mean(sync),
+            'sync_median': median(sync),
+            # Первый кадр всегда строит BVH с нуля
+            'sync_mean_warm': mean(sync[1:]) if len(sync) > 1 else sync[0],
+            'render_mean': mean(render),
+        }
+
+    def report(self):
+        summary = self.summary()
+        if not summary['frames']:
+            return
+        print(f"Frames: {summary['frames']}, persistent data: {summary['persistent_data']}, "
+              f"sync mean {summary['sync_mean']:.2f}s (warm {summary['sync_mean_warm']:.2f}s, "
+              f"total {summary['sync_total']:.1f}s), render mean {summary['render_mean']:.2f}s")
+
+
+render_timings = RenderTimings()
+
+
+# persistent - обработчики переживают read_homefile в clear_all()
+@persistent
+def timings_render_pre(*args):
+    render_timings.on_pre()
+
+
+@persistent
+def timings_render_stats(stats, *args):
+    render_timings.on_stats(stats)
+
+
+@persistent
+def timings_render_post(*args):
+    render_timings.on_post()
+
+
+def register():
+    handlers = bpy.app.handlers
+    for handler_list, handler in ((handlers.render_pre, timings_render_pre),
+                                  (handlers.render_stats, timings_render_stats),
+                                  (handlers.render_post, timings_render_post)):
+        if handler not in handler_list:
+            handler_list.append(handler)
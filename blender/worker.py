@@ -0,0 +1,118 @@
+"""
+Долгоживущий процесс Blender для пула рендера.
+
+Запуск: python worker.py -- --port 6100 [--device 0]
+или:    blender -b --python worker.py -- --port 6100
+
+Сцена (create_scene) создается один раз при старте, загруженная модель
+остается в сцене между задачами. Задачи приходят через multiprocessing.connection.
+
+Во время задачи воркер отправляет пулу сообщения {'event': 'progress', ...}
+(utils/progress.py), результат приходит последним сообщением. Команда
+{'command': 'cancel'} проверяется между единицами рендера.
+"""
+import argparse
+import os
+import sys
+import time
+import traceback
+from multiprocessing.connection import Listener
+
+# Воркер не интерактивный - ответы для settings.py
+os.environ.setdefault('RENDER_MAKE', 'y')
+os.environ.setdefault('RENDER_WRITE_ANYWAY', 'n')
+os.environ.setdefault('RENDER_IDS', '')
+
+
+def parse_args():
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else sys.argv[1:]
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, required=True)
+    parser.add_argument('--device', type=int, default=None)
+    return parser.parse_args(argv)
+
+
+args = parse_args()
+if args.device is not None:
+    os.environ['RENDER_DEVICE'] = str(args.device)
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+import bpy
+
+from render_object_parts import fetch_product, render_product
+from settings import render_preset
+from utils.crete_scene import create_scene
+from utils.progress import JobProgress, RenderCancelled
+from utils.timings import render_timings
+
+
+def connection_progress(conn):
+    cancelled = []
+
+    def send(snapshot):
+        conn.send(dict(snapshot, event='progress'))
+
+    def is_cancelled():
+        # Непрочитанные команды пула без ожидания
+        while not cancelled and conn.poll():
+            if conn.recv().get('command') == 'cancel':
+                cancelled.append(True)
+        return bool(cancelled)
+
+    return JobProgress(send, is_cancelled)
+
+
+def handle_job(job, conn):
+    pk = job['product_id']
+    start_time = time.time()
+
+    data = fetch_product(pk)
+    if data is None:
+        return {'status': 'error', 'product_id': pk, 'error': 'Response error'}
+
+    preset = job.get('preset') or render_preset
+    progress = connection_progress(conn)
+    try:
+        units = render_product(data, pk, warm=True, preset=preset, parts=job.get('parts'), progress=progress)
+    except RenderCancelled:
+        return {'status': 'cancelled', 'product_id': pk, 'preset': preset, 'units': progress.frames_done,
+                'time': time.time() - start_time}
+
+    return {'status': 'ok', 'product_id': pk, 'preset': preset, 'units': len(units),
+            'time': time.time() - start_time, 'timings': render_timings.summary()}
+
+
+def serve():
+    authkey = os.environ.get('RENDER_WORKER_KEY', 'render-server').encode()
+
+    bpy.context.scene.render.resolution_percentage = 100
+    create_scene()
+    print(f'Worker ready on {args.host}:{args.port}')
+
+    with Listener((args.host, args.port), authkey=authkey) as listener:
+        while True:
+            with listener.accept() as conn:
+                while True:
+                    try:
+                        job = conn.recv()
+                    except EOFError:
+                        break
+
+                    if job.get('command') == 'stop':
+                        return
+                    if job.get('command') == 'cancel':
+                        # Отмена пришла, когда задача уже закончилась
+                        continue
+
+                    try:
+                        result = handle_job(job, conn)
+                    except Exception:
+                        result = {'status': 'error', 'product_id': job.get('product_id'),
+                                  'error': traceback.format_exc()}
+                    conn.send(result)
+
+
+serve()
@@ -0,0 +1,169 @@
+"""
+Задачи рендера для API: состояние в Redis, прогресс через pub/sub.
+
+Ключи (префикс job:):
+    job:<id>           json задачи (параметры запроса), пишет API
+    job:<id>:products  hash продукт -> json прогресса, пишет celery задача продукта
+    job:<id>:cancel    флаг отмены, ставит API
+    job:<id>:events    канал pub/sub, в него публикуется каждое новое состояние
+
+Продукты одной задачи рендерятся разными воркерами (scheduler.py), состояние
+задачи собирается из прогресса продуктов (job_state). Клиент подписывается на
+/jobs/<id>/events (SSE) и не опрашивает Redis.
+"""
+import json
+import os
+import time
+import uuid
+
+from scheduler import average_cost
+
+REDIS_URL = os.environ.get('JOBS_REDIS_URL', os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0'))
+JOB_TTL = 7 * 24 * 3600
+FINAL_STATUSES = ('done', 'failed', 'cancelled')
+# Статусы результата воркера пула (worker.handle_job)
+PRODUCT_FINAL_STATUSES = ('ok', 'error', 'cancelled')
+
+
+def job_key(job_id):
+    return 'job:%s' % job_id
+
+
+def products_key(job_id):
+    return 'job:%s:products' % job_id
+
+
+def cancel_key(job_id):
+    return 'job:%s:cancel' % job_id
+
+
+def events_channel(job_id):
+    return 'job:%s:events' % job_id
+
+
+def new_job(product_ids, preset=None, parts=None, priority='normal', tenant=None, deadline=None):
+    return {
+        'id': uuid.uuid4().hex,
+        'status': 'queued',
+        'product_ids': product_ids,
+        'preset': preset,
+        'parts': parts or [],
+        'priority': priority,
+        'tenant': tenant,
+        'deadline': deadline,
+        # Кадры и оценка всех продуктов до начала рендера (celery задача plan_job)
+        'plan': {},
+        'created': time.time(),
+    }
+
+
+def job_state(job, products, cancel_requested, default_cost=0.0):
+    """Задача + прогресс продуктов {pk: dict} -> состояние для API;
+    default_cost - оценка продукта без плана (среднее время планировщика)"""
+    started = [products[str(pk)] for pk in job['product_ids'] if str(pk) in products]
+    finished = [p for p in started if p['status'] in PRODUCT_FINAL_STATUSES]
+    running = [p for p in started if p['status'] == 'running']
+
+    if len(finished) == len(job['product_ids']):
+        statuses = {p['status'] for p in finished}
+        status = 'cancelled' if 'cancelled' in statuses else 'failed' if 'error' in statuses else 'done'
+    elif started:
+        status = 'running'
+    else:
+        status = job['status']
+    if cancel_requested and status not in FINAL_STATUSES:
+        # Отмена запрошена, но воркер еще дорендеривает текущий кадр
+        status = 'cancelling'
+
+    # Идущие продукты - по прогрессу воркера, ожидающие - по плану задачи, пока его нет - по среднему
+    plan = job.get('plan') or {}
+    waiting = [str(pk) for pk in job['product_ids'] if str(pk) not in products]
+    eta = sum(p.get('eta') or 0 for p in running) + \
+        sum(plan.get(pk, {}).get('estimated_time', default_cost) for pk in waiting)
+    frames_total = sum(p.get('frames_total', 0) for p in started) + \
+        sum(plan.get(pk, {}).get('units', 0) for pk in waiting)
+
+    return dict(
+        job,
+        status=status,
+        products_done=len(finished),
+        frames_done=sum(p.get('frames_done', 0) for p in started),
+        frames_total=frames_total,
+        current=[p['current'] for p in running if p.get('current')],
+        eta=round(eta, 1) if status not in FINAL_STATUSES else None,
+        results=[p['result'] for p in finished if p.get('result')],
+    )
+
+
+class JobStore:
+    def __init__(self, redis):
+        self.redis = redis
+
+    def save(self, job):
+        self.redis.set(job_key(job['id']), json.dumps(job), ex=JOB_TTL)
+        return self.publish(job['id'])
+
+    def get(self, job_id):
+        data = self.redis.get(job_key(job_id))
+        return json.loads(data) if data else None
+
+    def state(self, job_id):
+        job = self.get(job_id)
+        if job is None:
+            return None
+        products = {k.decode(): json.loads(v) for k, v in self.redis.hgetall(products_key(job_id)).items()}
+        return job_state(job, products, self.is_cancelled(job_id), average_cost(self.redis))
+
+    def set_plan(self, job_id, plan):
+        # job пишет только API при создании, план дописывается один раз
+        job = self.get(job_id)
+        if job is None:
+            return None
+        job['plan'] = plan
+        self.redis.set(job_key(job_id), json.dumps(job), ex=JOB_TTL)
+        return self.publish(job_id)
+
+    def publish(self, job_id):
+        state = self.state(job_id)
+        if state is not None:
+            self.redis.publish(events_channel(job_id), json.dumps(state))
+        return state
+
+    def update_product(self, job_id, product_id, **fields):
+        # Продукт пишет один воркер, чтение-запись без блокировки
+        data = self.redis.hget(products_key(job_id), str(product_id))
+        progress = json.loads(data) if data else {}
+        progress.update(fields, updated=time.time())
+        pipe = self.redis.pipeline()
+        pipe.hset(products_key(job_id), str(product_id), json.dumps(progress))
+        pipe.expire(products_key(job_id), JOB_TTL)
+        pipe.execute()
+        return self.publish(job_id)
+
+    def cancel(self, job_id):
+        self.redis.set(cancel_key(job_id), 1, ex=JOB_TTL)
+        return self.publish(job_id)
+
+    def is_cancelled(self, job_id):
+        return bool(self.redis.exists(cancel_key(job_id)))
+
+
+class ProductReporter:
+    """Прогресс одного продукта задачи по сообщениям воркера пула"""
+
+    def __init__(self, store, job_id, product_id):
+        self.store = store
+        self.job_id = job_id
+        self.product_id = product_id
+
+    def start(self):
+        self.store.update_product(self.job_id, self.product_id, status='running')
+
+    def on_progress(self, message):
+        self.store.update_product(self.job_id, self.product_id, frames_done=message['frames_done'],
+                                  frames_total=message['frames_total'], current=message['current'],
+                                  eta=message['eta'])
+
+    def finish(self, result):
+        self.store.update_product(self.job_id, self.product_id, status=result['status'], result=result,
+                                  current=None, eta=0)
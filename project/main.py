@@ -1,10 +1,27 @@
-from fastapi import FastAPI, Request
+import json
+from datetime import datetime
+from typing import List, Optional
+
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.templating import Jinja2Templates
-from starlette.responses import JSONResponse
+from pydantic import BaseModel
+from redis import Redis
+from redis import asyncio as aioredis
+from starlette.responses import JSONResponse, StreamingResponse
 from starlette.staticfiles import StaticFiles
-from tasks import create_task, celery_app
+from tasks import create_task, plan_job, render_next, celery_app
 from celery.result import AsyncResult
 
+from jobs import REDIS_URL, FINAL_STATUSES, JobStore, cancel_key, events_channel, job_key, job_state, new_job, \
+    products_key
+from pool import render_presets
+from scheduler import DEFAULT_COST, PREFIX as SCHEDULER_PREFIX, PRIORITY_CLASSES, RedisScheduler, job_items
+
+# Комментарий в SSE потоке, чтобы прокси не закрывали соединение
+KEEPALIVE = 15
+# Неизвестный пресет упал бы только в Blender, на каждом продукте задачи
+RENDER_PRESETS = render_presets()
+
 app = FastAPI()
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
@@ -15,9 +32,15 @@ async def root(request: Request):
     return templates.TemplateResponse("dashboard.html", context={"request": request})
 
 
+def check_preset(preset):
+    if preset is not None and preset not in RENDER_PRESETS:
+        raise HTTPException(status_code=400, detail='preset must be one of %s' % ', '.join(RENDER_PRESETS))
+
+
 @app.get("/create_task", status_code=201)
-def run_task(request: Request):
-    task = create_task.delay()
+def run_task(product_id: int, preset: Optional[str] = None):
+    check_preset(preset)
+    task = create_task.delay(product_id, preset)
     return JSONResponse({"task_id": task.id})
 
 
@@ -31,3 +54,107 @@ def read_task(task_id: str):
     }
 
     return response
+
+
+class JobRequest(BaseModel):
+    product_ids: List[int]
+    preset: Optional[str] = None
+    # Фильтр частей по blender_name, пусто - все части
+    parts: List[str] = []
+    # urgent / normal / bulk (scheduler.py)
+    priority: str = 'normal'
+    # Владелец для справедливого разделения воркеров, по умолчанию - сама задача
+    tenant: Optional[str] = None
+    deadline: Optional[datetime] = None
+
+
+jobs = JobStore(Redis.from_url(REDIS_URL))
+scheduler = RedisScheduler(Redis.from_url(REDIS_URL))
+
+
+@app.post("/jobs", status_code=201)
+def create_job(request: JobRequest):
+    if not request.product_ids:
+        raise HTTPException(status_code=400, detail='product_ids is empty')
+    if request.priority not in PRIORITY_CLASSES:
+        raise HTTPException(status_code=400, detail='priority must be one of %s' % ', '.join(PRIORITY_CLASSES))
+    check_preset(request.preset)
+
+    deadline = request.deadline.timestamp() if request.deadline else None
+    job = new_job(request.product_ids, request.preset, request.parts, request.priority, request.tenant, deadline)
+
+    state = jobs.save(job)
+    items = job_items(job)
+    scheduler.submit(items)
+    # Оценка планировщика - в celery: до нее очередь и ETA считают по среднему времени продукта
+    plan_job.delay(job['id'])
+    for _ in items:
+        render_next.delay()
+    return state
+
+
+@app.get("/jobs/{job_id}")
+def read_job(job_id: str):
+    state = jobs.state(job_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail='Job not found')
+    return state
+
+
+@app.post("/jobs/{job_id}/cancel", status_code=202)
+def cancel_job(job_id: str):
+    state = jobs.state(job_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail='Job not found')
+    if state['status'] in FINAL_STATUSES:
+        return state
+
+    jobs.cancel(job_id)
+    # Неначатые продукты снимаются с очереди сразу, идущие останавливает воркер
+    for item in scheduler.remove_job(job_id):
+        jobs.update_product(job_id, item.product_id, status='cancelled')
+    return jobs.state(job_id)
+
+
+@app.get("/scheduler/stats")
+def scheduler_stats():
+    # Ожидание в очереди по классам приоритета, секунды
+    return scheduler.stats()
+
+
+async def job_events(job_id: str):
+    redis = aioredis.Redis.from_url(REDIS_URL)
+    pubsub = redis.pubsub()
+    try:
+        # Подписка до чтения состояния: обновление между ними не потеряется
+        await pubsub.subscribe(events_channel(job_id))
+        data = await redis.get(job_key(job_id))
+        if data is None:
+            return
+        products = {k.decode(): json.loads(v) for k, v in (await redis.hgetall(products_key(job_id))).items()}
+        cost_avg = await redis.get(SCHEDULER_PREFIX + 'cost_avg')
+        job = job_state(json.loads(data), products, await redis.exists(cancel_key(job_id)),
+                        float(cost_avg) if cost_avg is not None else DEFAULT_COST)
+
+        while True:
+            yield 'data: %s\n\n' % json.dumps(job)
+            if job['status'] in FINAL_STATUSES:
+                return
+
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=KEEPALIVE)
+            while message is None:
+                yield ': keepalive\n\n'
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=KEEPALIVE)
+            job = json.loads(message['data'])
+    finally:
+        await pubsub.unsubscribe()
+        await pubsub.close()
+        await redis.close()
+
+
+@app.get("/jobs/{job_id}/events")
+def stream_job(job_id: str):
+    if jobs.get(job_id) is None:
+        raise HTTPException(status_code=404, detail='Job not found')
+    return StreamingResponse(job_events(job_id), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
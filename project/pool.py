@@ -0,0 +1,149 @@
+import importlib.util
+import os
+import queue
+import shlex
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing.connection import Client
+
+BLENDER_ROOT = os.environ.get(
+    'BLENDER_ROOT', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'blender')
+)
+# Команда запуска python с bpy, например "blender -b --python"
+BLENDER_PYTHON = os.environ.get('BLENDER_PYTHON', sys.executable)
+WORKER_KEY = os.environ.get('RENDER_WORKER_KEY', 'render-server')
+BASE_PORT = int(os.environ.get('RENDER_WORKER_PORT', 6100))
+# Как часто проверять отмену задачи, пока воркер рендерит единицу, секунды
+CANCEL_POLL_INTERVAL = 1.0
+
+
+def render_presets():
+    """Имена пресетов качества из blender/utils/presets.py - модуль без bpy, загружается по пути"""
+    spec = importlib.util.spec_from_file_location('render_presets',
+                                                  os.path.join(BLENDER_ROOT, 'utils', 'presets.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return tuple(module.RENDER_PRESETS)
+
+
+def get_worker_devices():
+    # RENDER_DEVICES="0,1" - по воркеру на GPU, иначе RENDER_WORKERS воркеров на все устройства
+    devices = os.environ.get('RENDER_DEVICES')
+    if devices:
+        return [int(d) for d in devices.replace(' ', '').split(',') if d]
+    return [None] * int(os.environ.get('RENDER_WORKERS', 1))
+
+
+class BlenderWorker:
+    def __init__(self, n, port, device=None):
+        self.n = n
+        self.port = port
+        self.device = device
+        self.process = None
+        self.conn = None
+
+    def start(self, timeout=120):
+        command = shlex.split(BLENDER_PYTHON) + [os.path.join(BLENDER_ROOT, 'worker.py'), '--',
+                                                 '--port', str(self.port)]
+        if self.device is not None:
+            command += ['--device', str(self.device)]
+
+        env = dict(os.environ, RENDER_WORKER_KEY=WORKER_KEY)
+        self.process = subprocess.Popen(command, cwd=BLENDER_ROOT, env=env)
+
+        # Ждем пока воркер создаст сцену и начнет слушать порт
+        deadline = time.time() + timeout
+        while True:
+            if self.process.poll() is not None:
+                raise RuntimeError('Worker %d exited with code %d' % (self.n, self.process.returncode))
+            try:
+                self.conn = Client(('127.0.0.1', self.port), authkey=WORKER_KEY.encode())
+                return
+            except ConnectionRefusedError:
+                if time.time() > deadline:
+                    raise RuntimeError('Worker %d did not start in %ds' % (self.n, timeout))
+                time.sleep(0.5)
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def stop(self):
+        if self.conn is not None:
+            try:
+                self.conn.send({'command': 'stop'})
+                self.conn.close()
+            except OSError:
+                pass
+            self.conn = None
+        if self.process is not None:
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+            self.process = None
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+    def run_job(self, job, on_progress=None, is_cancelled=None, poll_interval=CANCEL_POLL_INTERVAL):
+        # До результата воркер присылает прогресс после каждой единицы. Отмена проверяется по
+        # таймеру, а не по прогрессу: команда должна лежать в соединении до начала следующей единицы
+        self.conn.send(job)
+        cancel_sent = False
+        while True:
+            if self.conn.poll(poll_interval):
+                message = self.conn.recv()
+                if message.get('event') != 'progress':
+                    return message
+                if on_progress:
+                    on_progress(message)
+
+            if is_cancelled and not cancel_sent and is_cancelled():
+                self.conn.send({'command': 'cancel'})
+                cancel_sent = True
+
+
+class BlenderPool:
+    def __init__(self, devices=None):
+        self.devices = devices if devices is not None else get_worker_devices()
+        self.workers = []
+        self.idle = queue.Queue()
+        self.lock = threading.Lock()
+        self.started = False
+
+    def start(self):
+        with self.lock:
+            if self.started:
+                return
+            for n, device in enumerate(self.devices):
+                worker = BlenderWorker(n, BASE_PORT + n, device)
+                worker.start()
+                self.workers.append(worker)
+                self.idle.put(worker)
+            self.started = True
+
+    def stop(self):
+        with self.lock:
+            for worker in self.workers:
+                worker.stop()
+            self.workers = []
+            self.idle = queue.Queue()
+            self.started = False
+
+    def render(self, product_id, preset=None, parts=None, on_progress=None, is_cancelled=None):
+        self.start()
+        worker = self.idle.get()
+        try:
+            if not worker.is_alive():
+                worker.restart()
+            return worker.run_job({'product_id': product_id, 'preset': preset, 'parts': parts},
+                                  on_progress, is_cancelled)
+        except (EOFError, OSError):
+            # Blender упал во время рендера - поднимаем воркер заново
+            worker.restart()
+            return {'status': 'error', 'product_id': product_id, 'error': 'Worker %d crashed' % worker.n}
+        finally:
+            self.idle.put(worker)
@@ -0,0 +1,450 @@
+"""
+Очередь рендера с приоритетами и справедливым разделением воркеров.
+
+Задача (/jobs) раскладывается на единицы - по одной на продукт. Каждая
+отправленная единица кладет в celery один токен render_next; какую единицу
+рендерить, решает планировщик в момент, когда воркер свободен. Поэтому
+срочный продукт, отправленный после рендера всего каталога, идет следующим.
+
+Порядок выбора:
+    1. Класс приоритета: urgent, normal, bulk. Единица, ждущая дольше MAX_WAIT
+       своего класса, поднимается на класс выше - bulk не голодает бесконечно.
+    2. Единицы с дедлайном, которые не успеют при ожидании дольше SLACK_MARGIN
+       (deadline - now - cost), - раньше всех в классе, по дедлайну (EDF).
+    3. Справедливое разделение: владелец (tenant, по умолчанию - задача) с
+       наименьшим потраченным временем воркеров. Время списывается по оценке
+       при выдаче и уточняется по факту.
+    4. Внутри владельца - по дедлайну, затем по времени отправки.
+
+cost - оценка планировщика (blender/planner.py), без нее - среднее фактическое
+время продукта. Оценку считает celery задача plan_job после создания задачи,
+не в запросе API.
+
+Выданная единица не удаляется, а переходит в running с арендой RUNNING_TTL,
+которую продлевает рендерящий воркер. Единица упавшего воркера возвращается в
+очередь (reap) с прежним временем отправки. У каждой выдачи свой токен
+(WorkItem.lease): воркер, чью аренду забрал reap, не продлит и не снимет аренду
+нового владельца.
+
+Ключи Redis (префикс sched:): items (hash id -> json единицы), running (hash
+id -> json единицы и срок аренды), usage (hash владелец -> секунды),
+waits:<class> (list последних ожиданий), cost_avg.
+
+Симуляция без Redis и Blender:
+    python scheduler.py simulate --workers 4 --bulk 300 --urgent 40 [--policy fifo]
+"""
+import heapq
+import json
+import random
+import subprocess
+import sys
+import time
+import uuid
+from collections import defaultdict, deque
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+PRIORITY_CLASSES = ('urgent', 'normal', 'bulk')
+MAX_WAIT = {'urgent': None, 'normal': 3600, 'bulk': 6 * 3600}
+SLACK_MARGIN = 60
+DEFAULT_COST = 600.0
+WAITS_KEPT = 1000
+PREFIX = 'sched:'
+# Аренда выданной единицы, продлевается не реже чем раз в RUNNING_TTL / 3
+RUNNING_TTL = 600
+
+
+@dataclass
+class WorkItem:
+    id: str
+    job_id: str
+    product_id: int
+    priority: str = 'normal'
+    tenant: str = ''
+    deadline: Optional[float] = None
+    cost: Optional[float] = None
+    submitted: float = 0.0
+    # Токен аренды в running, пустой у ожидающей единицы
+    lease: str = ''
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def job_items(job):
+    tenant = job.get('tenant') or job['id']
+    plan = job.get('plan') or {}
+    return [WorkItem(id='%s:%d' % (job['id'], pk), job_id=job['id'], product_id=pk,
+                     priority=job.get('priority') or 'normal', tenant=tenant, deadline=job.get('deadline'),
+                     cost=plan.get(str(pk), {}).get('estimated_time'), submitted=job['created'])
+            for pk in job['product_ids']]
+
+
+def average_cost(redis):
+    """Среднее фактическое время продукта - оценка для продуктов без плана"""
+    value = redis.get(PREFIX + 'cost_avg')
+    return float(value) if value is not None else DEFAULT_COST
+
+
+class Scheduler:
+    def __init__(self, slack_margin=SLACK_MARGIN, max_wait=None, default_cost=DEFAULT_COST):
+        self.slack_margin = slack_margin
+        self.max_wait = max_wait or MAX_WAIT
+        self.items = {}
+        self.usage = {}
+        self.waits = defaultdict(lambda: deque(maxlen=WAITS_KEPT))
+        self.cost_avg = default_cost
+
+    def cost(self, item):
+        return item.cost if item.cost is not None else self.cost_avg
+
+    def submit(self, item):
+        active = {i.tenant for i in self.items.values()}
+        if item.tenant not in active:
+            # Простаивавший владелец не копит запас: догоняет минимальный среди активных
+            floor = min((self.usage.get(t, 0.0) for t in active), default=0.0)
+            self.usage[item.tenant] = max(self.usage.get(item.tenant, 0.0), floor)
+        self.items[item.id] = item
+
+    def effective_class(self, item, now):
+        n = PRIORITY_CLASSES.index(item.priority)
+        max_wait = self.max_wait.get(item.priority)
+        if n > 0 and max_wait and now - item.submitted > max_wait:
+            n -= 1
+        return n
+
+    def pick(self, now):
+        if not self.items:
+            return None
+
+        by_class = defaultdict(list)
+        for item in self.items.values():
+            by_class[self.effective_class(item, now)].append(item)
+        candidates = by_class[min(by_class)]
+
+        at_risk = [i for i in candidates
+                   if i.deadline is not None and i.deadline - now - self.cost(i) <= self.slack_margin]
+        if at_risk:
+            return min(at_risk, key=lambda i: (i.deadline, i.submitted))
+
+        tenant = min({i.tenant for i in candidates},
+                     key=lambda t: (self.usage.get(t, 0.0), min(i.submitted for i in candidates if i.tenant == t)))
+        return min((i for i in candidates if i.tenant == tenant),
+                   key=lambda i: (i.deadline if i.deadline is not None else float('inf'), i.submitted))
+
+    def next(self, now=None):
+        now = time.time() if now is None else now
+        item = self.pick(now)
+        if item is None:
+            return None
+
+        del self.items[item.id]
+        self.usage[item.tenant] = self.usage.get(item.tenant, 0.0) + self.cost(item)
+        self.waits[item.priority].append(now - item.submitted)
+        return item
+
+    def release(self, item):
+        # Единица выдана, но не рендерилась: списанная оценка возвращается владельцу
+        self.usage[item.tenant] = max(self.usage.get(item.tenant, 0.0) - self.cost(item), 0.0)
+
+    def requeue(self, item):
+        # Единица упавшего воркера - обратно в очередь с прежним временем отправки
+        self.release(item)
+        self.items[item.id] = item
+
+    def done(self, item, seconds):
+        # Списанная оценка заменяется фактическим временем
+        self.usage[item.tenant] = self.usage.get(item.tenant, 0.0) + seconds - self.cost(item)
+        self.cost_avg = 0.9 * self.cost_avg + 0.1 * seconds
+        if not any(i.tenant == item.tenant for i in self.items.values()):
+            # Владелец без ожидающих единиц больше не участвует в разделении
+            self.usage.pop(item.tenant, None)
+
+    def remove_job(self, job_id):
+        removed = [i for i in self.items.values() if i.job_id == job_id]
+        for item in removed:
+            del self.items[item.id]
+        return removed
+
+    def stats(self, now=None):
+        now = time.time() if now is None else now
+        stats = {}
+        for priority in PRIORITY_CLASSES:
+            waits = list(self.waits[priority])
+            pending = [now - i.submitted for i in self.items.values() if i.priority == priority]
+            stats[priority] = {
+                'pending': len(pending),
+                'oldest_pending': round(max(pending, default=0.0), 1),
+                'started': len(waits),
+                'wait_mean': round(sum(waits) / len(waits), 1) if waits else 0.0,
+                'wait_p50': round(percentile(waits, 50), 1),
+                'wait_p95': round(percentile(waits, 95), 1),
+                'wait_max': round(max(waits, default=0.0), 1),
+            }
+        return stats
+
+
+class RedisScheduler:
+    """Scheduler с состоянием в Redis: API отправляет единицы, celery воркеры выбирают"""
+
+    def __init__(self, redis, **kwargs):
+        self.redis = redis
+        self.kwargs = kwargs
+
+    def key(self, name):
+        return PREFIX + name
+
+    def load(self, waits=False):
+        scheduler = Scheduler(**self.kwargs)
+        for data in self.redis.hvals(self.key('items')):
+            item = WorkItem(**json.loads(data))
+            scheduler.items[item.id] = item
+        scheduler.usage = {k.decode(): float(v) for k, v in self.redis.hgetall(self.key('usage')).items()}
+        cost_avg = self.redis.get(self.key('cost_avg'))
+        if cost_avg is not None:
+            scheduler.cost_avg = float(cost_avg)
+        for priority in PRIORITY_CLASSES if waits else ():
+            scheduler.waits[priority].extend(float(w) for w in self.redis.lrange(self.key('waits:' + priority), 0, -1))
+        return scheduler
+
+    def lock(self):
+        return self.redis.lock(self.key('lock'), timeout=30, blocking_timeout=30)
+
+    def submit(self, items):
+        with self.lock():
+            scheduler = self.load()
+            pipe = self.redis.pipeline()
+            for item in items:
+                scheduler.submit(item)
+                pipe.hset(self.key('items'), item.id, json.dumps(asdict(item)))
+                pipe.hset(self.key('usage'), item.tenant, scheduler.usage[item.tenant])
+            pipe.execute()
+
+    def running_entry(self, item, now):
+        return json.dumps({'item': asdict(item), 'expires': now + RUNNING_TTL})
+
+    def next(self):
+        with self.lock():
+            scheduler = self.load()
+            now = time.time()
+            item = scheduler.next(now)
+            if item is None:
+                return None
+
+            item.lease = uuid.uuid4().hex
+            pipe = self.redis.pipeline()
+            pipe.hdel(self.key('items'), item.id)
+            # Не удаляем, а арендуем: если воркер умрет, reap вернет единицу в очередь
+            pipe.hset(self.key('running'), item.id, self.running_entry(item, now))
+            pipe.hset(self.key('usage'), item.tenant, scheduler.usage[item.tenant])
+            pipe.lpush(self.key('waits:' + item.priority), now - item.submitted)
+            pipe.ltrim(self.key('waits:' + item.priority), 0, WAITS_KEPT - 1)
+            pipe.execute()
+            return item
+
+    def owns(self, item):
+        # Под блокировкой: аренда этой выдачи еще не возвращена в очередь
+        data = self.redis.hget(self.key('running'), item.id)
+        return data is not None and json.loads(data)['item']['lease'] == item.lease
+
+    def renew(self, item):
+        """Продление аренды, False - аренда истекла, единица возвращена в очередь или выдана другому"""
+        with self.lock():
+            if not self.owns(item):
+                return False
+            self.redis.hset(self.key('running'), item.id, self.running_entry(item, time.time()))
+            return True
+
+    def reap(self, now=None):
+        """Возвращает в очередь единицы с истекшей арендой, список возвращенных"""
+        now = time.time() if now is None else now
+        with self.lock():
+            expired = []
+            for data in self.redis.hvals(self.key('running')):
+                entry = json.loads(data)
+                if entry['expires'] < now:
+                    expired.append(WorkItem(**entry['item']))
+            if not expired:
+                return []
+
+            scheduler = self.load()
+            pipe = self.redis.pipeline()
+            for item in expired:
+                item.lease = ''
+                scheduler.requeue(item)
+                pipe.hdel(self.key('running'), item.id)
+                pipe.hset(self.key('items'), item.id, json.dumps(asdict(item)))
+                pipe.hset(self.key('usage'), item.tenant, scheduler.usage[item.tenant])
+            pipe.execute()
+            return expired
+
+    def release(self, item):
+        """Единица выдана, но рендер не начинался (задачу отменили)"""
+        with self.lock():
+            if not self.owns(item):
+                return False
+            scheduler = self.load()
+            scheduler.release(item)
+            pipe = self.redis.pipeline()
+            pipe.hdel(self.key('running'), item.id)
+            pipe.hset(self.key('usage'), item.tenant, scheduler.usage[item.tenant])
+            pipe.execute()
+            return True
+
+    def set_costs(self, job_id, costs):
+        """Оценки plan_job {pk: секунды} для ожидающих единиц задачи"""
+        with self.lock():
+            pipe = self.redis.pipeline()
+            for item in self.load().items.values():
+                if item.job_id == job_id and str(item.product_id) in costs:
+                    item.cost = costs[str(item.product_id)]
+                    pipe.hset(self.key('items'), item.id, json.dumps(asdict(item)))
+            pipe.execute()
+
+    def done(self, item, seconds):
+        """False - аренду забрал reap: время уже списано с нового владельца аренды"""
+        with self.lock():
+            if not self.owns(item):
+                return False
+            scheduler = self.load()
+            scheduler.done(item, seconds)
+            pipe = self.redis.pipeline()
+            pipe.hdel(self.key('running'), item.id)
+            if item.tenant in scheduler.usage:
+                pipe.hset(self.key('usage'), item.tenant, scheduler.usage[item.tenant])
+            else:
+                pipe.hdel(self.key('usage'), item.tenant)
+            pipe.set(self.key('cost_avg'), scheduler.cost_avg)
+            pipe.execute()
+            return True
+
+    def remove_job(self, job_id):
+        with self.lock():
+            removed = self.load().remove_job(job_id)
+            if removed:
+                self.redis.hdel(self.key('items'), *[item.id for item in removed])
+            return removed
+
+    def stats(self):
+        stats = self.load(waits=True).stats()
+        stats['running'] = self.redis.hlen(self.key('running'))
+        return stats
+
+
+def plan_products(product_ids, preset=None, parts=None, timeout=120):
+    """Сводки blender/planner.py {pk: summarize} по продуктам, {} если планировщик недоступен.
+    Планировщик загружает данные продуктов - вызывать из celery, не из запроса API"""
+    from pool import BLENDER_ROOT
+
+    command = [sys.executable, 'planner.py', ','.join(str(pk) for pk in product_ids), '--summary']
+    if preset:
+        command += ['--preset', preset]
+    if parts:
+        command += ['--parts', ','.join(parts)]
+    try:
+        output = subprocess.run(command, cwd=BLENDER_ROOT, capture_output=True, text=True, timeout=timeout)
+        return json.loads(output.stdout.strip().splitlines()[-1])
+    except (subprocess.SubprocessError, OSError, ValueError, IndexError) as e:
+        print('Cost estimate failed:', e)
+        return {}
+
+
+class FifoScheduler(Scheduler):
+    """Прежнее поведение - одна очередь celery, для сравнения в симуляции"""
+
+    def pick(self, now):
+        return min(self.items.values(), key=lambda i: i.submitted, default=None)
+
+
+def simulated_workload(bulk, normal, urgent, horizon, seed):
+    rng = random.Random(seed)
+    cost = lambda: rng.lognormvariate(6.2, 0.5)
+    items = []
+    # Перерендер каталога одной задачей в начале
+    for pk in range(bulk):
+        items.append(WorkItem(id='catalog:%d' % pk, job_id='catalog', product_id=pk, priority='bulk',
+                              tenant='catalog', cost=cost(), submitted=0.0))
+    for n in range(normal):
+        submitted = rng.uniform(0, horizon)
+        tenant = 'tenant_%d' % rng.randint(1, 3)
+        for pk in range(rng.randint(1, 5)):
+            items.append(WorkItem(id='normal_%d:%d' % (n, pk), job_id='normal_%d' % n, product_id=pk,
+                                  tenant=tenant, cost=cost(), submitted=submitted))
+    for n in range(urgent):
+        submitted = rng.uniform(0, horizon)
+        items.append(WorkItem(id='urgent_%d:0' % n, job_id='urgent_%d' % n, product_id=0, priority='urgent',
+                              tenant='urgent_%d' % n, deadline=submitted + 1800, cost=cost(), submitted=submitted))
+    return sorted(items, key=lambda i: i.submitted), rng
+
+
+def simulate(scheduler, workers, items, rng, noise=0.2):
+    """Дискретное событийное моделирование: время рендера - оценка с шумом"""
+    arrivals = deque(items)
+    free = [(0.0, n) for n in range(workers)]
+    misses = defaultdict(int)
+    served = defaultdict(float)
+    finished = 0.0
+
+    while arrivals or scheduler.items:
+        now, worker = heapq.heappop(free)
+        while arrivals and arrivals[0].submitted <= now:
+            scheduler.submit(arrivals.popleft())
+        if not scheduler.items:
+            # Воркер простаивает до следующей отправки
+            heapq.heappush(free, (arrivals[0].submitted, worker))
+            continue
+
+        item = scheduler.next(now)
+        seconds = item.cost * rng.uniform(1 - noise, 1 + noise)
+        scheduler.done(item, seconds)
+        served[item.tenant] += seconds
+        end = now + seconds
+        if item.deadline is not None and end > item.deadline:
+            misses[item.priority] += 1
+        finished = max(finished, end)
+        heapq.heappush(free, (end, worker))
+
+    return scheduler.stats(finished), misses, served, finished
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['simulate', 'stats'])
+    parser.add_argument('--policy', choices=['fair', 'fifo', 'both'], default='both')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--bulk', type=int, default=300)
+    parser.add_argument('--normal', type=int, default=60)
+    parser.add_argument('--urgent', type=int, default=40)
+    parser.add_argument('--horizon', type=float, default=12 * 3600)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    if args.command == 'stats':
+        from redis import Redis
+        from jobs import REDIS_URL
+
+        print(json.dumps(RedisScheduler(Redis.from_url(REDIS_URL)).stats(), indent=2))
+        return
+
+    for policy in (['fair', 'fifo'] if args.policy == 'both' else [args.policy]):
+        items, rng = simulated_workload(args.bulk, args.normal, args.urgent, args.horizon, args.seed)
+        scheduler = Scheduler() if policy == 'fair' else FifoScheduler()
+        stats, misses, served, finished = simulate(scheduler, args.workers, items, rng)
+
+        print(f"[{policy}] {len(items)} products on {args.workers} workers, finished in {finished / 3600:.1f}h")
+        for priority, s in stats.items():
+            print(f"  {priority:7} started {s['started']:4}, wait mean {s['wait_mean'] / 60:6.1f}m, "
+                  f"p50 {s['wait_p50'] / 60:6.1f}m, p95 {s['wait_p95'] / 60:6.1f}m, max {s['wait_max'] / 60:6.1f}m, "
+                  f"deadline misses {misses[priority]}")
+        tenants = sorted(served, key=served.get, reverse=True)[:5]
+        print('  Worker time: ' + ', '.join(f"{t} {served[t] / 3600:.1f}h" for t in tenants))
+
+
+if __name__ == '__main__':
+    main()
@@ -1 +1 @@
-celery -A celery worker --loglevel=info --logfile=logs/celery.log --hostname=localhost
\ No newline at end of file
+celery -A tasks worker --pool=threads --concurrency=${RENDER_WORKERS:-1} --loglevel=info --logfile=logs/celery.log --hostname=localhost
\ No newline at end of file
@@ -1,20 +1,125 @@
+import os
+import time
+
 from celery import Celery
-import bpy
+from celery.signals import worker_shutdown
+
+from redis import Redis
+from redis.exceptions import LockError
+
+from jobs import REDIS_URL, JobStore, ProductReporter
+from pool import BlenderPool
+from scheduler import RUNNING_TTL, RedisScheduler, plan_products
+
+broker_url = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0')
+backend_url = os.environ.get('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
+
+celery_app = Celery('tasks', broker=broker_url, backend=backend_url)
+# Возврат в очередь единиц упавших воркеров; beat запускается вместе с воркером (-B)
+celery_app.conf.beat_schedule = {
+    'reap-running': {'task': 'reap_running', 'schedule': RUNNING_TTL / 3},
+}
 
-celery_app = Celery('tasks', broker='redis://localhost:6379/0', backend='redis://localhost:6379/0')
+# Пул живет в процессе celery воркера (--pool=threads), Blender запускается один раз
+pool = BlenderPool()
+jobs = JobStore(Redis.from_url(REDIS_URL))
+scheduler = RedisScheduler(Redis.from_url(REDIS_URL))
+
+
+@worker_shutdown.connect
+def stop_pool(**kwargs):
+    pool.stop()
 
 
 @celery_app.task(name="create_task")
-def create_task(self):
-    output_path = "/Users/rostislavnikolaev/Desktop/Sites/render-server/image.png"
+def create_task(product_id, preset=None):
+    return pool.render(product_id, preset)
+
+
+@celery_app.task(name="plan_job")
+def plan_job(job_id):
+    # Кадры и оценка всех продуктов задачи для прогресса и ETA, до того как воркеры их возьмут
+    job = jobs.get(job_id)
+    if job is None:
+        return None
+    plan = plan_products(job['product_ids'], job['preset'], job['parts'])
+    jobs.set_plan(job_id, plan)
+    # Оценки нужны очереди для порядка по дедлайну
+    scheduler.set_costs(job_id, {pk: summary['estimated_time'] for pk, summary in plan.items()})
+    return plan
+
+
+@celery_app.task(name="reap_running")
+def reap_running():
+    # Единица вернулась в очередь без токена - кладем новый
+    reaped = scheduler.reap()
+    for _ in reaped:
+        render_next.delay()
+    return len(reaped)
+
+
+class LeaseKeeper:
+    """Продление аренды единицы не чаще раза в RUNNING_TTL / 3 из цикла опроса пула"""
+
+    def __init__(self, item):
+        self.item = item
+        self.renewed = time.time()
+        self.lost = False
+
+    def keep(self):
+        """False - аренду забрал reap, единицу рендерит другой воркер"""
+        if not self.lost and time.time() - self.renewed > RUNNING_TTL / 3:
+            try:
+                self.lost = not scheduler.renew(self.item)
+                self.renewed = time.time()
+            except LockError as e:
+                # Планировщик занят - попробуем на следующем опросе
+                print('Lease renew failed:', e)
+        return not self.lost
+
+
+# acks_late + reject_on_worker_lost: токен упавшего celery воркера вернется в брокер.
+# LockError - планировщик занят дольше blocking_timeout, единица не выдана, пробуем позже
+@celery_app.task(name="render_next", acks_late=True, reject_on_worker_lost=True, autoretry_for=(LockError,),
+                 retry_backoff=True, max_retries=None)
+def render_next():
+    # Токен без привязки к продукту: что рендерить, решает планировщик в момент запуска
+    item = scheduler.next()
+    if item is None:
+        return None
+
+    reporter = ProductReporter(jobs, item.job_id, item.product_id)
+    job = jobs.get(item.job_id)
+    if job is None or jobs.is_cancelled(item.job_id):
+        scheduler.release(item)
+        result = {'status': 'cancelled', 'product_id': item.product_id}
+        reporter.finish(result)
+        return result
+
+    reporter.start()
+    start_time = time.time()
+    lease = LeaseKeeper(item)
+
+    def is_cancelled():
+        # Пул опрашивает отмену раз в секунду, пока идет рендер - заодно продлеваем аренду.
+        # Аренду потеряли - останавливаем рендер, продукт уже у другого воркера
+        return not lease.keep() or jobs.is_cancelled(item.job_id)
 
-    # Set rendering parameters (you can customize these based on your needs)
-    bpy.context.scene.render.resolution_x = 1920  # Width of the image
-    bpy.context.scene.render.resolution_y = 1080  # Height of the image
-    bpy.context.scene.render.image_settings.file_format = 'PNG'  # Output file format
-    bpy.context.scene.render.filepath = output_path  # Set the output path
+    def on_progress(message):
+        if not lease.lost:
+            reporter.on_progress(message)
 
-    # Render the image
-    bpy.ops.render.render(write_still=True)
+    try:
+        result = pool.render(item.product_id, job['preset'], job['parts'], on_progress=on_progress,
+                             is_cancelled=is_cancelled)
+    except Exception as e:
+        result = {'status': 'error', 'product_id': item.product_id, 'error': str(e)}
+    finally:
+        owned = scheduler.done(item, time.time() - start_time)
 
-    return ''
+    if not owned:
+        # Прогресс продукта теперь пишет новый владелец аренды
+        print('Lease of %s lost, result dropped' % item.id)
+        return {'status': 'lease_lost', 'product_id': item.product_id}
+    reporter.finish(result)
+    return result
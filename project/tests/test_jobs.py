@@ -0,0 +1,52 @@
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+from jobs import job_state, new_job
+from pool import BlenderWorker, render_presets
+
+
+def fake_worker(listener, log):
+    # Воркер рендерит единицу без прогресса и ждет команду отмены
+    with listener.accept() as conn:
+        log.append(conn.recv())
+        if conn.poll(5):
+            log.append(conn.recv())
+            conn.send({'status': 'cancelled', 'product_id': 1})
+        else:
+            conn.send({'status': 'ok', 'product_id': 1})
+
+
+def test_cancel_is_forwarded_without_progress_messages():
+    listener = Listener(('127.0.0.1', 0), authkey=b'test')
+    log = []
+    thread = threading.Thread(target=fake_worker, args=(listener, log))
+    thread.start()
+
+    worker = BlenderWorker(0, listener.address[1])
+    worker.conn = Client(listener.address, authkey=b'test')
+    cancel_at = time.time() + 0.3
+    start_time = time.time()
+    result = worker.run_job({'product_id': 1}, is_cancelled=lambda: time.time() > cancel_at, poll_interval=0.05)
+    thread.join()
+    listener.close()
+
+    assert result['status'] == 'cancelled'
+    assert log[1] == {'command': 'cancel'}
+    assert time.time() - start_time < 2
+
+
+def test_job_state_counts_planned_products_not_started_yet():
+    job = new_job([1, 2, 3, 4])
+    job['plan'] = {str(pk): {'units': 10, 'estimated_time': 100.0} for pk in job['product_ids']}
+    products = {'1': {'status': 'running', 'frames_done': 4, 'frames_total': 10, 'eta': 60.0, 'current': 'u'}}
+
+    state = job_state(job, products, False)
+
+    assert state['frames_total'] == 40
+    assert state['frames_done'] == 4
+    assert state['eta'] == 360.0
+
+
+def test_render_presets_come_from_blender_tree():
+    assert set(render_presets()) == {'draft', 'preview', 'final'}
@@ -0,0 +1,165 @@
+import contextlib
+from collections import defaultdict
+
+from scheduler import RUNNING_TTL, RedisScheduler, Scheduler, WorkItem
+
+
+def item(n, priority='normal', tenant='a', deadline=None, cost=100.0, submitted=0.0):
+    return WorkItem(id='job:%d' % n, job_id='job', product_id=n, priority=priority, tenant=tenant,
+                    deadline=deadline, cost=cost, submitted=submitted)
+
+
+def test_higher_class_is_picked_first():
+    scheduler = Scheduler()
+    scheduler.submit(item(1, 'bulk'))
+    scheduler.submit(item(2, 'normal', submitted=10))
+    scheduler.submit(item(3, 'urgent', submitted=20))
+    assert [scheduler.next(now=30).product_id for _ in range(3)] == [3, 2, 1]
+
+
+def test_waiting_bulk_is_promoted_after_max_wait():
+    scheduler = Scheduler(max_wait={'urgent': None, 'normal': 3600, 'bulk': 100})
+    scheduler.submit(item(1, 'bulk', submitted=0))
+    scheduler.submit(item(2, 'normal', submitted=50))
+    # До MAX_WAIT bulk ждет normal, после - соревнуется с ним на равных и отправлен раньше
+    assert scheduler.pick(now=90).product_id == 2
+    assert scheduler.pick(now=150).product_id == 1
+
+
+def test_tenants_share_workers():
+    scheduler = Scheduler()
+    for n in range(4):
+        scheduler.submit(item(n, tenant='catalog', submitted=n))
+    scheduler.submit(item(10, tenant='shop', submitted=10))
+    scheduler.submit(item(11, tenant='shop', submitted=11))
+    tenants = [scheduler.next(now=20).tenant for _ in range(6)]
+    # Владелец с большой задачей не занимает воркеры до конца: очередь чередуется
+    assert tenants[:4] == ['catalog', 'shop', 'catalog', 'shop']
+
+
+def test_deadline_at_risk_goes_first_in_class():
+    scheduler = Scheduler(slack_margin=60)
+    scheduler.submit(item(1, tenant='a', submitted=0))
+    scheduler.submit(item(2, tenant='b', submitted=10, deadline=1000, cost=100))
+    assert scheduler.pick(now=100).product_id == 1
+    # deadline - now - cost <= SLACK_MARGIN
+    assert scheduler.pick(now=850).product_id == 2
+
+
+def test_requeue_refunds_usage_and_keeps_submitted():
+    scheduler = Scheduler()
+    scheduler.submit(item(1, submitted=5, cost=100))
+    taken = scheduler.next(now=10)
+    assert scheduler.usage['a'] == 100
+    scheduler.requeue(taken)
+    assert scheduler.usage['a'] == 0
+    assert scheduler.items['job:1'].submitted == 5
+
+
+class FakeRedis:
+    """Хэши, строки и списки Redis, которые использует RedisScheduler"""
+
+    def __init__(self):
+        self.hashes = defaultdict(dict)
+        self.values = {}
+        self.lists = defaultdict(list)
+
+    def lock(self, name, **kwargs):
+        return contextlib.nullcontext()
+
+    def pipeline(self):
+        return self
+
+    def execute(self):
+        return []
+
+    def hset(self, name, key, value):
+        self.hashes[name][key] = str(value)
+
+    def hdel(self, name, *keys):
+        for key in keys:
+            self.hashes[name].pop(key, None)
+
+    def hvals(self, name):
+        return list(self.hashes[name].values())
+
+    def hgetall(self, name):
+        return {k.encode(): v.encode() for k, v in self.hashes[name].items()}
+
+    def hget(self, name, key):
+        return self.hashes[name].get(key)
+
+    def hlen(self, name):
+        return len(self.hashes[name])
+
+    def get(self, name):
+        return self.values.get(name)
+
+    def set(self, name, value):
+        self.values[name] = str(value)
+
+    def lpush(self, name, value):
+        self.lists[name].insert(0, str(value))
+
+    def ltrim(self, name, start, end):
+        self.lists[name] = self.lists[name][start:end + 1]
+
+    def lrange(self, name, start, end):
+        return self.lists[name][start:None if end == -1 else end + 1]
+
+
+def test_expired_lease_is_requeued():
+    scheduler = RedisScheduler(FakeRedis())
+    scheduler.submit([item(1, cost=100)])
+    taken = scheduler.next()
+    assert scheduler.stats()['running'] == 1
+    assert scheduler.load().items == {}
+
+    assert scheduler.reap() == []
+    reaped = scheduler.reap(now=taken.submitted + RUNNING_TTL * 10 ** 7)
+    assert [i.id for i in reaped] == ['job:1']
+    assert scheduler.renew(taken) is False
+
+    state = scheduler.load()
+    assert list(state.items) == ['job:1']
+    assert state.usage['a'] == 0
+    assert scheduler.next().id == 'job:1'
+
+
+def test_done_clears_lease():
+    scheduler = RedisScheduler(FakeRedis())
+    scheduler.submit([item(1)])
+    taken = scheduler.next()
+    assert scheduler.renew(taken) is True
+    scheduler.done(taken, 50.0)
+    assert scheduler.stats()['running'] == 0
+    assert scheduler.reap(now=float('inf')) == []
+
+
+def test_plan_costs_update_pending_items():
+    scheduler = RedisScheduler(FakeRedis())
+    scheduler.submit([item(1, cost=None), item(2, cost=None)])
+    scheduler.set_costs('job', {'1': 30.0})
+    items = scheduler.load().items
+    assert items['job:1'].cost == 30.0
+    assert items['job:2'].cost is None
+
+
+def test_stale_worker_cannot_touch_new_lease():
+    scheduler = RedisScheduler(FakeRedis())
+    scheduler.submit([item(1, cost=100)])
+    stale = scheduler.next()
+    scheduler.reap(now=float('inf'))
+    owner = scheduler.next()
+    assert owner.lease != stale.lease
+
+    assert scheduler.renew(stale) is False
+    assert scheduler.done(stale, 500.0) is False
+    assert scheduler.release(stale) is False
+    assert scheduler.stats()['running'] == 1
+    # Списано один раз - с нового владельца аренды
+    assert scheduler.load().usage['a'] == 100
+
+    assert scheduler.renew(owner) is True
+    assert scheduler.done(owner, 80.0) is True
+    assert scheduler.stats()['running'] == 0